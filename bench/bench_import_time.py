@@ -0,0 +1,72 @@
+"""Benchmark of the import time of fluidlab packages
+
+Each module is imported in a new interpreter (with `python -X importtime`)
+so that the modules already imported do not hide the cost. The median
+of several runs is printed, with the heavy packages imported by the
+module (for example matplotlib, which should not be imported by
+fluidlab.exp).
+
+Usage::
+
+  python bench/bench_import_time.py [-n NB_RUNS] [module ...]
+
+"""
+
+import argparse
+import subprocess
+import sys
+from statistics import median
+
+modules_default = [
+    "fluidlab",
+    "fluidlab.exp",
+    "fluidlab.instruments",
+    "fluidlab.objects.boards",
+]
+
+heavy_packages = ["matplotlib.pyplot", "h5py", "scipy", "PyDAQmx", "serial"]
+
+
+def measure(module):
+    """Import time (in s) of a module in a new interpreter.
+
+    Returns the time and the list of the heavy packages imported.
+
+    """
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+        check=True,
+    )
+    cumulative = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        try:
+            _, cumul, name = line[len("import time:") :].split("|")
+            cumulative[name.strip()] = int(cumul)
+        except ValueError:
+            # header line
+            continue
+    imported = [name for name in heavy_packages if name in cumulative]
+    return cumulative[module] * 1e-6, imported
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("modules", nargs="*", default=modules_default)
+    parser.add_argument("-n", "--nb-runs", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'module':<28}{'time (ms)':>10}  heavy packages imported")
+    for module in args.modules:
+        results = [measure(module) for _ in range(args.nb_runs)]
+        time = median(result[0] for result in results)
+        imported = ", ".join(results[-1][1]) or "-"
+        print(f"{module:<28}{1000 * time:>10.1f}  {imported}")
+
+
+if __name__ == "__main__":
+    main()
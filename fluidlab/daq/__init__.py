@@ -11,6 +11,10 @@ Provides:
    :toctree:
 
    daqmx
+   simulated_daqmx
+   ringbuffer
+   sinks
+   rawdata
 
 
 """
@@ -4,26 +4,51 @@ DAQmx (National Instruments, :mod:`fluidlab.instruments.daq.daqmx`)
 
 .. todo:: DAQmx interface and drivers (using Comedi API?)...
 
+By default, this module uses PyDAQmx. A simulated backend (without NI
+hardware, see :mod:`fluidlab.daq.simulated_daqmx`) is used if the
+environment variable ``FLUIDLAB_DAQMX_BACKEND`` is set to "simulated" (or
+with ``daqmx_backend = "simulated"`` in a FluidLab user configuration
+file).
+
 Provides:
 
 .. autofunction:: read_analog
 
+.. autofunction:: read_analog_continuous
+
+.. autoclass:: ContinuousAcquisition
+   :members:
+
 .. autofunction:: write_analog
 
 .. autofunction:: write_analog_end_task
 
+.. autofunction:: write_analog_stream
+
+.. autofunction:: write_read_analog
+
+.. autoclass:: AnalogOutputStream
+   :members:
+
+.. autoclass:: OutputUnderflowError
+
+.. autoclass:: StimulusResponse
+   :members:
+
 .. autofunction:: measure_freq
 
 
 """
 
 try:
-    from collections.abc import Iterable
+    from collections.abc import Iterable, Iterator
 except ImportError:
     # For Python < 3.9
-    from collections import Iterable
+    from collections import Iterable, Iterator
 from numbers import Number
+import os
 from platform import platform
+import threading
 import time
 
 import numpy as np
@@ -31,32 +56,81 @@ import numpy as np
 import ctypes
 import six
 
-from PyDAQmx import Task, byref, float64, int32
-
-from PyDAQmx import (
-    DAQmx_Val_Cfg_Default,
-    DAQmx_Val_RSE,
-    DAQmx_Val_NRSE,
-    DAQmx_Val_Diff,
-    DAQmx_Val_Volts,
-    DAQmx_AI_Coupling,
-    DAQmx_Val_DC,
-    DAQmx_Val_AC,
-    DAQmx_Val_GND,
-    DAQmx_Val_Rising,
-    DAQmx_Val_FiniteSamps,
-    DAQmx_Val_GroupByChannel,
-    DAQmx_Val_Hz,
-    DAQmx_Val_LowFreq1Ctr,
-)
+_backend = os.environ.get("FLUIDLAB_DAQMX_BACKEND")
+if _backend is None:
+    from fluidlab.util import userconfig
+
+    _backend = getattr(userconfig, "daqmx_backend", "pydaqmx")
+
+if _backend == "simulated":
+    from fluidlab.daq.simulated_daqmx import (
+        Task,
+        byref,
+        float64,
+        int32,
+        uInt32,
+        uInt64,
+        AttributeNotSupportedInTaskContextError,
+        DAQError,
+        DAQmx_Val_PseudoDiff,
+        DAQmx_Val_Cfg_Default,
+        DAQmx_Val_RSE,
+        DAQmx_Val_NRSE,
+        DAQmx_Val_Diff,
+        DAQmx_Val_Volts,
+        DAQmx_AI_Coupling,
+        DAQmx_Val_DC,
+        DAQmx_Val_AC,
+        DAQmx_Val_GND,
+        DAQmx_Val_Rising,
+        DAQmx_Val_FiniteSamps,
+        DAQmx_Val_ContSamps,
+        DAQmx_Val_GroupByChannel,
+        DAQmx_Val_Hz,
+        DAQmx_Val_LowFreq1Ctr,
+        DAQmx_Val_DoNotAllowRegen,
+    )
+elif _backend == "pydaqmx":
+    from PyDAQmx import Task, byref, float64, int32, uInt32, uInt64
+
+    from PyDAQmx import (
+        DAQmx_Val_Cfg_Default,
+        DAQmx_Val_RSE,
+        DAQmx_Val_NRSE,
+        DAQmx_Val_Diff,
+        DAQmx_Val_Volts,
+        DAQmx_AI_Coupling,
+        DAQmx_Val_DC,
+        DAQmx_Val_AC,
+        DAQmx_Val_GND,
+        DAQmx_Val_Rising,
+        DAQmx_Val_FiniteSamps,
+        DAQmx_Val_ContSamps,
+        DAQmx_Val_GroupByChannel,
+        DAQmx_Val_Hz,
+        DAQmx_Val_LowFreq1Ctr,
+        DAQmx_Val_DoNotAllowRegen,
+    )
+
+    try:
+        from PyDAQmx import DAQmx_Val_PseudoDiff
+    except ImportError:
+        DAQmx_Val_PseudoDiff = None
+        pass
 
-try:
-    from PyDAQmx import DAQmx_Val_PseudoDiff
-except ImportError:
-    DAQmx_Val_PseudoDiff = None
-    pass
+    from PyDAQmx.DAQmxFunctions import (
+        AttributeNotSupportedInTaskContextError,
+        DAQError,
+    )
+else:
+    raise ValueError(
+        "Unknown DAQmx backend (FLUIDLAB_DAQMX_BACKEND or "
+        f"userconfig.daqmx_backend): {_backend}"
+    )
 
-from PyDAQmx.DAQmxFunctions import AttributeNotSupportedInTaskContextError
+from fluidlab.daq.ringbuffer import RingBuffer
+from fluidlab.daq.sinks import H5Sink
+from fluidlab.daq.rawdata import RawAnalogData
 
 _coupling_values = {
     "DC": DAQmx_Val_DC,
@@ -82,67 +156,8 @@ def _parse_resource_names(resource_names):
     return resource_names, nb_resources
 
 
-def read_analog(
-    resource_names,
-    terminal_config,
-    volt_min,
-    volt_max,
-    samples_per_chan=1,
-    sample_rate=1,
-    coupling_types="DC",
-    output_filename=None,
-    verbose=False,
-):
-    """Read from the analog input subdevice.
-
-    Parameters
-    ----------
-
-    resource_names: {str or iterable of str}
-
-      Analogic input identifier(s), e.g. 'Dev1/ai0'.
-
-    terminal_config: {'Diff', 'PseudoDiff', 'RSE', 'NRSE'}
-
-      A type of configuration (apply to all terminals).
-
-    volt_min : {number or iterable of numbers}
-
-      Minima for the channels.
-
-    volt_max : {number or iterable of numbers}
-
-      Maxima for the channels.
-
-    samples_per_chan: number
-
-      Number of samples per channel to read.
-
-    sample_rate: number
-
-      Sample rate for all channels (Hz).
-
-    coupling_types : {'DC', 'AC', 'GND', list of str}
-
-      Type of coupling for each resource.
-
-    output_filename: {None, str}
-
-      If specified data is output into this file instead of output
-      arrays.
-
-    verbose: {False, boolean}
-
-      If True, print more verbose message
-
-    """
-    if output_filename is not None:
-        raise NotImplementedError()
-
-    # prepare resource_names
-    resource_names, nb_resources = _parse_resource_names(resource_names)
+def _parse_terminal_config(terminal_config, verbose=False):
 
-    # prepare terminal_config
     if terminal_config is None:
         if verbose:
             print("DAQmx: Default terminal configuration will be used.")
@@ -166,7 +181,11 @@ def read_analog(
     else:
         raise ValueError("DAQmx: Unrecognized terminal mode")
 
-    # prepare volt_min, volt_max
+    return terminal_config
+
+
+def _parse_volt_range(volt_min, volt_max, nb_resources):
+
     if not isinstance(volt_min, Number) and len(volt_min) != nb_resources:
         raise ValueError(
             "volt_min has to be a number or an iterable of the same length "
@@ -184,9 +203,27 @@ def read_analog(
     if isinstance(volt_max, Number):
         volt_max = [volt_max] * nb_resources
 
-    # check samples_per_chan
-    if not isinstance(samples_per_chan, int) or samples_per_chan <= 0:
-        raise ValueError("samples_per_chan has to be a positive integer.")
+    return volt_min, volt_max
+
+
+def _create_ai_task(
+    resource_names,
+    terminal_config,
+    volt_min,
+    volt_max,
+    coupling_types="DC",
+    verbose=False,
+):
+    """Create a task with analog input voltage channels."""
+
+    # prepare resource_names
+    resource_names, nb_resources = _parse_resource_names(resource_names)
+
+    # prepare terminal_config
+    terminal_config = _parse_terminal_config(terminal_config, verbose)
+
+    # prepare volt_min, volt_max
+    volt_min, volt_max = _parse_volt_range(volt_min, volt_max, nb_resources)
 
     # prepare coupling_types
     if not isinstance(coupling_types, str) and len(coupling_types) != nb_resources:
@@ -271,23 +308,154 @@ def read_analog(
         except AttributeNotSupportedInTaskContextError:
             print("Coupling attribute not supported on this device")
 
+    return task, resource_names, nb_resources
+
+
+def _get_scaling_coeffs(task, resource_names, nb_coeffs=4):
+    """Get the polynomial coefficients converting raw samples to volts."""
+    coeffs = np.zeros((len(resource_names), nb_coeffs), dtype=np.float64)
+    for ir, resource in enumerate(resource_names):
+        task.GetAIDevScalingCoeff(resource, coeffs[ir], nb_coeffs)
+    return coeffs
+
+
+def _print_clock_timing(samples_per_chan, sample_rate, source="OnboardClock"):
+    verbose_text = "DAQmx: Configure clock timing ("
+    if samples_per_chan is None:
+        verbose_text += "continuous @ "
+    elif samples_per_chan < 1000:
+        verbose_text += str(samples_per_chan) + " samp/chan @ "
+    elif samples_per_chan < 1_000_000:
+        verbose_text += str(samples_per_chan / 1000) + " kSamp/chan @ "
+    else:
+        verbose_text += str(samples_per_chan / 1_000_000) + " MSamp/chan @ "
+    if sample_rate < 1000:
+        verbose_text += "%.2f Hz using %s)" % (sample_rate, source)
+    elif sample_rate < 1_000_000:
+        verbose_text += "%.2f kHz using %s)" % (sample_rate / 1000.0, source)
+    else:
+        verbose_text += "%.2f MHz using %s)" % (sample_rate / 1e6, source)
+    print(verbose_text)
+
+
+def _print_start(action, samples_per_chan, sample_rate):
+    if platform().startswith("Windows"):
+        dateformat = "%A %d %B %Y - %X (%z)"
+    else:
+        dateformat = "%A %e %B %Y - %H:%M:%S (UTC%z)"
+    starttime = time.time()
+    starttime_str = time.strftime(dateformat, time.localtime(starttime))
+    print("DAQmx: Starting " + action + ": " + starttime_str)
+    if samples_per_chan is None:
+        return
+    endtime = starttime + samples_per_chan / sample_rate
+    endtime_str = time.strftime(dateformat, time.localtime(endtime))
+    print(
+        "       Expected duration: %.2f min"
+        % (samples_per_chan / (60.0 * sample_rate))
+    )
+    print("       Expected end time: " + endtime_str)
+
+
+def read_analog(
+    resource_names,
+    terminal_config,
+    volt_min,
+    volt_max,
+    samples_per_chan=1,
+    sample_rate=1,
+    coupling_types="DC",
+    output_filename=None,
+    raw=False,
+    verbose=False,
+):
+    """Read from the analog input subdevice.
+
+    Parameters
+    ----------
+
+    resource_names: {str or iterable of str}
+
+      Analogic input identifier(s), e.g. 'Dev1/ai0'.
+
+    terminal_config: {'Diff', 'PseudoDiff', 'RSE', 'NRSE'}
+
+      A type of configuration (apply to all terminals).
+
+    volt_min : {number or iterable of numbers}
+
+      Minima for the channels.
+
+    volt_max : {number or iterable of numbers}
+
+      Maxima for the channels.
+
+    samples_per_chan: number
+
+      Number of samples per channel to read.
+
+    sample_rate: number
+
+      Sample rate for all channels (Hz).
+
+    coupling_types : {'DC', 'AC', 'GND', list of str}
+
+      Type of coupling for each resource.
+
+    output_filename: {None, str}
+
+      If specified data is output into this file (HDF5, dataset
+      "data") instead of output arrays. The data is then streamed to
+      the file by chunks (see :func:`read_analog_continuous`) so that
+      long acquisitions do not have to fit in memory.
+
+    raw: {False, boolean}
+
+      If True, the native 16-bit samples are read (``ReadBinaryI16``)
+      and a :class:`fluidlab.daq.rawdata.RawAnalogData` is returned,
+      which stores the device scaling coefficients and converts to volts
+      on access. With `output_filename`, the file contains the int16
+      data and the attribute "scaling_coeffs" (see
+      :func:`fluidlab.daq.rawdata.load_raw_h5`).
+
+    verbose: {False, boolean}
+
+      If True, print more verbose message
+
+    """
+    # check samples_per_chan
+    if not isinstance(samples_per_chan, int) or samples_per_chan <= 0:
+        raise ValueError("samples_per_chan has to be a positive integer.")
+
+    if output_filename is not None:
+        acquisition = read_analog_continuous(
+            resource_names,
+            terminal_config,
+            volt_min,
+            volt_max,
+            sample_rate=sample_rate,
+            coupling_types=coupling_types,
+            output_filename=output_filename,
+            nb_samples_max=samples_per_chan,
+            raw=raw,
+            verbose=verbose,
+        )
+        acquisition.wait()
+        return
+
+    task, resource_names, nb_resources = _create_ai_task(
+        resource_names,
+        terminal_config,
+        volt_min,
+        volt_max,
+        coupling_types,
+        verbose,
+    )
+
     # configure clock and DMA input buffer
     if samples_per_chan > 1:
-        verbose_text = "DAQmx: Configure clock timing ("
         if verbose:
-            if samples_per_chan < 1000:
-                verbose_text += str(samples_per_chan) + " samp/chan @ "
-            elif samples_per_chan < 1_000_000:
-                verbose_text += str(samples_per_chan / 1000) + " kSamp/chan @ "
-            else:
-                verbose_text += str(samples_per_chan / 1_000_000) + " MSamp/chan @ "
-            if sample_rate < 1000:
-                verbose_text += "%.2f Hz using OnboardClock)" % sample_rate
-            elif sample_rate < 1_000_000:
-                verbose_text += "%.2f kHz using OnboardClock)" % (sample_rate / 1000.0)
-            else:
-                verbose_text += "%.2f MHz using OnboardClock)" % (sample_rate / 1e6)
-            print(verbose_text)
+            _print_clock_timing(samples_per_chan, sample_rate)
         task.CfgSampClkTiming(
             "OnboardClock",
             sample_rate,
@@ -301,20 +469,7 @@ def read_analog(
 
     # start task
     if verbose:
-        if platform().startswith("Windows"):
-            dateformat = "%A %d %B %Y - %X (%z)"
-        else:
-            dateformat = "%A %e %B %Y - %H:%M:%S (UTC%z)"
-        starttime = time.time()
-        starttime_str = time.strftime(dateformat, time.localtime(starttime))
-        endtime = starttime + samples_per_chan / sample_rate
-        endtime_str = time.strftime(dateformat, time.localtime(endtime))
-        print("DAQmx: Starting acquisition: " + starttime_str)
-        print(
-            "       Expected duration: %.2f min"
-            % (samples_per_chan / (60.0 * sample_rate))
-        )
-        print("       Expected end time: " + endtime_str)
+        _print_start("acquisition", samples_per_chan, sample_rate)
 
     task.StartTask()
 
@@ -322,9 +477,14 @@ def read_analog(
     # why 10?
     timeout = float(10 * samples_per_chan / sample_rate)
     buffer_size_in_samps = int(samples_per_chan * nb_resources)
-    data = np.zeros((buffer_size_in_samps,), dtype=np.float64)
     samples_per_chan_read = int32()
-    task.ReadAnalogF64(
+    if raw:
+        data = np.zeros((buffer_size_in_samps,), dtype=np.int16)
+        read_function = task.ReadBinaryI16
+    else:
+        data = np.zeros((buffer_size_in_samps,), dtype=np.float64)
+        read_function = task.ReadAnalogF64
+    read_function(
         samples_per_chan,
         timeout,
         DAQmx_Val_GroupByChannel,
@@ -337,7 +497,631 @@ def read_analog(
     if verbose:
         print("DAQmx: %d samples read." % samples_per_chan_read.value)
 
-    return data.reshape([nb_resources, samples_per_chan])
+    data = data.reshape([nb_resources, samples_per_chan])
+
+    if raw:
+        coeffs = _get_scaling_coeffs(task, resource_names)
+        return RawAnalogData(data, coeffs, sample_rate)
+
+    return data
+
+
+class ContinuousAcquisition:
+    """Continuous acquisition on analog inputs (``DAQmx_Val_ContSamps``)
+
+    A reader thread reads the samples by chunks from the DAQmx buffer
+    and pushes them in a preallocated
+    :class:`fluidlab.daq.ringbuffer.RingBuffer`, which forwards them
+    to its sinks (see :mod:`fluidlab.daq.sinks`). The memory used does
+    not grow with the duration of the acquisition.
+
+    Do not instantiate this class directly but use
+    :func:`read_analog_continuous`.
+
+    """
+
+    def __init__(
+        self,
+        task,
+        nb_resources,
+        sample_rate,
+        samples_per_read,
+        ring_buffer,
+        nb_samples_max=None,
+        scaling_coeffs=None,
+    ):
+        self.task = task
+        self.nb_resources = nb_resources
+        self.sample_rate = sample_rate
+        self.samples_per_read = samples_per_read
+        self.ring_buffer = ring_buffer
+        self.nb_samples_max = nb_samples_max
+        self.scaling_coeffs = scaling_coeffs
+        self.nb_samples_read = 0
+        self.error = None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def add_sink(self, sink):
+        """Attach a sink to the ring buffer (see :mod:`fluidlab.daq.sinks`)."""
+        self.ring_buffer.add_sink(sink)
+
+    def start(self):
+        """Start the task and the reader thread."""
+        self.task.StartTask()
+        self._thread = threading.Thread(target=self._read_loop, daemon=True)
+        self._thread.start()
+
+    def _read_loop(self):
+        nb_resources = self.nb_resources
+        chunk = np.zeros(
+            nb_resources * self.samples_per_read, dtype=self.ring_buffer.dtype
+        )
+        samples_per_chan_read = int32()
+        timeout = float(10 * self.samples_per_read / self.sample_rate)
+        try:
+            while not self._stop_event.is_set():
+                nb_to_read = self.samples_per_read
+                if self.nb_samples_max is not None:
+                    nb_to_read = min(
+                        nb_to_read, self.nb_samples_max - self.nb_samples_read
+                    )
+                    if nb_to_read <= 0:
+                        break
+                self._read_chunk(
+                    nb_to_read, timeout, chunk, byref(samples_per_chan_read)
+                )
+                nb_read = samples_per_chan_read.value
+                self.ring_buffer.push(
+                    chunk[: nb_resources * nb_read].reshape(nb_resources, nb_read)
+                )
+                self.nb_samples_read += nb_read
+        except Exception as error:
+            self.error = error
+        finally:
+            self.task.StopTask()
+            self.task.ClearTask()
+            self.ring_buffer.close()
+
+    def _read_chunk(self, nb_samples, timeout, chunk, samples_per_chan_read):
+        if self.scaling_coeffs is not None:
+            read_function = self.task.ReadBinaryI16
+        else:
+            read_function = self.task.ReadAnalogF64
+        read_function(
+            nb_samples,
+            timeout,
+            DAQmx_Val_GroupByChannel,
+            chunk,
+            chunk.size,
+            samples_per_chan_read,
+            None,
+        )
+
+    def wait(self, timeout=None):
+        """Wait for the end of the acquisition (if `nb_samples_max` is set)."""
+        self._thread.join(timeout)
+        self._raise_if_error()
+
+    def stop(self):
+        """Stop the acquisition, the task and close the sinks."""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._raise_if_error()
+
+    def _raise_if_error(self):
+        if self.error is not None:
+            error = self.error
+            self.error = None
+            raise error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+def read_analog_continuous(
+    resource_names,
+    terminal_config,
+    volt_min,
+    volt_max,
+    sample_rate=1,
+    coupling_types="DC",
+    samples_per_read=None,
+    buffer_duration=10.0,
+    output_filename=None,
+    sinks=None,
+    nb_samples_max=None,
+    raw=False,
+    start=True,
+    verbose=False,
+):
+    """Continuously read from the analog input subdevice.
+
+    The parameters `resource_names`, `terminal_config`, `volt_min`,
+    `volt_max`, `sample_rate` and `coupling_types` are as for
+    :func:`read_analog`.
+
+    Parameters
+    ----------
+
+    samples_per_read : {None, int}
+
+      Number of samples per channel read by chunk (default: 0.1 s of
+      signal).
+
+    buffer_duration : number
+
+      Duration (in s) of the signal kept in the ring buffer.
+
+    output_filename : {None, str}
+
+      If specified, the data is streamed into this HDF5 file (dataset
+      "data").
+
+    sinks : {None, list}
+
+      Sinks attached to the ring buffer (see :mod:`fluidlab.daq.sinks`).
+
+    nb_samples_max : {None, int}
+
+      If specified, the acquisition stops after this number of samples
+      per channel.
+
+    raw : {False, bool}
+
+      If True, the native 16-bit samples are read (``ReadBinaryI16``).
+      The ring buffer and the HDF5 file then contain int16 data and the
+      scaling coefficients are available as
+      ``acquisition.scaling_coeffs`` (and as the attribute
+      "scaling_coeffs" in the file). See :mod:`fluidlab.daq.rawdata`.
+
+    start : {True, bool}
+
+      If True, the acquisition is started.
+
+    Returns
+    -------
+
+    acquisition : :class:`ContinuousAcquisition`
+
+      Use ``acquisition.stop()`` (or a ``with`` statement) to end the
+      acquisition and ``acquisition.ring_buffer`` to get the last
+      samples.
+
+    """
+    task, resource_names, nb_resources = _create_ai_task(
+        resource_names,
+        terminal_config,
+        volt_min,
+        volt_max,
+        coupling_types,
+        verbose,
+    )
+
+    if samples_per_read is None:
+        samples_per_read = max(1, int(sample_rate / 10))
+
+    if verbose:
+        _print_clock_timing(nb_samples_max, sample_rate)
+    # the last argument is used to compute the size of the DAQmx buffer
+    task.CfgSampClkTiming(
+        "OnboardClock",
+        sample_rate,
+        DAQmx_Val_Rising,
+        DAQmx_Val_ContSamps,
+        max(10 * samples_per_read, int(sample_rate)),
+    )
+
+    if raw:
+        dtype = np.int16
+        scaling_coeffs = _get_scaling_coeffs(task, resource_names)
+    else:
+        dtype = np.float64
+        scaling_coeffs = None
+
+    ring_buffer = RingBuffer(
+        nb_resources,
+        max(samples_per_read, int(buffer_duration * sample_rate)),
+        dtype=dtype,
+    )
+
+    if output_filename is not None:
+        attrs = {
+            "sample_rate": sample_rate,
+            "resource_names": [r.decode() for r in resource_names],
+        }
+        if raw:
+            attrs["scaling_coeffs"] = scaling_coeffs
+        ring_buffer.add_sink(
+            H5Sink(output_filename, nb_resources, dtype=dtype, attrs=attrs)
+        )
+
+    if sinks is not None:
+        for sink in sinks:
+            ring_buffer.add_sink(sink)
+
+    acquisition = ContinuousAcquisition(
+        task,
+        nb_resources,
+        sample_rate,
+        samples_per_read,
+        ring_buffer,
+        nb_samples_max,
+        scaling_coeffs,
+    )
+
+    if start:
+        if verbose:
+            _print_start("continuous acquisition", nb_samples_max, sample_rate)
+        acquisition.start()
+
+    return acquisition
+
+
+def _create_ao_task(resource_names, volt_min, volt_max, verbose=False):
+    """Create a task with analog output voltage channels."""
+
+    # prepare resource_names
+    resource_names, nb_resources = _parse_resource_names(resource_names)
+
+    # prepare volt_min, volt_max
+    volt_min, volt_max = _parse_volt_range(volt_min, volt_max, nb_resources)
+
+    # create task
+    if verbose:
+        print("DAQmx: Create Task")
+
+    task = Task()
+
+    # create AO channels
+    for ir, resource in enumerate(resource_names):
+        if verbose:
+            print(
+                "DAQmx: Create A0 Voltage Chan ("
+                + str(resource)
+                + " ["
+                + str(volt_min[ir])
+                + "V;"
+                + str(volt_max[ir])
+                + "V])"
+            )
+        task.CreateAOVoltageChan(
+            resource, "", volt_min[ir], volt_max[ir], DAQmx_Val_Volts, None
+        )
+
+    return task, resource_names, nb_resources
+
+
+def _iter_chunks(signals, samples_per_write):
+    for start in range(0, signals.shape[1], samples_per_write):
+        yield signals[:, start : start + samples_per_write]
+
+
+# DAQmx error codes meaning that the output buffer has been emptied
+_underflow_error_codes = {
+    -200290,  # generation stopped to prevent the regeneration of old samples
+    -200621,  # onboard memory underflow
+    -200018,  # DAC conversion attempted before data was available
+    -200016,  # onboard memory underflow
+}
+
+
+class OutputUnderflowError(RuntimeError):
+    """Raised when a non-regenerative output has run out of samples."""
+
+
+class AnalogOutputStream:
+    """Non-regenerative analog output fed by chunks
+
+    The first chunks are written in the task buffer before the start of
+    the task and a writer thread then writes the next chunks as soon as
+    there is space in the buffer. The signals can therefore be longer
+    than the device and host buffers and can be generated on the fly.
+
+    The number of samples still in the buffer is checked after each
+    write (attribute `min_buffer_level`). If the buffer has been emptied
+    (underflow), `underflow` is set to True, the generation is stopped
+    and :class:`OutputUnderflowError` is raised by :func:`wait` or
+    :func:`stop`.
+
+    Parameters
+    ----------
+
+    task : PyDAQmx.Task
+
+      A task with AO channels and its timing already configured.
+
+    nb_resources : int
+
+    sample_rate : number
+
+    chunks : iterable
+
+      Iterable (e.g. a generator) of arrays of shape (nb_resources,
+      nb_samples).
+
+    buffer_size : int
+
+      Size (samples per channel) of the task buffer.
+
+    low_level_warning : {None, int}
+
+      A warning is printed when the number of samples in the buffer after
+      a write is smaller than this value (default: buffer_size // 10).
+
+    """
+
+    def __init__(
+        self,
+        task,
+        nb_resources,
+        sample_rate,
+        chunks,
+        buffer_size,
+        low_level_warning=None,
+    ):
+        self.task = task
+        self.nb_resources = nb_resources
+        self.sample_rate = sample_rate
+        self.buffer_size = buffer_size
+        if low_level_warning is None:
+            low_level_warning = buffer_size // 10
+        self.low_level_warning = low_level_warning
+        self._chunks = iter(chunks)
+        self._pending_chunk = None
+        self.nb_samples_written = 0
+        self.min_buffer_level = None
+        self.underflow = False
+        self.error = None
+        self.done = threading.Event()
+        self._started = False
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        task.SetWriteRegenMode(DAQmx_Val_DoNotAllowRegen)
+        task.CfgOutputBuffer(buffer_size)
+
+    def _as_2d_array(self, chunk):
+        chunk = np.ascontiguousarray(chunk, dtype=np.float64)
+        if chunk.ndim == 1:
+            chunk = chunk.reshape(self.nb_resources, -1)
+        return chunk
+
+    def _write(self, chunk):
+        nb_samples = chunk.shape[1]
+        if nb_samples == 0:
+            return
+        written = int32()
+        # timeout: the time needed to free the space for the chunk
+        timeout = 10.0 + 2 * nb_samples / self.sample_rate
+        try:
+            self.task.WriteAnalogF64(
+                nb_samples,
+                0,
+                timeout,
+                DAQmx_Val_GroupByChannel,
+                chunk.ravel(),
+                byref(written),
+                None,
+            )
+        except DAQError as error:
+            if error.error in _underflow_error_codes:
+                self._signal_underflow()
+            raise
+        self.nb_samples_written += written.value
+        if self._started:
+            self._check_buffer_level()
+
+    def _check_buffer_level(self):
+        space_avail = uInt32()
+        self.task.GetWriteSpaceAvail(byref(space_avail))
+        level = self.buffer_size - space_avail.value
+        if self.min_buffer_level is None or level < self.min_buffer_level:
+            self.min_buffer_level = level
+        if level <= 0:
+            self._signal_underflow()
+            raise OutputUnderflowError(
+                "DAQmx: output buffer empty after "
+                f"{self.nb_samples_written} samples (underflow)"
+            )
+        if level < self.low_level_warning:
+            print(
+                f"DAQmx: Warning: only {level} samples in the output buffer "
+                f"({level / self.sample_rate:.3f} s)"
+            )
+
+    def _signal_underflow(self):
+        self.underflow = True
+
+    def prefill(self):
+        """Write the first chunks in the buffer (before starting the task)."""
+        while self.nb_samples_written < self.buffer_size:
+            try:
+                chunk = self._as_2d_array(next(self._chunks))
+            except StopIteration:
+                self.done.set()
+                return
+            if (
+                self.nb_samples_written > 0
+                and self.nb_samples_written + chunk.shape[1] > self.buffer_size
+            ):
+                # written by the writer thread when there is space
+                self._pending_chunk = chunk
+                return
+            self._write(chunk)
+
+    def start(self):
+        """Prefill the buffer, start the task and the writer thread."""
+        self.prefill()
+        self.task.StartTask()
+        self.start_writing()
+
+    def start_writing(self):
+        """Start the writer thread (the task has to be started)."""
+        self._started = True
+        self._thread = threading.Thread(target=self._write_loop, daemon=True)
+        self._thread.start()
+
+    def _write_loop(self):
+        try:
+            if self._pending_chunk is not None:
+                self._write(self._pending_chunk)
+                self._pending_chunk = None
+            if not self.done.is_set():
+                for chunk in self._chunks:
+                    if self._stop_event.is_set():
+                        break
+                    self._write(self._as_2d_array(chunk))
+        except Exception as error:
+            self.error = error
+        finally:
+            self.done.set()
+
+    def wait(self, timeout=None):
+        """Wait until all chunks are written in the buffer."""
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._raise_if_error()
+
+    def wait_until_generated(self, timeout=None):
+        """Wait until all samples written in the buffer are generated."""
+        self.wait(timeout)
+        if timeout is not None:
+            time_end = time.time() + timeout
+        generated = uInt64()
+        while True:
+            self.task.GetWriteTotalSampPerChanGenerated(byref(generated))
+            nb_remaining = self.nb_samples_written - generated.value
+            if nb_remaining <= 0:
+                break
+            if timeout is not None and time.time() > time_end:
+                break
+            time.sleep(min(0.1, max(nb_remaining / self.sample_rate, 0.001)))
+
+    def stop(self):
+        """Stop the writer thread."""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._raise_if_error()
+
+    def close(self):
+        """Stop the writer thread and clear the task."""
+        try:
+            self.stop()
+        finally:
+            if self.task is not None:
+                self.task.StopTask()
+                self.task.ClearTask()
+                self.task = None
+
+    def _raise_if_error(self):
+        if self.error is not None:
+            error = self.error
+            self.error = None
+            raise error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def write_analog_stream(
+    resource_names,
+    chunks,
+    sample_rate=1,
+    volt_min=-10.0,
+    volt_max=10.0,
+    buffer_size=None,
+    blocking=True,
+    verbose=False,
+):
+    """Write analogic output from an iterable of chunks (streaming mode)
+
+    The output is non-regenerative: a background thread writes the
+    chunks in the task buffer as soon as there is space, so that the
+    signal length is not limited by the buffer size and the signal does
+    not have to be in memory (it can be generated on the fly by a
+    generator). Underflows are detected and reported (see
+    :class:`AnalogOutputStream`).
+
+    Parameters
+    ----------
+
+    resource_names:
+
+      Analogic output identifier(s), e.g. 'Dev1/ao0'.
+
+    chunks: iterable
+
+      Iterable (e.g. a generator) of arrays of shape (nb_channels,
+      nb_samples) (or (nb_samples,) for one channel).
+
+    sample_rate: number
+
+      Frequency rate for all channels (Hz).
+
+    volt_min, volt_max: {number or iterable of numbers}
+
+      Minima and maxima for the channels.
+
+    buffer_size: {None, int}
+
+      Size (samples per channel) of the output buffer (default: 1 s of
+      signal).
+
+    blocking: bool
+
+      If True, wait until all samples are generated. If False, the
+      :class:`AnalogOutputStream` is returned (use its method `close`
+      to stop the generation).
+
+    """
+    if buffer_size is None:
+        buffer_size = max(2, int(sample_rate))
+
+    task, resource_names, nb_resources = _create_ao_task(
+        resource_names, volt_min, volt_max, verbose
+    )
+
+    if verbose:
+        _print_clock_timing(None, sample_rate)
+    task.CfgSampClkTiming(
+        "OnboardClock",
+        sample_rate,
+        DAQmx_Val_Rising,
+        DAQmx_Val_ContSamps,
+        buffer_size,
+    )
+
+    stream = AnalogOutputStream(
+        task, nb_resources, sample_rate, chunks, buffer_size
+    )
+
+    if verbose:
+        _print_start("streamed write Task", None, sample_rate)
+
+    stream.start()
+
+    if not blocking:
+        return stream
+
+    try:
+        stream.wait_until_generated()
+    finally:
+        stream.close()
+
+    if verbose:
+        print(
+            "DAQmx: %d samples written (min buffer level: %s samples)"
+            % (stream.nb_samples_written, stream.min_buffer_level)
+        )
 
 
 def write_analog(
@@ -370,38 +1154,33 @@ def write_analog(
 
         Maxima for the channels
 
-    signals: numpy.ndarray or simple scalar
+    signals: numpy.ndarray, simple scalar or iterator
 
-      The signal(s) to be output.
+      The signal(s) to be output. If it is an iterator (e.g. a generator)
+      of chunks, the signal is streamed with
+      :func:`write_analog_stream`.
 
     blocking: bool
 
       Specifies whether to wait until the task is done before
       returning. If blocking=false, then a task object is
       returned. To stop the task, use the :func:`write_analog_end_task` function.
+      If `signals` is an iterator, an :class:`AnalogOutputStream` is
+      returned instead (it can also be stopped with
+      :func:`write_analog_end_task`).
 
     """
-    # prepare resource_names
-    resource_names, nb_resources = _parse_resource_names(resource_names)
-
-    # prepare volt_min, volt_max
-    if not isinstance(volt_min, Number) and len(volt_min) != nb_resources:
-        raise ValueError(
-            "volt_min has to be a number or an iterable of the same length "
-            "as resource_names"
+    if isinstance(signals, Iterator):
+        return write_analog_stream(
+            resource_names,
+            signals,
+            sample_rate=sample_rate,
+            volt_min=volt_min,
+            volt_max=volt_max,
+            blocking=blocking,
+            verbose=verbose,
         )
 
-    if not isinstance(volt_max, Number) and len(volt_max) != nb_resources:
-        raise ValueError(
-            "volt_max has to be a number or an iterable of the same length "
-            "as resource_names"
-        )
-
-    if isinstance(volt_min, Number):
-        volt_min = [volt_min] * nb_resources
-    if isinstance(volt_max, Number):
-        volt_max = [volt_max] * nb_resources
-
     if not isinstance(signals, (list, tuple, np.ndarray)):
         nb_samps_per_chan = 1
     # if np.isscalar(signals)==True
@@ -412,55 +1191,14 @@ def write_analog(
     else:
         raise ValueError("signals has to be a scalar or an array of dimension 1 or 2.")
 
-    # create task
-    if verbose:
-        print("DAQmx: Create Task")
-
-    task = Task()
-
-    # create AO channels
-    for ir, resource in enumerate(resource_names):
-        if verbose:
-            print(
-                "DAQmx: Create A0 Voltage Chan ("
-                + resource
-                + " ["
-                + str(volt_min[ir])
-                + "V;"
-                + str(volt_max[ir])
-                + "V])"
-            )
-        task.CreateAOVoltageChan(
-            resource, "", volt_min[ir], volt_max[ir], DAQmx_Val_Volts, None
-        )
+    task, resource_names, nb_resources = _create_ao_task(
+        resource_names, volt_min, volt_max, verbose
+    )
 
     # configure clock
     if nb_samps_per_chan > 1:
-        verbose_text = "DAQmx: Configure clock timing ("
         if verbose:
-            if nb_samps_per_chan < 1000:
-                verbose_text = verbose_text + str(nb_samps_per_chan) + " samp/chan @ "
-            elif nb_samps_per_chan < 1_000_000:
-                verbose_text = (
-                    verbose_text + str(nb_samps_per_chan / 1000) + " kSamp/chan @ "
-                )
-            else:
-                verbose_text = (
-                    verbose_text + str(nb_samps_per_chan / 1_000_000) + " MSamp/chan @ "
-                )
-            if sample_rate < 1000:
-                verbose_text = verbose_text + (
-                    "%.2f Hz using OnboardClock)" % sample_rate
-                )
-            elif sample_rate < 1_000_000:
-                verbose_text = verbose_text + (
-                    "%.2f kHz using OnboardClock)" % (sample_rate / 1000.0)
-                )
-            else:
-                verbose_text = verbose_text + (
-                    "%.2f MHz using OnboardClock)" % (sample_rate / 1e6)
-                )
-            print(verbose_text)
+            _print_clock_timing(nb_samps_per_chan, sample_rate)
         task.CfgSampClkTiming(
             "OnboardClock",
             sample_rate,
@@ -494,20 +1232,7 @@ def write_analog(
 
         # start task
         if verbose:
-            if platform().startswith("Windows"):
-                dateformat = "%A %d %B %Y - %X (%z)"
-            else:
-                dateformat = "%A %e %B %Y - %H:%M:%S (UTC%z)"
-            starttime = time.time()
-            starttime_str = time.strftime(dateformat, time.localtime(starttime))
-            endtime = starttime + nb_samps_per_chan / sample_rate
-            endtime_str = time.strftime(dateformat, time.localtime(endtime))
-            print("DAQmx: Starting write Task: " + starttime_str)
-            print(
-                "       Expected duration: %.2f min"
-                % (nb_samps_per_chan / (60.0 * sample_rate))
-            )
-            print("       Expected end time: " + endtime_str)
+            _print_start("write Task", nb_samps_per_chan, sample_rate)
 
         task.StartTask()
 
@@ -526,21 +1251,255 @@ def write_analog_end_task(task, timeout=0.0):
     Parameters
     ----------
 
-    task : PyDAQmx.Task
+    task : PyDAQmx.Task or AnalogOutputStream
 
-      The task to end.
+      The task to end (or the stream returned by :func:`write_analog`
+      for an iterator of chunks).
 
     timeout : number
 
       Time (in s) to wait before stopping the task if it is not done.
 
     """
+    if isinstance(task, AnalogOutputStream):
+        try:
+            task.wait_until_generated(timeout)
+        finally:
+            task.close()
+        return
 
     task.WaitUntilTaskDone(timeout)
     task.StopTask()
     task.ClearTask()
 
 
+class StimulusResponse:
+    """Synchronized generation and acquisition
+
+    Do not instantiate this class directly but use
+    :func:`write_read_analog`.
+
+    """
+
+    def __init__(self, ao_task, output_stream, acquisition):
+        self.ao_task = ao_task
+        self.output_stream = output_stream
+        self.acquisition = acquisition
+        self.ring_buffer = acquisition.ring_buffer
+
+    def start(self):
+        """Start the generation and then the acquisition.
+
+        The AO task waits for the AI start trigger and is clocked by the
+        AI sample clock, so the two tasks start on the same sample.
+
+        """
+        self.output_stream.start()
+        self.acquisition.start()
+
+    def wait(self, timeout=None):
+        """Wait for the end of the generation and of the acquisition."""
+        self.output_stream.wait(timeout)
+        if self.acquisition.nb_samples_max is None:
+            # the number of samples is known only when all chunks are written
+            self.acquisition.nb_samples_max = (
+                self.output_stream.nb_samples_written
+            )
+        self.acquisition.wait(timeout)
+        self._stop_ao_task()
+
+    def stop(self):
+        """Stop the generation and the acquisition."""
+        try:
+            self.output_stream.stop()
+            self.acquisition.stop()
+        finally:
+            self._stop_ao_task()
+
+    def _stop_ao_task(self):
+        if self.ao_task is not None:
+            self.ao_task.StopTask()
+            self.ao_task.ClearTask()
+            self.ao_task = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+def _get_device_name(resource_name):
+    if isinstance(resource_name, bytes):
+        resource_name = resource_name.decode()
+    return resource_name.strip("/").split("/")[0]
+
+
+def write_read_analog(
+    ao_resource_names,
+    ai_resource_names,
+    signals,
+    sample_rate,
+    terminal_config=None,
+    volt_min_ai=-10.0,
+    volt_max_ai=10.0,
+    volt_min_ao=-10.0,
+    volt_max_ao=10.0,
+    coupling_types="DC",
+    samples_per_write=None,
+    samples_per_read=None,
+    buffer_size=None,
+    output_filename=None,
+    sinks=None,
+    raw=False,
+    blocking=True,
+    verbose=False,
+):
+    """Generate AO signals and acquire AI channels on the same sample clock.
+
+    The AI task is the master: the AO task is clocked by its sample
+    clock (``/DevX/ai/SampleClock``) and started by its start trigger
+    (``/DevX/ai/StartTrigger``), so that the excitation and the response
+    are sample-synchronized. Both sides are streamed: the output is
+    non-regenerative and written by chunks, and the input is read by
+    chunks in a :class:`fluidlab.daq.ringbuffer.RingBuffer`.
+
+    Parameters
+    ----------
+
+    ao_resource_names : {str or iterable of str}
+
+      Analogic output identifier(s), e.g. 'Dev1/ao0'.
+
+    ai_resource_names : {str or iterable of str}
+
+      Analogic input identifier(s), e.g. 'Dev1/ai0' (on the same device
+      as the outputs).
+
+    signals : numpy.ndarray
+
+      The signal(s) to be output (shape (nb_ao, nb_samples) or
+      (nb_samples,)). The same number of samples is acquired.
+
+    sample_rate : number
+
+      Sample rate for all channels (Hz).
+
+    terminal_config, coupling_types :
+
+      See :func:`read_analog`.
+
+    volt_min_ai, volt_max_ai, volt_min_ao, volt_max_ao : {number or iterable}
+
+      Ranges of the input and output channels.
+
+    samples_per_write : {None, int}
+
+      Number of samples per channel written by chunk (default: 0.1 s).
+
+    samples_per_read : {None, int}
+
+      Number of samples per channel read by chunk (default: 0.1 s).
+
+    buffer_size : {None, int}
+
+      Size of the output buffer (default: 1 s of signal, at least 4
+      chunks).
+
+    output_filename, sinks, raw :
+
+      See :func:`read_analog_continuous`.
+
+    blocking : {True, bool}
+
+      If True, wait for the end and return the acquired data (if
+      `output_filename` is None, else None). If False, a
+      :class:`StimulusResponse` object is returned.
+
+    """
+    signals = np.asarray(signals, dtype=np.float64)
+    if signals.ndim == 1:
+        signals = signals.reshape(1, -1)
+    elif signals.ndim != 2:
+        raise ValueError("signals has to be an array of dimension 1 or 2.")
+    nb_samples = signals.shape[1]
+
+    if samples_per_write is None:
+        samples_per_write = max(1, int(sample_rate / 10))
+
+    if buffer_size is None:
+        buffer_size = max(4 * samples_per_write, int(sample_rate))
+    buffer_size = min(buffer_size, nb_samples)
+
+    ao_task, ao_resource_names, nb_ao = _create_ao_task(
+        ao_resource_names, volt_min_ao, volt_max_ao, verbose
+    )
+    if signals.shape[0] != nb_ao:
+        ao_task.ClearTask()
+        raise ValueError("signals has to contain one row per AO channel.")
+
+    acquisition = read_analog_continuous(
+        ai_resource_names,
+        terminal_config,
+        volt_min_ai,
+        volt_max_ai,
+        sample_rate=sample_rate,
+        coupling_types=coupling_types,
+        samples_per_read=samples_per_read,
+        buffer_duration=nb_samples / sample_rate if blocking else 10.0,
+        output_filename=output_filename,
+        sinks=sinks,
+        nb_samples_max=nb_samples,
+        raw=raw,
+        start=False,
+        verbose=verbose,
+    )
+
+    device = _get_device_name(_parse_resource_names(ai_resource_names)[0][0])
+    clock_source = f"/{device}/ai/SampleClock"
+    if verbose:
+        _print_clock_timing(nb_samples, sample_rate, clock_source)
+    ao_task.CfgSampClkTiming(
+        clock_source,
+        sample_rate,
+        DAQmx_Val_Rising,
+        DAQmx_Val_FiniteSamps,
+        nb_samples,
+    )
+    ao_task.CfgDigEdgeStartTrig(f"/{device}/ai/StartTrigger", DAQmx_Val_Rising)
+
+    output_stream = AnalogOutputStream(
+        ao_task,
+        nb_ao,
+        sample_rate,
+        _iter_chunks(signals, samples_per_write),
+        buffer_size,
+    )
+
+    stim_resp = StimulusResponse(ao_task, output_stream, acquisition)
+
+    if verbose:
+        _print_start(
+            "synchronized generation/acquisition", nb_samples, sample_rate
+        )
+
+    stim_resp.start()
+
+    if not blocking:
+        return stim_resp
+
+    try:
+        stim_resp.wait()
+    finally:
+        stim_resp.stop()
+
+    if output_filename is None:
+        data = acquisition.ring_buffer.get_last()
+        if raw:
+            return RawAnalogData(data, acquisition.scaling_coeffs, sample_rate)
+        return data
+
+
 def measure_freq(resource_name, freq_min=1, freq_max=1000):
     """Read analogic output
 
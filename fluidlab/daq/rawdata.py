@@ -0,0 +1,173 @@
+"""Raw (binary) acquisition data (:mod:`fluidlab.daq.rawdata`)
+=============================================================
+
+The analog input boards digitize the signals as 16-bit integers. Keeping
+the data in this native format (instead of float64) divides by 4 the
+memory and the disk bandwidth. The conversion to volts is done lazily
+with the scaling polynomial of each channel,
+
+.. math::
+
+   V = \\sum_k c_k x^k,
+
+where :math:`x` is the raw value and :math:`c_k` are the device scaling
+coefficients.
+
+.. autofunction:: scale_raw
+
+.. autoclass:: RawAnalogData
+   :members:
+
+.. autofunction:: load_raw_h5
+
+"""
+
+import numpy as np
+import h5py
+
+
+def scale_raw(raw, coeffs, out=None):
+    """Convert raw values to volts.
+
+    Parameters
+    ----------
+
+    raw : array_like (nb_channels, nb_samples)
+
+    coeffs : array_like (nb_channels, nb_coeffs)
+
+      Polynomial scaling coefficients (increasing order) of each channel.
+
+    out : {None, numpy.ndarray}
+
+      Array (float64) where the result is stored.
+
+    """
+    raw = np.asarray(raw)
+    coeffs = np.asarray(coeffs, dtype=np.float64)
+    if out is None:
+        out = np.empty(raw.shape, dtype=np.float64)
+
+    if raw.ndim == 1:
+        raw = raw.reshape(1, -1)
+        out2d = out.reshape(1, -1)
+    else:
+        out2d = out
+    coeffs = coeffs.reshape(raw.shape[0], -1)
+
+    # Horner scheme, channel by channel to limit the temporary arrays
+    for ichan in range(raw.shape[0]):
+        coeffs_chan = coeffs[ichan]
+        values = out2d[ichan]
+        values[:] = coeffs_chan[-1]
+        for coeff in coeffs_chan[-2::-1]:
+            values *= raw[ichan]
+            values += coeff
+
+    return out
+
+
+class RawAnalogData:
+    """Raw data with the scaling coefficients, converted to volts on access.
+
+    Parameters
+    ----------
+
+    raw : numpy.ndarray or h5py.Dataset (nb_channels, nb_samples)
+
+      Raw data (usually int16).
+
+    coeffs : array_like (nb_channels, nb_coeffs)
+
+      Polynomial scaling coefficients (increasing order) of each channel.
+
+    sample_rate : {None, number}
+
+    Notes
+    -----
+
+    Indexing the object returns volts only for the selected part of the
+    data (``data[0, 1000:2000]``), which is read from the file if `raw`
+    is a HDF5 dataset.
+
+    """
+
+    def __init__(self, raw, coeffs, sample_rate=None):
+        self.raw = raw
+        self.coeffs = np.atleast_2d(np.asarray(coeffs, dtype=np.float64))
+        self.sample_rate = sample_rate
+
+        if self.coeffs.shape[0] != raw.shape[0]:
+            raise ValueError("coeffs has to be of shape (nb_channels, nb_coeffs)")
+
+    @property
+    def shape(self):
+        return self.raw.shape
+
+    @property
+    def nb_channels(self):
+        return self.raw.shape[0]
+
+    @property
+    def nb_samples(self):
+        return self.raw.shape[1]
+
+    def __len__(self):
+        return self.raw.shape[0]
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        key_chan = key[0]
+        key_samples = key[1:]
+
+        coeffs = self.coeffs[key_chan]
+        raw = np.asarray(self.raw[key])
+        if coeffs.ndim == 1:
+            # only one channel selected
+            if raw.ndim == 0:
+                return scale_raw(raw.reshape(1, 1), coeffs).item()
+            return scale_raw(raw, coeffs)
+
+        if key_samples and np.isscalar(key_samples[0]):
+            return scale_raw(raw[:, np.newaxis], coeffs)[:, 0]
+        return scale_raw(raw, coeffs)
+
+    def iter_volts(self, chunk_size=2**20):
+        """Iterate over the data in volts by chunks of samples."""
+        for start in range(0, self.nb_samples, chunk_size):
+            yield self[:, start : start + chunk_size]
+
+    def to_volts(self, chunk_size=2**20):
+        """Convert all the data to volts (float64 array)."""
+        volts = np.empty(self.shape, dtype=np.float64)
+        for start in range(0, self.nb_samples, chunk_size):
+            raw = np.asarray(self.raw[:, start : start + chunk_size])
+            scale_raw(
+                raw, self.coeffs, out=volts[:, start : start + raw.shape[1]]
+            )
+        return volts
+
+    def save(self, path, dataset_name="data"):
+        """Save the raw data and the coefficients in a HDF5 file."""
+        with h5py.File(path, "w") as file:
+            dataset = file.create_dataset(dataset_name, data=self.raw)
+            dataset.attrs["scaling_coeffs"] = self.coeffs
+            if self.sample_rate is not None:
+                dataset.attrs["sample_rate"] = self.sample_rate
+
+
+def load_raw_h5(path, dataset_name="data"):
+    """Open raw data saved in a HDF5 file without loading it.
+
+    The file has to contain a dataset with the attribute
+    "scaling_coeffs" (as written by :func:`RawAnalogData.save` and by
+    :func:`fluidlab.daq.daqmx.read_analog_continuous` with
+    ``raw=True``). The file stays open as long as the returned object
+    is used.
+
+    """
+    file = h5py.File(path, "r")
+    dataset = file[dataset_name]
+    sample_rate = dataset.attrs.get("sample_rate", None)
+    return RawAnalogData(dataset, dataset.attrs["scaling_coeffs"], sample_rate)
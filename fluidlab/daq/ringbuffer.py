@@ -0,0 +1,135 @@
+"""Ring buffer for streamed acquisitions (:mod:`fluidlab.daq.ringbuffer`)
+=========================================================================
+
+A :class:`RingBuffer` is a preallocated 2d array (one row per channel)
+in which an acquisition thread pushes chunks of samples. The memory
+used does not grow with the duration of the acquisition.
+
+Consumers can attach to the ring buffer in two ways:
+
+- as "sinks" (see :mod:`fluidlab.daq.sinks`), which are called with
+  each new chunk in the acquisition thread (e.g. to write to disk),
+
+- by polling with :func:`RingBuffer.read_since` or
+  :func:`RingBuffer.get_last` from another thread (e.g. for a live
+  plot).
+
+.. autoclass:: RingBuffer
+   :members:
+
+"""
+
+import threading
+
+import numpy as np
+
+
+class RingBuffer:
+    """Preallocated circular buffer for multichannel time series.
+
+    Parameters
+    ----------
+
+    nb_channels : int
+
+      Number of channels (rows of the buffer).
+
+    size : int
+
+      Number of samples per channel kept in memory.
+
+    dtype : numpy dtype
+
+      Data type of the samples.
+
+    """
+
+    def __init__(self, nb_channels, size, dtype=np.float64):
+        if size <= 0:
+            raise ValueError("size has to be a positive integer.")
+
+        self.nb_channels = nb_channels
+        self.size = size
+        self.dtype = np.dtype(dtype)
+        self.data = np.zeros((nb_channels, size), dtype=self.dtype)
+        # total number of samples per channel pushed since the creation
+        self.nb_samples_pushed = 0
+        self.sinks = []
+        self._lock = threading.Lock()
+
+    def add_sink(self, sink):
+        """Attach a sink called with each new chunk."""
+        self.sinks.append(sink)
+
+    def push(self, chunk):
+        """Push a chunk of shape (nb_channels, nb_samples)."""
+        chunk = np.asarray(chunk)
+        if chunk.ndim == 1:
+            chunk = chunk.reshape(self.nb_channels, -1)
+
+        if chunk.shape[0] != self.nb_channels:
+            raise ValueError(
+                "chunk has to be of shape (nb_channels, nb_samples)."
+            )
+
+        nb_samples = chunk.shape[1]
+        index_chunk = self.nb_samples_pushed
+
+        with self._lock:
+            to_copy = chunk
+            if nb_samples > self.size:
+                to_copy = chunk[:, -self.size :]
+            nb_to_copy = to_copy.shape[1]
+            start = (index_chunk + nb_samples - nb_to_copy) % self.size
+            stop = start + nb_to_copy
+            if stop <= self.size:
+                self.data[:, start:stop] = to_copy
+            else:
+                nb_first = self.size - start
+                self.data[:, start:] = to_copy[:, :nb_first]
+                self.data[:, : stop - self.size] = to_copy[:, nb_first:]
+            self.nb_samples_pushed += nb_samples
+
+        for sink in self.sinks:
+            sink.process(chunk, index_chunk)
+
+    def _copy_range(self, index_start, index_stop):
+        # the lock has to be acquired by the caller
+        nb_samples = index_stop - index_start
+        result = np.empty((self.nb_channels, nb_samples), dtype=self.dtype)
+        start = index_start % self.size
+        stop = start + nb_samples
+        if stop <= self.size:
+            result[:] = self.data[:, start:stop]
+        else:
+            nb_first = self.size - start
+            result[:, :nb_first] = self.data[:, start:]
+            result[:, nb_first:] = self.data[:, : stop - self.size]
+        return result
+
+    def get_last(self, nb_samples=None):
+        """Return a copy of the last samples (in chronological order)."""
+        with self._lock:
+            nb_available = min(self.nb_samples_pushed, self.size)
+            if nb_samples is None or nb_samples > nb_available:
+                nb_samples = nb_available
+            index_stop = self.nb_samples_pushed
+            return self._copy_range(index_stop - nb_samples, index_stop)
+
+    def read_since(self, index):
+        """Return the samples pushed since `index` and the new index.
+
+        If some of these samples have already been overwritten, only the
+        samples still in the buffer are returned, so that the number of
+        lost samples is `new_index - index - data.shape[1]`.
+
+        """
+        with self._lock:
+            index_stop = self.nb_samples_pushed
+            index_start = max(index, index_stop - self.size)
+            return self._copy_range(index_start, index_stop), index_stop
+
+    def close(self):
+        """Close all the sinks."""
+        for sink in self.sinks:
+            sink.close()
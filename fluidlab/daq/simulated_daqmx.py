@@ -0,0 +1,453 @@
+"""Simulated DAQmx backend (:mod:`fluidlab.daq.simulated_daqmx`)
+================================================================
+
+Pure-Python replacement of the parts of PyDAQmx used in
+:mod:`fluidlab.daq.daqmx`. It can be used to import, test, profile and
+benchmark the acquisition chain without NI hardware and without the
+NI-DAQmx library.
+
+The backend is selected with the environment variable
+``FLUIDLAB_DAQMX_BACKEND=simulated`` or by defining
+``daqmx_backend = "simulated"`` in a FluidLab user configuration file
+(for example `~/.fluidlab/config.py`).
+
+The simulated tasks follow the real timing: reading blocks until the
+samples are "acquired" according to the sample rate and the start time
+of the task, and writing in a non-regenerative output blocks until
+there is space in the buffer.
+
+The signals are deterministic. For the AI channel `aiN` of a device,
+the signal is the one written on the AO channel `aoN` of the same
+device if such a channel is used (loopback), otherwise
+
+.. math::
+
+   V(t) = A \\sin(2\\pi f_N t), \\quad A = V_{max}/2, \\quad f_N = 10 (N+1) \\,
+   \\mathrm{Hz}.
+
+.. autoclass:: Task
+   :members:
+
+.. autoclass:: DAQError
+
+"""
+
+import time
+import threading
+from ctypes import (
+    byref,
+    c_double as float64,
+    c_int32 as int32,
+    c_uint32 as uInt32,
+    c_uint64 as uInt64,
+)
+
+import numpy as np
+
+DAQmx_Val_Cfg_Default = -1
+DAQmx_Val_RSE = 10083
+DAQmx_Val_NRSE = 10078
+DAQmx_Val_Diff = 10106
+DAQmx_Val_PseudoDiff = 12529
+DAQmx_Val_Volts = 10348
+DAQmx_AI_Coupling = 0x0064
+DAQmx_Val_DC = 10050
+DAQmx_Val_AC = 10045
+DAQmx_Val_GND = 10066
+DAQmx_Val_Rising = 10280
+DAQmx_Val_FiniteSamps = 10178
+DAQmx_Val_ContSamps = 10123
+DAQmx_Val_GroupByChannel = 0
+DAQmx_Val_Hz = 10373
+DAQmx_Val_LowFreq1Ctr = 10105
+DAQmx_Val_DoNotAllowRegen = 10158
+DAQmx_Val_AllowRegen = 10097
+
+_error_timeout = -200284
+_error_underflow = -200290
+
+
+class DAQError(Exception):
+    """Error in a simulated DAQmx function (same API as in PyDAQmx)"""
+
+    def __init__(self, error, mess, fname):
+        self.error = error
+        self.mess = mess
+        self.fname = fname
+        super().__init__(f"{fname} failed (error {error}): {mess}")
+
+
+class AttributeNotSupportedInTaskContextError(DAQError):
+    pass
+
+
+class _Device:
+    """Shared state of a simulated device (for clocks and loopback)."""
+
+    def __init__(self, name):
+        self.name = name
+        self.ai_start_time = None
+        self.ao_tasks = []
+
+
+_devices = {}
+_lock_devices = threading.Lock()
+
+
+def _split_channel(name):
+    if isinstance(name, bytes):
+        name = name.decode()
+    device, channel = name.strip("/").split("/")[:2]
+    return device, channel
+
+
+def _get_device(name):
+    with _lock_devices:
+        if name not in _devices:
+            _devices[name] = _Device(name)
+        return _devices[name]
+
+
+def _set_pointer(pointer, value):
+    pointer._obj.value = value
+
+
+class Task:
+    """Simulated DAQmx task"""
+
+    def __init__(self):
+        self.ai_channels = []
+        self.ao_channels = []
+        self.ci_channels = []
+        self.device = None
+        self.sample_rate = None
+        self.sample_mode = None
+        self.samples_per_chan = None
+        self.clock_source = None
+        self.start_trigger = None
+        self.regen_mode = DAQmx_Val_AllowRegen
+        self.buffer_size = None
+        self.start_time = None
+        self.started = False
+        self.nb_samples_read = 0
+        self.nb_samples_written = 0
+        self._ao_data = []
+        self._lock = threading.Lock()
+
+    def _set_device(self, name):
+        device_name, channel = _split_channel(name)
+        self.device = _get_device(device_name)
+        return channel
+
+    def CreateAIVoltageChan(
+        self, name, assigned_name, terminal_config, vmin, vmax, units, scale
+    ):
+        channel = self._set_device(name)
+        self.ai_channels.append(
+            {"name": name, "index": int(channel[2:]), "vmin": vmin, "vmax": vmax}
+        )
+
+    def CreateAOVoltageChan(self, name, assigned_name, vmin, vmax, units, scale):
+        channel = self._set_device(name)
+        self.ao_channels.append(
+            {"name": name, "index": int(channel[2:]), "vmin": vmin, "vmax": vmax}
+        )
+
+    def CreateCIFreqChan(
+        self,
+        name,
+        assigned_name,
+        freq_min,
+        freq_max,
+        units,
+        edge,
+        method,
+        measure_time,
+        divisor,
+        scale,
+    ):
+        self._set_device(name)
+        self.ci_channels.append(
+            {"name": name, "freq_min": freq_min, "freq_max": freq_max}
+        )
+
+    def _get_ai_channel(self, name):
+        for channel in self.ai_channels:
+            if channel["name"] == name:
+                return channel
+        raise DAQError(-200428, "channel not in task", "GetChannel")
+
+    def GetAIRngHigh(self, name, pointer):
+        _set_pointer(pointer, self._get_ai_channel(name)["vmax"])
+
+    def GetAIRngLow(self, name, pointer):
+        _set_pointer(pointer, self._get_ai_channel(name)["vmin"])
+
+    def GetAIDevScalingCoeff(self, name, coeffs, nb_coeffs):
+        channel = self._get_ai_channel(name)
+        coeffs[:nb_coeffs] = 0.0
+        coeffs[1] = self._volts_per_bit(channel)
+
+    @staticmethod
+    def _volts_per_bit(channel):
+        return max(abs(channel["vmin"]), abs(channel["vmax"])) / 32768
+
+    def SetChanAttribute(self, name, attribute, value):
+        pass
+
+    def CfgSampClkTiming(self, source, rate, edge, mode, samples_per_chan):
+        if isinstance(source, bytes):
+            source = source.decode()
+        self.clock_source = source
+        self.sample_rate = float(rate)
+        self.sample_mode = mode
+        self.samples_per_chan = samples_per_chan
+        if self.buffer_size is None:
+            self.buffer_size = samples_per_chan
+
+    def CfgInputBuffer(self, size):
+        self.buffer_size = size
+
+    def CfgOutputBuffer(self, size):
+        self.buffer_size = size
+
+    def SetWriteRegenMode(self, mode):
+        self.regen_mode = mode
+
+    def CfgDigEdgeStartTrig(self, source, edge):
+        self.start_trigger = source
+
+    def _uses_ai_clock(self):
+        return bool(self.ao_channels) and (
+            "ai/SampleClock" in (self.clock_source or "")
+            or "ai/StartTrigger" in (self.start_trigger or "")
+        )
+
+    def StartTask(self):
+        with self._lock:
+            self.started = True
+            if self.ao_channels:
+                self.device.ao_tasks.append(self)
+            if self._uses_ai_clock():
+                # armed, the start time is the one of the AI task
+                self.start_time = None
+            else:
+                self.start_time = time.perf_counter()
+            if self.ai_channels:
+                self.device.ai_start_time = self.start_time
+
+    def _get_start_time(self):
+        if self._uses_ai_clock():
+            return self.device.ai_start_time
+        return self.start_time
+
+    def _nb_samples_clocked(self):
+        start_time = self._get_start_time()
+        if start_time is None or self.sample_rate is None:
+            return 0
+        nb_samples = int((time.perf_counter() - start_time) * self.sample_rate)
+        if self.sample_mode == DAQmx_Val_FiniteSamps:
+            nb_samples = min(nb_samples, self.samples_per_chan)
+        return nb_samples
+
+    def StopTask(self):
+        with self._lock:
+            if self in self.device.ao_tasks:
+                self.device.ao_tasks.remove(self)
+            if self.ai_channels and self.started:
+                self.device.ai_start_time = None
+            self.start_time = None
+            self.started = False
+
+    def ClearTask(self):
+        if self.started:
+            self.StopTask()
+
+    def WaitUntilTaskDone(self, timeout):
+        start_time = self._get_start_time()
+        if start_time is None or self.sample_mode != DAQmx_Val_FiniteSamps:
+            return
+        duration = self.samples_per_chan / self.sample_rate
+        time_to_wait = start_time + duration - time.perf_counter()
+        if time_to_wait > timeout >= 0:
+            time.sleep(timeout)
+            raise DAQError(_error_timeout, "task not done", "WaitUntilTaskDone")
+        if time_to_wait > 0:
+            time.sleep(time_to_wait)
+
+    # analog input
+
+    def _wait_for_samples(self, index_stop, timeout, fname):
+        start_time = self._get_start_time()
+        if start_time is None:
+            raise DAQError(-200473, "task not started", fname)
+        time_available = start_time + index_stop / self.sample_rate
+        time_to_wait = time_available - time.perf_counter()
+        if time_to_wait > timeout >= 0:
+            time.sleep(timeout)
+            raise DAQError(_error_timeout, "timeout while reading", fname)
+        if time_to_wait > 0:
+            time.sleep(time_to_wait)
+
+    def _make_ai_signals(self, index_start, nb_samples):
+        times = (index_start + np.arange(nb_samples)) / self.sample_rate
+        signals = np.empty((len(self.ai_channels), nb_samples))
+        ao_signals = {}
+        for ao_task in list(self.device.ao_tasks):
+            ao_signals.update(ao_task._get_ao_signals(index_start, nb_samples))
+        for ichan, channel in enumerate(self.ai_channels):
+            index = channel["index"]
+            if index in ao_signals:
+                signals[ichan] = ao_signals[index]
+            else:
+                amplitude = channel["vmax"] / 2
+                signals[ichan] = amplitude * np.sin(
+                    2 * np.pi * 10 * (index + 1) * times
+                )
+        return signals
+
+    def _read(self, nb_samples, timeout, array, pointer_read, fname):
+        if nb_samples < 0:
+            nb_samples = self.samples_per_chan - self.nb_samples_read
+        if self.sample_mode == DAQmx_Val_FiniteSamps or self.sample_rate is None:
+            total = self.samples_per_chan or 1
+            nb_samples = min(nb_samples, total - self.nb_samples_read)
+        index_start = self.nb_samples_read
+        if self.sample_rate is not None:
+            self._wait_for_samples(index_start + nb_samples, timeout, fname)
+            signals = self._make_ai_signals(index_start, nb_samples)
+        else:
+            signals = np.zeros((len(self.ai_channels), nb_samples))
+        self.nb_samples_read += nb_samples
+        _set_pointer(pointer_read, nb_samples)
+        return signals
+
+    def ReadAnalogF64(
+        self, nb_samples, timeout, fill_mode, array, size, pointer_read, reserved
+    ):
+        signals = self._read(
+            nb_samples, timeout, array, pointer_read, "ReadAnalogF64"
+        )
+        array[: signals.size] = signals.ravel()
+
+    def ReadBinaryI16(
+        self, nb_samples, timeout, fill_mode, array, size, pointer_read, reserved
+    ):
+        signals = self._read(
+            nb_samples, timeout, array, pointer_read, "ReadBinaryI16"
+        )
+        for ichan, channel in enumerate(self.ai_channels):
+            signals[ichan] /= self._volts_per_bit(channel)
+        array[: signals.size] = np.clip(np.round(signals), -32768, 32767).ravel()
+
+    # analog output
+
+    def _get_ao_signals(self, index_start, nb_samples):
+        """Samples generated by the AO task (for the loopback)."""
+        with self._lock:
+            if not self._ao_data:
+                return {}
+            signals = np.zeros((len(self.ao_channels), nb_samples))
+            index_stop = index_start + nb_samples
+            for index_chunk, chunk in self._ao_data:
+                stop_chunk = index_chunk + chunk.shape[1]
+                start = max(index_start, index_chunk)
+                stop = min(index_stop, stop_chunk)
+                if start < stop:
+                    signals[:, start - index_start : stop - index_start] = chunk[
+                        :, start - index_chunk : stop - index_chunk
+                    ]
+            # forget the samples already read
+            self._ao_data = [
+                (index_chunk, chunk)
+                for index_chunk, chunk in self._ao_data
+                if index_chunk + chunk.shape[1] > index_start
+            ]
+        return {
+            channel["index"]: signals[ichan]
+            for ichan, channel in enumerate(self.ao_channels)
+        }
+
+    def _nb_samples_generated(self):
+        return min(self._nb_samples_clocked(), self.nb_samples_written)
+
+    def _check_underflow(self, fname):
+        if (
+            self.regen_mode == DAQmx_Val_DoNotAllowRegen
+            and self._get_start_time() is not None
+            and self.sample_mode == DAQmx_Val_ContSamps
+            and self._nb_samples_clocked() > self.nb_samples_written
+        ):
+            raise DAQError(
+                _error_underflow,
+                "generation stopped to prevent the regeneration of old samples",
+                fname,
+            )
+
+    def WriteAnalogF64(
+        self,
+        nb_samples,
+        autostart,
+        timeout,
+        data_layout,
+        array,
+        pointer_written,
+        reserved,
+    ):
+        fname = "WriteAnalogF64"
+        self._check_underflow(fname)
+        if self.regen_mode == DAQmx_Val_DoNotAllowRegen and self.buffer_size:
+            time_end = time.perf_counter() + timeout
+            while (
+                self.nb_samples_written
+                - self._nb_samples_generated()
+                + nb_samples
+                > self.buffer_size
+            ):
+                if not self.started:
+                    raise DAQError(
+                        -200547, "buffer full, task not started", fname
+                    )
+                if time.perf_counter() > time_end:
+                    raise DAQError(_error_timeout, "timeout while writing", fname)
+                time.sleep(min(0.01, nb_samples / self.sample_rate))
+                self._check_underflow(fname)
+
+        chunk = np.array(array, dtype=np.float64).reshape(
+            len(self.ao_channels), nb_samples
+        )
+        with self._lock:
+            if self.device.ai_start_time is None:
+                # no loopback: forget the samples already generated
+                nb_generated = self._nb_samples_generated()
+                self._ao_data = [
+                    (index_chunk, chunk_old)
+                    for index_chunk, chunk_old in self._ao_data
+                    if index_chunk + chunk_old.shape[1] > nb_generated
+                ]
+            self._ao_data.append((self.nb_samples_written, chunk))
+            self.nb_samples_written += nb_samples
+        _set_pointer(pointer_written, nb_samples)
+        if autostart and not self.started:
+            self.StartTask()
+
+    def WriteAnalogScalarF64(self, autostart, timeout, value, reserved):
+        with self._lock:
+            self._ao_data = [(0, np.full((len(self.ao_channels), 1), value))]
+
+    def GetWriteSpaceAvail(self, pointer):
+        nb_samples_in_buffer = (
+            self.nb_samples_written - self._nb_samples_generated()
+        )
+        _set_pointer(pointer, max(0, self.buffer_size - nb_samples_in_buffer))
+
+    def GetWriteTotalSampPerChanGenerated(self, pointer):
+        _set_pointer(pointer, self._nb_samples_generated())
+
+    # counter input
+
+    def ReadCounterScalarF64(self, timeout, pointer, reserved):
+        channel = self.ci_channels[0]
+        freq = np.sqrt(channel["freq_min"] * channel["freq_max"])
+        time.sleep(min(1.0 / freq, timeout))
+        _set_pointer(pointer, freq)
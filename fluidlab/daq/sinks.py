@@ -0,0 +1,163 @@
+"""Sinks for streamed acquisitions (:mod:`fluidlab.daq.sinks`)
+=============================================================
+
+Sinks are objects with the methods ``process(chunk, index)`` and
+``close()``. They can be attached to a
+:class:`fluidlab.daq.ringbuffer.RingBuffer` and are called in the
+acquisition thread with each new chunk (array of shape
+``(nb_channels, nb_samples)``) and the index of its first sample. The
+chunk can be reused by the caller after the call, so the sinks have to
+copy what they keep.
+
+.. autoclass:: H5Sink
+   :members:
+
+.. autoclass:: DecimatorSink
+   :members:
+
+.. autoclass:: CallbackSink
+   :members:
+
+"""
+
+import numpy as np
+import h5py
+
+
+class H5Sink:
+    """Append the chunks to a chunked and extendable HDF5 dataset.
+
+    Parameters
+    ----------
+
+    path : str
+
+      Path of the HDF5 file (created).
+
+    nb_channels : int
+
+      Number of channels.
+
+    dtype : numpy dtype
+
+    chunk_size : int
+
+      Number of samples per channel in a HDF5 chunk.
+
+    dataset_name : str
+
+    attrs : {None, dict}
+
+      Attributes saved with the dataset (e.g. sample rate, channel names).
+
+    compression : {None, str}
+
+      HDF5 compression filter (e.g. "gzip" or "lzf").
+
+    """
+
+    def __init__(
+        self,
+        path,
+        nb_channels,
+        dtype=np.float64,
+        chunk_size=2**16,
+        dataset_name="data",
+        attrs=None,
+        compression=None,
+    ):
+        self.path = path
+        self._file = h5py.File(path, "w")
+        self.dataset = self._file.create_dataset(
+            dataset_name,
+            shape=(nb_channels, 0),
+            maxshape=(nb_channels, None),
+            chunks=(nb_channels, chunk_size),
+            dtype=dtype,
+            compression=compression,
+        )
+        if attrs is not None:
+            for key, value in attrs.items():
+                self.dataset.attrs[key] = value
+
+    def process(self, chunk, index):
+        nb_samples = chunk.shape[1]
+        dataset = self.dataset
+        nb_samples_old = dataset.shape[1]
+        dataset.resize(nb_samples_old + nb_samples, axis=1)
+        dataset[:, nb_samples_old:] = chunk
+
+    def close(self):
+        if self._file:
+            self._file.close()
+
+
+class DecimatorSink:
+    """Decimate the signals (block averages) and forward them to a sink.
+
+    Parameters
+    ----------
+
+    factor : int
+
+      Decimation factor.
+
+    sink :
+
+      Sink receiving the decimated chunks (for example a
+      :class:`CallbackSink` or a :class:`fluidlab.daq.ringbuffer.RingBuffer`
+      wrapped in a :class:`CallbackSink`).
+
+    """
+
+    def __init__(self, factor, sink):
+        if factor < 1:
+            raise ValueError("factor has to be a positive integer.")
+        self.factor = int(factor)
+        self.sink = sink
+        self._remainder = None
+        self._index_out = 0
+
+    def process(self, chunk, index):
+        if self._remainder is not None and self._remainder.shape[1] > 0:
+            chunk = np.concatenate((self._remainder, chunk), axis=1)
+
+        nb_blocks = chunk.shape[1] // self.factor
+        nb_used = nb_blocks * self.factor
+        self._remainder = chunk[:, nb_used:].copy()
+
+        if nb_blocks == 0:
+            return
+
+        decimated = (
+            chunk[:, :nb_used]
+            .reshape(chunk.shape[0], nb_blocks, self.factor)
+            .mean(axis=2)
+        )
+        self.sink.process(decimated, self._index_out)
+        self._index_out += nb_blocks
+
+    def close(self):
+        self.sink.close()
+
+
+class CallbackSink:
+    """Call a function with each chunk (e.g. to update a live plot).
+
+    Parameters
+    ----------
+
+    callback : callable
+
+      Called as ``callback(chunk, index)``.
+
+    """
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def process(self, chunk, index):
+        self.callback(chunk, index)
+
+    def close(self):
+        pass
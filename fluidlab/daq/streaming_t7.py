@@ -1,10 +1,22 @@
 """Streaming with a T7 board (LabJack)
 ======================================
 
+.. autoclass:: T7
+   :members:
+
+.. autoclass:: InputStream
+   :members:
+
+.. autoclass:: StreamOutRefiller
+   :members:
+
 """
+
 from __future__ import print_function
 
 import time
+import threading
+import itertools
 
 import numpy as np
 
@@ -14,6 +26,23 @@ from labjack import ljm
 
 from fluiddyn.io.query import query_yes_no
 
+from fluidlab.daq.ringbuffer import RingBuffer
+from fluidlab.daq.sinks import H5Sink
+
+# Modbus TCP "write multiple registers" request overhead (bytes): MBAP
+# header (7), function code (1), address (2), number of registers (2) and
+# byte count (1)
+MODBUS_WRITE_OVERHEAD = 13
+BYTES_PER_F32 = 4
+# bytes per value in the stream-out buffers of the device
+BYTES_PER_VALUE_STREAM_OUT = 2
+# maximum size (bytes) of a stream-out buffer of the device
+MAX_DEVICE_BUFFER_SIZE_STREAM_OUT = 16384
+# maximum number of values per channel in a stream-out buffer
+MAX_NB_VALUES_STREAM_OUT = (
+    MAX_DEVICE_BUFFER_SIZE_STREAM_OUT // BYTES_PER_VALUE_STREAM_OUT
+)
+
 
 def is_power2(num):
     "states if a number is a power of two"
@@ -28,8 +57,14 @@ class T7:
         self.handle = ljm.openS("ANY", "ANY", identifier)
         # handle = ljm.open(ljm.constants.dtANY, ljm.constants.ctANY, "ANY")
 
-        self.get_info()
+        info = self.get_info()
+        self.max_bytes_per_mb = info[5]
+        self.max_values_per_packet = max(
+            1, (self.max_bytes_per_mb - MODBUS_WRITE_OVERHEAD) // BYTES_PER_F32
+        )
         self._closed = False
+        self.input_stream = None
+        self.out_buffer_sizes = []
 
     def __del__(self):
         self.close()
@@ -42,9 +77,16 @@ class T7:
     def stop_stream(self):
         print("stop_stream")
         handle = self.handle
-        ljm.eWriteName(handle, "DAC0", 0)
-        ljm.eWriteName(handle, "DAC1", 0)
-        ljm.eStreamStop(handle)
+        input_stream = self.input_stream
+        self.input_stream = None
+        try:
+            if input_stream is not None:
+                input_stream.stop()
+                input_stream.print_stats()
+        finally:
+            ljm.eWriteName(handle, "DAC0", 0)
+            ljm.eWriteName(handle, "DAC1", 0)
+            ljm.eStreamStop(handle)
 
     def get_info(self):
         info = ljm.getHandleInfo(self.handle)
@@ -63,6 +105,7 @@ class T7:
                 info[5],
             )
         )
+        return info
 
     def split_data_in_buffer(self, data):
         MAX_BUFFER_SIZE = 512
@@ -83,43 +126,27 @@ class T7:
                 data_splited.append([d])
             else:
                 NUMBER_SAMPLE = 2 * (data_byte_size // MAX_BUFFER_SIZE + 1)
-                data_splited.append(np.split(d, NUMBER_SAMPLE))
+                # the segments can differ by one value (see StreamOutRefiller)
+                data_splited.append(np.array_split(d, NUMBER_SAMPLE))
                 buffer_size.append(MAX_BUFFER_SIZE)
         return buffer_size, data_splited
 
     def write_out_buffer(self, streamout, volt):
-        """to replace
-        for l in volt:
-            ljm.eWriteName(handle, "STREAM_OUT0_BUFFER_F32", l)
-        """
+        """Write values in a stream-out buffer (e.g. "STREAM_OUT0_BUFFER_F32").
+
+        The values are converted once to a float32 array and uploaded
+        with as many values per packet as allowed by the maximum packet
+        size of the connection (``max_values_per_packet``).
 
+        """
         handle = self.handle
-        maxpoints = 8  # 8 = max number points able to write
-        N = volt.size
-        nloop = N // maxpoints
+        volt = np.ascontiguousarray(volt, dtype=np.float32).ravel()
+        nb_values = volt.size
+        maxpoints = self.max_values_per_packet
 
-        if nloop == 0:
-            ljm.eWriteNameArray(
-                handle, streamout, volt.size, np.ndarray.tolist(volt)
-            )
-        else:
-            for i in range(nloop):
-                ljm.eWriteNameArray(
-                    handle,
-                    streamout,
-                    maxpoints,
-                    np.ndarray.tolist(
-                        volt[i * maxpoints : i * maxpoints + maxpoints]
-                    ),
-                )
-            if N % maxpoints != 0:
-                i += 1
-                ljm.eWriteNameArray(
-                    handle,
-                    streamout,
-                    volt[i * maxpoints :].size,
-                    np.ndarray.tolist(volt[i * maxpoints :]),
-                )
+        for start in range(0, nb_values, maxpoints):
+            chunk = volt[start : start + maxpoints]
+            ljm.eWriteNameArray(handle, streamout, chunk.size, chunk)
 
     def prepare_stream_loop(self, IN_NAMES=None, OUT_NAMES=[], volt=[]):
         handle = self.handle
@@ -131,6 +158,7 @@ class T7:
 
         NUM_OUT_CHANNELS = len(OUT_NAMES)
         buffer_size, volt_splitted = self.split_data_in_buffer(volt)
+        self.out_buffer_sizes = buffer_size
         for indout, out in enumerate(OUT_NAMES):
             outAddress = ljm.nameToAddress(OUT_NAMES[indout])[0]
             ljm.eWriteName(handle, f"STREAM_OUT{indout}_ENABLE", 0)
@@ -220,6 +248,108 @@ class T7:
 
         return aScanList
 
+    def start_input_stream(
+        self,
+        IN_NAMES,
+        scan_rate,
+        scans_per_read=None,
+        OUT_NAMES=None,
+        volt=None,
+        buffer_duration=10.0,
+        output_filename=None,
+        sinks=None,
+    ):
+        """Start a stream and a reader thread for the input channels.
+
+        Parameters
+        ----------
+
+        IN_NAMES : list of str
+
+          Names of the input channels (e.g. ["AIN0", "AIN1"]).
+
+        scan_rate : number
+
+          Scan rate (Hz).
+
+        scans_per_read : {None, int}
+
+          Number of scans returned by each call of ``ljm.eStreamRead``
+          (default: 0.1 s).
+
+        OUT_NAMES, volt :
+
+          Output channels and signals (looped, see
+          :func:`prepare_stream_loop`) streamed with the inputs.
+
+        buffer_duration : number
+
+          Duration (in s) of the signals kept in the ring buffer.
+
+        output_filename : {None, str}
+
+          If specified, the data is written in this HDF5 file (dataset
+          "data").
+
+        sinks : {None, list}
+
+          Sinks attached to the ring buffer (see :mod:`fluidlab.daq.sinks`).
+
+        Returns
+        -------
+
+        input_stream : :class:`InputStream`
+
+          Stopped with :func:`stop_stream` (and :func:`wait_before_stop`).
+
+        """
+        if OUT_NAMES is None:
+            OUT_NAMES = []
+        if volt is None:
+            volt = []
+
+        if scans_per_read is None:
+            scans_per_read = max(1, int(scan_rate / 10))
+
+        if OUT_NAMES:
+            aScanList, _ = self.prepare_stream_loop(
+                IN_NAMES=IN_NAMES, OUT_NAMES=OUT_NAMES, volt=volt
+            )
+        else:
+            aScanList = self.prepare_stream(IN_NAMES=IN_NAMES)
+
+        input_stream = InputStream(
+            self,
+            IN_NAMES,
+            scans_per_read,
+            max(scans_per_read, int(buffer_duration * scan_rate)),
+            nb_addresses=len(aScanList),
+        )
+
+        if output_filename is not None:
+            input_stream.add_sink(
+                H5Sink(
+                    output_filename,
+                    len(IN_NAMES),
+                    attrs={"scan_rate": scan_rate, "names": IN_NAMES},
+                )
+            )
+        if sinks is not None:
+            for sink in sinks:
+                input_stream.add_sink(sink)
+
+        scan_rate = ljm.eStreamStart(
+            self.handle,
+            scans_per_read,
+            len(aScanList),
+            aScanList,
+            scan_rate,
+        )
+        input_stream.scan_rate = scan_rate
+        input_stream.start()
+        self.input_stream = input_stream
+        return input_stream
+
     def wait_before_stop(self, total_time=None, dt=None):
         try:
             if total_time is not None:
@@ -247,3 +377,303 @@ class T7:
 
         except KeyboardInterrupt:
             self.stop_stream()
+
+
+class InputStream:
+    """Reader thread draining ``ljm.eStreamRead`` into a ring buffer
+
+    The data of each read is deinterleaved with NumPy and pushed in a
+    :class:`fluidlab.daq.ringbuffer.RingBuffer` (shape (nb_channels,
+    nb_scans)), which forwards it to its sinks (see
+    :mod:`fluidlab.daq.sinks`). The number of skipped scans (values
+    equal to ``ljm.constants.DUMMY_VALUE``) and the device and LJM
+    backlogs are tracked.
+
+    The scan list can also contain stream-out addresses (after the
+    inputs, see :func:`T7.prepare_stream_loop`): a scan then has
+    `nb_addresses` values and only the input columns are kept.
+
+    Do not instantiate this class directly but use
+    :func:`T7.start_input_stream`.
+
+    """
+
+    def __init__(
+        self, t7, IN_NAMES, scans_per_read, buffer_size, nb_addresses=None
+    ):
+        self.t7 = t7
+        self.names = list(IN_NAMES)
+        self.nb_channels = len(IN_NAMES)
+        if nb_addresses is None:
+            nb_addresses = self.nb_channels
+        if nb_addresses < self.nb_channels:
+            raise ValueError("nb_addresses < number of input channels")
+        # number of values per scan (inputs and stream-out addresses)
+        self.nb_addresses = nb_addresses
+        self.scans_per_read = scans_per_read
+        self.scan_rate = None
+        self.ring_buffer = RingBuffer(self.nb_channels, buffer_size)
+        self.nb_scans_read = 0
+        self.nb_skipped_scans = 0
+        self.device_backlog = 0
+        self.ljm_backlog = 0
+        self.max_device_backlog = 0
+        self.max_ljm_backlog = 0
+        self.error = None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def add_sink(self, sink):
+        """Attach a sink to the ring buffer."""
+        self.ring_buffer.add_sink(sink)
+
+    def start(self):
+        """Start the reader thread (the stream has to be started)."""
+        self._thread = threading.Thread(target=self._read_loop, daemon=True)
+        self._thread.start()
+
+    def _read_loop(self):
+        nb_values = self.scans_per_read * self.nb_addresses
+        try:
+            while not self._stop_event.is_set():
+                data, device_backlog, ljm_backlog = ljm.eStreamRead(
+                    self.t7.handle
+                )
+                data = np.asarray(data[:nb_values])
+                self._process(data, device_backlog, ljm_backlog)
+        except Exception as error:
+            self.error = error
+        finally:
+            self.ring_buffer.close()
+
+    def _process(self, data, device_backlog, ljm_backlog):
+        scans = data.reshape(-1, self.nb_addresses)
+        nb_skipped = np.count_nonzero(
+            (scans == ljm.constants.DUMMY_VALUE).any(axis=1)
+        )
+        # the inputs are the first addresses of the scan list
+        scans = scans[:, : self.nb_channels]
+        if nb_skipped:
+            self.nb_skipped_scans += int(nb_skipped)
+
+        self.device_backlog = device_backlog
+        self.ljm_backlog = ljm_backlog
+        self.max_device_backlog = max(self.max_device_backlog, device_backlog)
+        self.max_ljm_backlog = max(self.max_ljm_backlog, ljm_backlog)
+
+        self.ring_buffer.push(scans.T)
+        self.nb_scans_read += scans.shape[0]
+
+    def stop(self):
+        """Stop the reader thread and close the sinks."""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self.error is not None:
+            error = self.error
+            self.error = None
+            raise error
+
+    def print_stats(self):
+        """Print the number of scans read and skipped and the backlogs."""
+        print(
+            f"{self.nb_scans_read} scans read, "
+            f"{self.nb_skipped_scans} skipped scans, "
+            f"max backlogs: device {self.max_device_backlog}, "
+            f"LJM {self.max_ljm_backlog}"
+        )
+
+
+class StreamOutRefiller:
+    """Event-driven refill of the stream-out buffers (double buffering)
+
+    The device outputs the written values in order. The next segment can
+    be written when there is enough free space in the buffer and has to
+    be written before the device reaches the end of the written data
+    (otherwise it loops on the last segment: underrun). Instead of
+    polling ``STREAM_OUT0_BUFFER_STATUS`` in a busy loop, the refiller
+    computes from the scan rate when the space for the next segment will
+    be free, sleeps until then, checks the status once and writes the
+    segment. The time origin is resynchronized with the device at each
+    status read.
+
+    Parameters
+    ----------
+
+    t7 : :class:`T7`
+
+      A T7 whose stream-out channels have been prepared (for example
+      with :func:`T7.prepare_stream_loop`, which writes the first
+      segments).
+
+    nb_out : int
+
+      Number of stream-out channels.
+
+    scan_rate : number
+
+      Actual scan rate of the stream (returned by ``ljm.eStreamStart``).
+
+    buffer_capacity : {None, int}
+
+      Number of values in the stream-out buffers (default: computed from
+      the buffer size set by :func:`T7.prepare_stream_loop`).
+
+    """
+
+    def __init__(self, t7, nb_out, scan_rate, buffer_capacity=None):
+        self.t7 = t7
+        self.nb_out = nb_out
+        self.scan_rate = float(scan_rate)
+        if buffer_capacity is None:
+            buffer_capacity = t7.out_buffer_sizes[0] // BYTES_PER_VALUE_STREAM_OUT
+        self.buffer_capacity = buffer_capacity
+        self.nb_underruns = 0
+        self.nb_segments_written = 0
+        self.nb_status_reads = 0
+        self.max_lateness = 0.0
+        self.time_end = None
+
+    def _read_free_space(self):
+        self.nb_status_reads += 1
+        return ljm.eReadName(self.t7.handle, "STREAM_OUT0_BUFFER_STATUS")
+
+    def _write_segment(self, segment):
+        handle = self.t7.handle
+        for indout in range(self.nb_out):
+            values = segment[indout]
+            self.t7.write_out_buffer(f"STREAM_OUT{indout}_BUFFER_F32", values)
+            ljm.eWriteName(handle, f"STREAM_OUT{indout}_LOOP_SIZE", values.size)
+            ljm.eWriteName(handle, f"STREAM_OUT{indout}_SET_LOOP", 1)
+
+    def run(self, segments, nb_values_loaded, time_start):
+        """Write the segments when they are due (blocking).
+
+        Parameters
+        ----------
+
+        segments : iterable
+
+          Iterable (possibly a generator) of segments. A segment is a
+          sequence of 1d arrays (one per stream-out channel) of the same
+          size, smaller than half the buffer capacity.
+
+        nb_values_loaded : int
+
+          Number of values per channel already written in the buffers
+          before the start of the stream.
+
+        time_start : float
+
+          Time (``time.perf_counter()``) of the start of the stream.
+
+        Returns
+        -------
+
+        nb_underruns : int
+
+        """
+        scan_rate = self.scan_rate
+        capacity = self.buffer_capacity
+        nb_written = nb_values_loaded
+
+        for segment in segments:
+            size = len(segment[0])
+            if size > capacity:
+                raise ValueError("Segment larger than the stream-out buffer.")
+
+            # the space for this segment is free when the device has
+            # output nb_written + size - capacity values
+            time_due = time_start + (nb_written + size - capacity) / scan_rate
+            time_to_sleep = time_due - time.perf_counter()
+            if time_to_sleep > 0:
+                time.sleep(time_to_sleep)
+
+            while True:
+                free_space = self._read_free_space()
+                if free_space >= size:
+                    break
+                time.sleep((size - free_space) / scan_rate)
+
+            now = time.perf_counter()
+            # device time (values output) estimated from the free space
+            nb_output = nb_written - (capacity - free_space)
+            if free_space < capacity:
+                time_start = now - nb_output / scan_rate
+
+            self._write_segment(segment)
+            self.nb_segments_written += 1
+
+            # the device reaches the end of the written data at time_deadline
+            time_deadline = time_start + nb_written / scan_rate
+            lateness = time.perf_counter() - time_deadline
+            if lateness > 0:
+                self.nb_underruns += 1
+                self.max_lateness = max(self.max_lateness, lateness)
+            nb_written += size
+
+        # estimated time when the device reaches the end of the written data
+        self.time_end = time_start + nb_written / scan_rate
+
+        if self.nb_underruns:
+            print(
+                f"\nStreamOutRefiller: {self.nb_underruns} underrun(s) "
+                f"(max lateness {self.max_lateness:.4f} s)"
+            )
+
+        return self.nb_underruns
+
+    def run_periods(self, volt_splitted, nb_periods, time_start):
+        """Output `nb_periods` times a periodic signal split in segments.
+
+        Parameters
+        ----------
+
+        volt_splitted : list
+
+          For each stream-out channel, the list of segments of one period
+          (as returned by :func:`T7.prepare_stream_loop`, which has
+          already written the first segment).
+
+        nb_periods : {int, None}
+
+          If None, the signal is output until the call is interrupted
+          (KeyboardInterrupt).
+
+        time_start : float
+
+          Time (``time.perf_counter()``) of the start of the stream.
+
+        """
+        nb_segments = len(volt_splitted[0])
+
+        if nb_periods is None:
+            periods = itertools.count()
+            str_nb_periods = ""
+        else:
+            periods = range(nb_periods)
+            str_nb_periods = f"/{nb_periods}"
+
+        def segments():
+            for index_period in periods:
+                print(f"\r{index_period + 1}{str_nb_periods}", end="")
+                sys.stdout.flush()
+                # the first segment has been written before the start
+                start = 1 if index_period == 0 else 0
+                for iseg in range(start, nb_segments):
+                    yield [volt_chan[iseg] for volt_chan in volt_splitted]
+
+        return self.run(segments(), volt_splitted[0][0].size, time_start)
+
+    def wait_end(self):
+        """Sleep until the device has output all the written values.
+
+        After the last segment, the device loops on it, so the stream
+        has to be stopped just after this call.
+
+        """
+        if self.time_end is None:
+            return
+        time_to_sleep = self.time_end - time.perf_counter()
+        if time_to_sleep > 0:
+            time.sleep(time_to_sleep)
@@ -0,0 +1,167 @@
+import os
+import sys
+import importlib
+from tempfile import TemporaryDirectory
+
+import numpy as np
+import h5py
+import pytest
+
+from fluiddyn.io import stdout_redirected
+
+import fluidlab.daq
+from fluidlab.daq.rawdata import load_raw_h5
+from fluidlab.daq.sinks import CallbackSink
+
+sample_rate = 20000.0
+
+
+def _expected_signal(index_chan, nb_samples, volt_max=10.0):
+    times = np.arange(nb_samples) / sample_rate
+    return volt_max / 2 * np.sin(2 * np.pi * 10 * (index_chan + 1) * times)
+
+
+@pytest.fixture
+def daqmx(monkeypatch):
+    """Module fluidlab.daq.daqmx imported with the simulated backend."""
+    name = "fluidlab.daq.daqmx"
+    monkeypatch.setenv("FLUIDLAB_DAQMX_BACKEND", "simulated")
+    # the module possibly imported before is restored after the test
+    monkeypatch.delitem(sys.modules, name, raising=False)
+    monkeypatch.delattr(fluidlab.daq, "daqmx", raising=False)
+    yield importlib.import_module(name)
+    sys.modules.pop(name, None)
+    if hasattr(fluidlab.daq, "daqmx"):
+        del fluidlab.daq.daqmx
+
+
+def test_read_analog(daqmx):
+    with stdout_redirected():
+        data = daqmx.read_analog(
+            ["Dev1/ai0", "Dev1/ai2"],
+            "Diff",
+            -10,
+            10,
+            samples_per_chan=1000,
+            sample_rate=sample_rate,
+            verbose=True,
+        )
+    assert data.shape == (2, 1000)
+    assert np.allclose(data[1], _expected_signal(2, 1000))
+
+    data = daqmx.read_analog(
+        "Dev1/ai1",
+        "RSE",
+        -10,
+        10,
+        samples_per_chan=1000,
+        sample_rate=sample_rate,
+        raw=True,
+    )
+    assert data.raw.dtype == np.int16
+    assert np.allclose(data[0], _expected_signal(1, 1000), atol=1e-3)
+
+
+def test_read_analog_continuous(daqmx):
+    nb_samples_callback = []
+
+    def callback(chunk, index):
+        nb_samples_callback.append(chunk.shape[1])
+
+    with TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "data.h5")
+        daqmx.read_analog(
+            ["Dev1/ai0", "Dev1/ai1"],
+            "Diff",
+            -10,
+            10,
+            samples_per_chan=2500,
+            sample_rate=sample_rate,
+            output_filename=path,
+        )
+        with h5py.File(path, "r") as file:
+            data = file["data"][...]
+        assert data.shape == (2, 2500)
+        assert np.allclose(data[0], _expected_signal(0, 2500))
+
+        path = os.path.join(tmpdir, "raw.h5")
+        with daqmx.read_analog_continuous(
+            "Dev1/ai0",
+            "Diff",
+            -10,
+            10,
+            sample_rate=sample_rate,
+            samples_per_read=500,
+            buffer_duration=0.1,
+            output_filename=path,
+            sinks=[CallbackSink(callback)],
+            raw=True,
+        ) as acquisition:
+            while acquisition.nb_samples_read < 5000:
+                acquisition.wait(0.05)
+        assert acquisition.ring_buffer.size == 2000
+        assert acquisition.ring_buffer.dtype == np.int16
+
+        data = load_raw_h5(path)
+        nb_samples = data.nb_samples
+        assert nb_samples == sum(nb_samples_callback) >= 5000
+        assert np.allclose(data[0], _expected_signal(0, nb_samples), atol=1e-3)
+        data.raw.file.close()
+
+
+def test_write_analog(daqmx):
+    signals = np.cos(np.linspace(0, 2 * np.pi, 200))
+    signals = np.vstack((signals, signals + 2))
+    daqmx.write_analog(["Dev1/ao0", "Dev1/ao1"], sample_rate, signals=signals)
+
+    def make_chunks():
+        for _ in range(8):
+            yield signals
+
+    with stdout_redirected():
+        daqmx.write_analog_stream(
+            ["Dev1/ao0", "Dev1/ao1"],
+            make_chunks(),
+            sample_rate=sample_rate,
+            buffer_size=600,
+            verbose=True,
+        )
+
+    stream = daqmx.write_analog(
+        "Dev1/ao0",
+        sample_rate,
+        signals=(signals[0] for _ in range(4)),
+        blocking=False,
+    )
+    assert isinstance(stream, daqmx.AnalogOutputStream)
+    # the stream is ended as a task (waiting until it is generated)
+    daqmx.write_analog_end_task(stream, timeout=5.0)
+    assert stream.nb_samples_written == 800
+    assert not stream.underflow
+    assert stream.task is None
+
+
+def test_write_read_analog(daqmx):
+    nb_samples = 3000
+    times = np.arange(nb_samples) / sample_rate
+    signals = np.vstack(
+        (np.sin(2 * np.pi * 50 * times), np.linspace(-1, 1, nb_samples))
+    )
+    data = daqmx.write_read_analog(
+        ["Dev2/ao0", "Dev2/ao1"],
+        ["Dev2/ai1", "Dev2/ai0", "Dev2/ai3"],
+        signals,
+        sample_rate,
+        samples_per_write=400,
+        samples_per_read=500,
+        buffer_size=1200,
+    )
+    assert data.shape == (3, nb_samples)
+    # loopback aoN -> aiN
+    assert np.allclose(data[0], signals[1])
+    assert np.allclose(data[1], signals[0])
+    assert np.allclose(data[2], _expected_signal(3, nb_samples))
+
+
+def test_measure_freq(daqmx):
+    assert daqmx.measure_freq("Dev1/ctr0", 100, 400) == 200.0
@@ -0,0 +1,33 @@
+import os
+from tempfile import TemporaryDirectory
+
+import numpy as np
+
+from fluidlab.daq.rawdata import RawAnalogData, scale_raw, load_raw_h5
+
+
+def test_rawdata():
+    raw = np.arange(-10, 20, dtype=np.int16).reshape(2, 15)
+    coeffs = np.array([[0.1, 3e-4, 1e-9, 0.0], [-0.2, 6e-4, 0.0, 1e-12]])
+    expected = np.array(
+        [np.polynomial.polynomial.polyval(raw[i], coeffs[i]) for i in range(2)]
+    )
+
+    assert np.allclose(scale_raw(raw, coeffs), expected)
+
+    data = RawAnalogData(raw, coeffs, sample_rate=100.0)
+    assert np.allclose(data.to_volts(chunk_size=4), expected)
+    assert np.allclose(data[1], expected[1])
+    assert np.allclose(data[:, 3:7], expected[:, 3:7])
+    assert np.allclose(data[:, 3], expected[:, 3])
+    assert np.isclose(data[0, 2], expected[0, 2])
+    assert np.allclose(np.hstack(list(data.iter_volts(4))), expected)
+
+    with TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "raw.h5")
+        data.save(path)
+        data_file = load_raw_h5(path)
+        assert data_file.sample_rate == 100.0
+        assert data_file.raw.dtype == np.int16
+        assert np.allclose(data_file[:, 5:10], expected[:, 5:10])
+        data_file.raw.file.close()
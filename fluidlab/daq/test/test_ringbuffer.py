@@ -0,0 +1,59 @@
+import os
+from tempfile import TemporaryDirectory
+
+import numpy as np
+import h5py
+
+from fluidlab.daq.ringbuffer import RingBuffer
+from fluidlab.daq.sinks import H5Sink, DecimatorSink, CallbackSink
+
+
+def test_ringbuffer_wrap():
+    ring = RingBuffer(2, 10)
+    signal = np.arange(50, dtype=np.float64).reshape(2, 25)
+
+    for start in range(0, 25, 7):
+        ring.push(signal[:, start : start + 7])
+
+    assert ring.nb_samples_pushed == 25
+    assert np.array_equal(ring.get_last(), signal[:, -10:])
+    assert np.array_equal(ring.get_last(3), signal[:, -3:])
+
+    data, index = ring.read_since(20)
+    assert index == 25
+    assert np.array_equal(data, signal[:, 20:])
+
+    # samples overwritten are not returned
+    data, index = ring.read_since(0)
+    assert data.shape == (2, 10)
+
+    # chunk larger than the buffer
+    ring.push(np.ones((2, 23)))
+    assert np.array_equal(ring.get_last(), np.ones((2, 10)))
+
+
+def test_sinks():
+    results = []
+
+    def callback(chunk, index):
+        results.append((index, chunk.copy()))
+
+    ring = RingBuffer(2, 8)
+    ring.add_sink(DecimatorSink(4, CallbackSink(callback)))
+
+    with TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "test.h5")
+        ring.add_sink(H5Sink(path, 2, chunk_size=4, attrs={"sample_rate": 10}))
+
+        signal = np.arange(26, dtype=np.float64).reshape(2, 13)
+        ring.push(signal[:, :5])
+        ring.push(signal[:, 5:])
+        ring.close()
+
+        with h5py.File(path, "r") as file:
+            assert np.array_equal(file["data"][...], signal)
+            assert file["data"].attrs["sample_rate"] == 10
+
+    decimated = np.concatenate([chunk for _, chunk in results], axis=1)
+    assert [index for index, _ in results] == [0, 1]
+    assert np.allclose(decimated, signal[:, :12].reshape(2, 3, 4).mean(axis=2))
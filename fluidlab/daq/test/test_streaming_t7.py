@@ -0,0 +1,174 @@
+import sys
+import time
+import importlib
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import fluidlab.daq
+
+DUMMY_VALUE = -9999.0
+
+
+class FakeLJM:
+    """Minimal replacement of labjack.ljm recording the calls."""
+
+    constants = SimpleNamespace(DUMMY_VALUE=DUMMY_VALUE)
+
+    def __init__(self):
+        self.reads = []
+        self.on_last_read = None
+        self.free_spaces = []
+        self.capacity = None
+        self.names_written = []
+        self.arrays_written = []
+        # simulate a Ctrl-C after this number of arrays written
+        self.max_nb_arrays = None
+
+    def eStreamRead(self, handle):
+        result = self.reads.pop(0)
+        if not self.reads and self.on_last_read is not None:
+            self.on_last_read()
+        return result
+
+    def eReadName(self, handle, name):
+        if self.free_spaces:
+            return self.free_spaces.pop(0)
+        return self.capacity
+
+    def eWriteName(self, handle, name, value):
+        self.names_written.append((name, value))
+
+    def eWriteNameArray(self, handle, name, nb_values, values):
+        assert nb_values == len(values)
+        if len(self.arrays_written) == self.max_nb_arrays:
+            raise KeyboardInterrupt
+        self.arrays_written.append((name, np.array(values)))
+
+
+@pytest.fixture
+def ljm(monkeypatch):
+    fake = FakeLJM()
+    monkeypatch.setitem(sys.modules, "labjack", SimpleNamespace(ljm=fake))
+    return fake
+
+
+@pytest.fixture
+def streaming_t7(ljm, monkeypatch):
+    """Module fluidlab.daq.streaming_t7 imported with the fake ljm."""
+    name = "fluidlab.daq.streaming_t7"
+    monkeypatch.delitem(sys.modules, name, raising=False)
+    monkeypatch.delattr(fluidlab.daq, "streaming_t7", raising=False)
+    yield importlib.import_module(name)
+    sys.modules.pop(name, None)
+    if hasattr(fluidlab.daq, "streaming_t7"):
+        del fluidlab.daq.streaming_t7
+
+
+def _make_t7(streaming_t7, out_buffer_sizes=(512,)):
+    # no connection to a device
+    t7 = streaming_t7.T7.__new__(streaming_t7.T7)
+    t7.handle = 1
+    t7._closed = True
+    t7.input_stream = None
+    t7.max_values_per_packet = 1000
+    t7.out_buffer_sizes = list(out_buffer_sizes)
+    return t7
+
+
+def test_input_stream_in_out(streaming_t7, ljm):
+    t7 = _make_t7(streaming_t7)
+    # 2 inputs and 2 stream-out addresses in the scan list
+    stream = streaming_t7.InputStream(
+        t7, ["AIN0", "AIN1"], 3, 100, nb_addresses=4
+    )
+
+    def make_read(first, skipped=()):
+        scans = np.array(
+            [
+                [index, 10 + index, 4800, 4801]
+                for index in range(first, first + 3)
+            ],
+            dtype=float,
+        )
+        for index in skipped:
+            scans[index, :] = DUMMY_VALUE
+        return list(scans.ravel())
+
+    ljm.reads = [
+        (make_read(0), 0, 0),
+        (make_read(3, skipped=[1]), 12, 3),
+        (make_read(6), 4, 1),
+    ]
+    ljm.on_last_read = stream._stop_event.set
+    stream._read_loop()
+    stream.stop()
+
+    assert stream.nb_scans_read == 9
+    assert stream.nb_skipped_scans == 1
+    assert stream.max_device_backlog == 12
+    assert stream.max_ljm_backlog == 3
+    assert (stream.device_backlog, stream.ljm_backlog) == (4, 1)
+
+    data = stream.ring_buffer.get_last()
+    assert data.shape == (2, 9)
+    expected = np.arange(9.0)
+    expected[4] = DUMMY_VALUE
+    assert np.array_equal(data[0], expected)
+    assert np.array_equal(data[1, [0, 1, 8]], [10, 11, 18])
+
+    with pytest.raises(ValueError):
+        streaming_t7.InputStream(t7, ["AIN0", "AIN1"], 3, 100, nb_addresses=1)
+
+
+def test_refiller_run_periods(streaming_t7, ljm, capsys):
+    t7 = _make_t7(streaming_t7)
+    refiller = streaming_t7.StreamOutRefiller(t7, 1, scan_rate=1e6)
+    assert refiller.buffer_capacity == 256
+    ljm.capacity = 256
+    # not enough space at the first status read
+    ljm.free_spaces = [50]
+
+    period = np.arange(400.0)
+    volt_splitted = [np.split(period, 4)]
+    refiller.run_periods(volt_splitted, 2, time.perf_counter())
+    refiller.wait_end()
+
+    names = [name for name, _ in ljm.arrays_written]
+    assert names == ["STREAM_OUT0_BUFFER_F32"] * 7
+    written = np.concatenate([values for _, values in ljm.arrays_written])
+    # the first segment is written before the start of the stream
+    assert np.array_equal(written, np.concatenate((period[100:], period)))
+    assert ljm.names_written.count(("STREAM_OUT0_LOOP_SIZE", 100)) == 7
+    assert refiller.nb_segments_written == 7
+    assert refiller.nb_status_reads == 8
+
+
+def test_refiller_run_periods_until_interrupted(streaming_t7, ljm, capsys):
+    t7 = _make_t7(streaming_t7)
+    refiller = streaming_t7.StreamOutRefiller(t7, 1, scan_rate=1e6)
+    ljm.capacity = 256
+    ljm.max_nb_arrays = 10
+
+    volt_splitted = [np.split(np.arange(300.0), 3)]
+    with pytest.raises(KeyboardInterrupt):
+        refiller.run_periods(volt_splitted, None, time.perf_counter())
+    assert refiller.nb_segments_written == 10
+    assert "\r4" in capsys.readouterr().out
+
+
+def test_refiller_underruns(streaming_t7, ljm, capsys):
+    t7 = _make_t7(streaming_t7)
+    refiller = streaming_t7.StreamOutRefiller(t7, 2, scan_rate=1000.0)
+    ljm.capacity = 256
+    segments = [[np.zeros(100), np.ones(100)] for _ in range(3)]
+    # the device already output all the values: each segment is late
+    nb_underruns = refiller.run(segments, 100, time.perf_counter() - 10.0)
+    assert nb_underruns == 3
+    assert "3 underrun(s)" in capsys.readouterr().out
+    names = [name for name, _ in ljm.arrays_written]
+    assert names == ["STREAM_OUT0_BUFFER_F32", "STREAM_OUT1_BUFFER_F32"] * 3
+
+    with pytest.raises(ValueError):
+        refiller.run([[np.zeros(300), np.zeros(300)]], 0, time.perf_counter())
@@ -8,6 +8,9 @@
 
    session
    octavesession
+   catalogue
+   tablefiles
+   liveplot
 
 """
 
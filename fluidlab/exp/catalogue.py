@@ -0,0 +1,491 @@
+"""Catalogue of experiment files (:mod:`fluidlab.exp.catalogue`)
+==============================================================
+
+Small SQLite database indexing the files saved by the acquisitions (PIV
+runs, probe and torque measurements). Each run is registered with its
+path, its type, the time of the measurement and some scalar parameters
+(e.g. ``time_expo``, ``time_between_frames``, ``sample_rate``), so that
+runs can be found without opening the HDF5 files.
+
+The catalogue is saved by default in ``~/.fluidlab/catalogue.sqlite``.
+Another path can be given with the environment variable
+``FLUIDLAB_CATALOGUE`` or with ``catalogue_path`` in a FluidLab user
+configuration file.
+
+The catalogue of existing files can be (re)built from the command line::
+
+  python -m fluidlab.exp.catalogue rebuild ~/.fluidcoriolis
+
+and queried with::
+
+  python -m fluidlab.exp.catalogue query --kind "piv2d*" \\
+      --param time_expo=0.01 --since 2020-01-01
+
+.. autoclass:: Catalogue
+   :members:
+
+.. autofunction:: register_run
+
+"""
+
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+from glob import glob
+from datetime import datetime
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import h5py
+
+# prefixes of the file names -> kind of runs
+_kinds_from_prefix = [
+    ("piv_scan_single_frame", "piv_scan_single_frame"),
+    ("piv_scan_double_frame", "piv_scan_double_frame"),
+    ("piv2d_single_frame", "piv2d_single_frame"),
+    ("piv2d_double_frame", "piv2d_double_frame"),
+    ("multilevel_piv", "multilevel_piv"),
+    ("torque_", "torque"),
+]
+
+
+def get_default_path():
+    """Path of the default catalogue."""
+    path = os.environ.get("FLUIDLAB_CATALOGUE")
+    if path is None:
+        from fluidlab.util import userconfig
+
+        path = getattr(userconfig, "catalogue_path", None)
+    if path is None:
+        path = os.path.join(
+            os.path.expanduser("~"), ".fluidlab", "catalogue.sqlite"
+        )
+    return os.path.expanduser(path)
+
+
+def _to_timestamp(value):
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.timestamp()
+    if isinstance(value, str):
+        return datetime.fromisoformat(value).timestamp()
+    return float(value)
+
+
+class Catalogue:
+    """SQLite catalogue of experiment files.
+
+    Parameters
+    ----------
+
+    path : {None, str}
+
+      Path of the database (created if needed). The default is given by
+      :func:`get_default_path`.
+
+    """
+
+    def __init__(self, path=None):
+        if path is None:
+            path = get_default_path()
+        self.path = path
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        with self._connect() as connection:
+            connection.executescript("""
+                CREATE TABLE IF NOT EXISTS runs (
+                    path TEXT PRIMARY KEY,
+                    kind TEXT,
+                    time_measurement REAL,
+                    time_registered REAL,
+                    params TEXT
+                );
+                CREATE INDEX IF NOT EXISTS runs_kind_time
+                    ON runs (kind, time_measurement);
+                CREATE TABLE IF NOT EXISTS params (
+                    path TEXT REFERENCES runs(path) ON DELETE CASCADE,
+                    name TEXT,
+                    value REAL
+                );
+                CREATE INDEX IF NOT EXISTS params_name_value
+                    ON params (name, value);
+                CREATE INDEX IF NOT EXISTS params_path ON params (path);
+                """)
+
+    @contextmanager
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            connection.execute("PRAGMA foreign_keys = ON")
+            # commit (or rollback) the transaction
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def register(self, path, kind, time_measurement=None, **params):
+        """Add (or replace) a run.
+
+        Parameters
+        ----------
+
+        path : str
+
+        kind : str
+
+          Type of run (e.g. "piv2d_double_frame", "torque").
+
+        time_measurement : {None, float, datetime, str}
+
+          Time of the measurement (timestamp, datetime or ISO string).
+          The default is the modification time of the file.
+
+        params :
+
+          Scalar parameters of the run. The numbers can be used in the
+          queries, the other values are only stored.
+
+        """
+        self.register_many([(path, kind, time_measurement, params)])
+
+    def register_many(self, runs):
+        """Register runs given as (path, kind, time_measurement, params)."""
+        rows_runs = []
+        rows_params = []
+        now = time.time()
+        for path, kind, time_measurement, params in runs:
+            path = os.path.abspath(path)
+            time_measurement = _to_timestamp(time_measurement)
+            if time_measurement is None:
+                try:
+                    time_measurement = os.path.getmtime(path)
+                except OSError:
+                    time_measurement = now
+            params = {
+                key: value for key, value in params.items() if value is not None
+            }
+            params = {
+                key: (value.item() if isinstance(value, np.generic) else value)
+                for key, value in params.items()
+            }
+            rows_runs.append(
+                (
+                    path,
+                    kind,
+                    time_measurement,
+                    now,
+                    json.dumps(params, default=str),
+                )
+            )
+            for name, value in params.items():
+                if isinstance(value, (int, float)) and not isinstance(
+                    value, bool
+                ):
+                    rows_params.append((path, name, float(value)))
+
+        with self._connect() as connection:
+            connection.executemany(
+                "DELETE FROM runs WHERE path = ?", [row[:1] for row in rows_runs]
+            )
+            connection.executemany(
+                "INSERT INTO runs VALUES (?, ?, ?, ?, ?)", rows_runs
+            )
+            connection.executemany(
+                "INSERT INTO params VALUES (?, ?, ?)", rows_params
+            )
+
+    def remove(self, path):
+        """Remove a run from the catalogue (the file is not touched)."""
+        with self._connect() as connection:
+            connection.execute(
+                "DELETE FROM runs WHERE path = ?", (os.path.abspath(path),)
+            )
+
+    def query(self, kind=None, since=None, until=None, **params):
+        """Paths of the runs matching the criteria (in chronological order).
+
+        Parameters
+        ----------
+
+        kind : {None, str}
+
+          Type of run (glob pattern, e.g. "piv*").
+
+        since, until : {None, float, datetime, str}
+
+          Bounds of the time of the measurement.
+
+        params :
+
+          Values of parameters: a number (equality with a relative
+          tolerance of 1e-9) or a tuple (min, max) (None for no bound).
+
+        """
+        conditions = []
+        arguments = []
+        if kind is not None:
+            conditions.append("kind GLOB ?")
+            arguments.append(kind)
+        if since is not None:
+            conditions.append("time_measurement >= ?")
+            arguments.append(_to_timestamp(since))
+        if until is not None:
+            conditions.append("time_measurement <= ?")
+            arguments.append(_to_timestamp(until))
+
+        for name, value in params.items():
+            if isinstance(value, tuple):
+                vmin, vmax = value
+            else:
+                tolerance = 1e-9 * abs(value)
+                vmin, vmax = value - tolerance, value + tolerance
+            condition = "EXISTS (SELECT 1 FROM params p WHERE p.path = runs.path AND p.name = ?"
+            arguments.append(name)
+            if vmin is not None:
+                condition += " AND p.value >= ?"
+                arguments.append(vmin)
+            if vmax is not None:
+                condition += " AND p.value <= ?"
+                arguments.append(vmax)
+            conditions.append(condition + ")")
+
+        sql = "SELECT path FROM runs"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY time_measurement"
+
+        with self._connect() as connection:
+            return [row[0] for row in connection.execute(sql, arguments)]
+
+    def get_info(self, path):
+        """Kind, time of the measurement and parameters of a run."""
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT kind, time_measurement, params FROM runs WHERE path = ?",
+                (os.path.abspath(path),),
+            ).fetchone()
+        if row is None:
+            raise KeyError(path)
+        kind, time_measurement, params = row
+        return {
+            "kind": kind,
+            "time_measurement": time_measurement,
+            "params": json.loads(params),
+        }
+
+    def __len__(self):
+        with self._connect() as connection:
+            return connection.execute("SELECT COUNT(*) FROM runs").fetchone()[0]
+
+    def rebuild(self, paths, pattern="*.h5", nb_workers=None, clear=False):
+        """Scan existing files (in parallel) and register them.
+
+        Parameters
+        ----------
+
+        paths : str or sequence of str
+
+          Directories (scanned recursively with `pattern`) or files.
+
+        pattern : str
+
+        nb_workers : {None, int}
+
+          Number of processes (default: number of CPUs).
+
+        clear : bool
+
+          If True, the runs under `paths` that are not found and the
+          runs whose file no longer exists are removed from the
+          catalogue (the other runs are kept).
+
+        Returns
+        -------
+
+        nb_registered : int
+
+        """
+        if isinstance(paths, str):
+            paths = [paths]
+
+        files = []
+        dirs = []
+        for path in paths:
+            path = os.path.abspath(os.path.expanduser(path))
+            if os.path.isdir(path):
+                dirs.append(os.path.join(path, ""))
+                files.extend(
+                    glob(os.path.join(path, "**", pattern), recursive=True)
+                )
+            else:
+                files.append(path)
+        files = sorted(set(files))
+
+        if clear:
+            self._clear_not_found(dirs, files)
+
+        if len(files) < 2 or nb_workers == 1:
+            runs = [_scan_file(path) for path in files]
+        else:
+            with ProcessPoolExecutor(nb_workers) as executor:
+                runs = list(executor.map(_scan_file, files, chunksize=16))
+
+        runs = [run for run in runs if run is not None]
+        self.register_many(runs)
+        return len(runs)
+
+    def _clear_not_found(self, dirs, files):
+        """Remove the runs under `dirs` not in `files` and the missing files."""
+        files = set(files)
+        with self._connect() as connection:
+            paths = [
+                row[0] for row in connection.execute("SELECT path FROM runs")
+            ]
+            to_remove = [
+                (path,)
+                for path in paths
+                if path not in files
+                and (path.startswith(tuple(dirs)) or not os.path.exists(path))
+            ]
+            connection.executemany("DELETE FROM runs WHERE path = ?", to_remove)
+
+
+def _parse_time(value):
+    if isinstance(value, bytes):
+        value = value.decode()
+    value = str(value)
+    try:
+        # format of time.ctime (used in the files saved by fluidlab)
+        return time.mktime(time.strptime(value, "%a %b %d %H:%M:%S %Y"))
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        return None
+
+
+def _scalar(value):
+    value = np.asarray(value)
+    if value.ndim != 0 or value.dtype.kind not in "iuf":
+        return None
+    return value.item()
+
+
+def _scan_file(path):
+    """Get the information of a run from a HDF5 file (None if unknown)."""
+    name = os.path.basename(path)
+    kind = None
+    for prefix, kind_prefix in _kinds_from_prefix:
+        if name.startswith(prefix):
+            kind = kind_prefix
+            break
+
+    params = {}
+    time_measurement = None
+    try:
+        with h5py.File(path, "r") as file:
+            if kind is None and "voltrho" in file:
+                kind = "mscti_probe"
+            if kind is None:
+                return None
+
+            for key, value in file.attrs.items():
+                scalar = _scalar(value)
+                if scalar is not None:
+                    params[key] = scalar
+            for key, value in file.items():
+                if isinstance(value, h5py.Dataset) and value.shape == ():
+                    scalar = _scalar(value[()])
+                    if scalar is not None:
+                        params[key] = scalar
+
+            for key in ("t_start", "date"):
+                if key in file:
+                    time_measurement = _parse_time(file[key][()])
+            if "time start" in file.attrs:
+                time_measurement = _parse_time(file.attrs["time start"])
+
+            if "sample_rate" not in params and "t" in file:
+                times = file["t"]
+                if times.ndim == 1 and times.size > 1:
+                    params["sample_rate"] = float(1.0 / (times[1] - times[0]))
+    except OSError:
+        return None
+
+    return path, kind, time_measurement, params
+
+
+def register_run(path, kind, time_measurement=None, **params):
+    """Register a run in the default catalogue.
+
+    Errors are printed but not raised, since the catalogue is only an
+    index of the files.
+
+    """
+    try:
+        Catalogue().register(path, kind, time_measurement, **params)
+    except Exception as error:
+        # the measurement must not be aborted by the catalogue
+        print(
+            f"Warning: {path} not registered in the catalogue "
+            f"({type(error).__name__}: {error})"
+        )
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m fluidlab.exp.catalogue",
+        description="Catalogue of experiment files",
+    )
+    parser.add_argument("--db", help="path of the catalogue", default=None)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    parser_rebuild = subparsers.add_parser("rebuild", help="scan files")
+    parser_rebuild.add_argument("paths", nargs="+")
+    parser_rebuild.add_argument("--pattern", default="*.h5")
+    parser_rebuild.add_argument("-n", "--nb-workers", type=int, default=None)
+    parser_rebuild.add_argument("--clear", action="store_true")
+
+    parser_query = subparsers.add_parser("query", help="print paths")
+    parser_query.add_argument("--kind", default=None)
+    parser_query.add_argument("--since", default=None)
+    parser_query.add_argument("--until", default=None)
+    parser_query.add_argument(
+        "--param",
+        action="append",
+        default=[],
+        help="name=value or name=min:max",
+    )
+
+    args = parser.parse_args(args)
+    catalogue = Catalogue(args.db)
+
+    if args.command == "rebuild":
+        nb_registered = catalogue.rebuild(
+            args.paths, args.pattern, args.nb_workers, args.clear
+        )
+        print(f"{nb_registered} runs registered in {catalogue.path}")
+        return
+
+    params = {}
+    for param in args.param:
+        name, value = param.split("=", 1)
+        if ":" in value:
+            vmin, vmax = (float(v) if v else None for v in value.split(":", 1))
+            params[name] = (vmin, vmax)
+        else:
+            params[name] = float(value)
+
+    for path in catalogue.query(args.kind, args.since, args.until, **params):
+        sys.stdout.write(path + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+"""Live plots of data tables (:mod:`fluidlab.exp.liveplot`)
+=========================================================
+
+A :class:`LivePlot` follows the evolution of variables with one line
+per variable, updated with `set_data`. The cost of an update does not
+depend on the number of points already plotted:
+
+- the recent points are kept at full resolution in a
+  :class:`fluidlab.daq.ringbuffer.RingBuffer`,
+
+- the older points are kept in a decimated history (the minimum and
+  the maximum for each interval, so that peaks stay visible),
+
+- the lines are decimated (min/max) to the pixel width of the axes,
+
+- the figure is redrawn with blitting (only the lines are redrawn,
+  except when the limits of the axes have to be extended).
+
+.. autoclass:: LivePlot
+   :members:
+
+.. autofunction:: decimate_minmax
+
+"""
+
+import numpy as np
+import matplotlib.pyplot as plt
+
+from fluidlab.daq.ringbuffer import RingBuffer
+
+
+def decimate_minmax(x, y, nb_bins):
+    """Decimate a line keeping the minimum and the maximum of each bin.
+
+    The points are split in at most `nb_bins` bins with the same number
+    of points (except the last one). Returns at most `2 * nb_bins`
+    points, in the order of `x`.
+
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    if x.size <= 2 * nb_bins:
+        return x, y
+
+    nb_points_bin = -(-x.size // nb_bins)
+    nb_full_bins = x.size // nb_points_bin
+    nb_points = nb_full_bins * nb_points_bin
+    bins = y[:nb_points].reshape(nb_full_bins, nb_points_bin)
+    indices = np.empty((nb_full_bins, 2), dtype=int)
+    indices[:, 0] = np.argmin(bins, axis=1)
+    indices[:, 1] = np.argmax(bins, axis=1)
+    indices += nb_points_bin * np.arange(nb_full_bins)[:, np.newaxis]
+    indices = indices.ravel()
+
+    if nb_points < x.size:
+        # incomplete last bin
+        last = y[nb_points:]
+        indices = np.append(
+            indices, nb_points + np.array([np.argmin(last), np.argmax(last)])
+        )
+
+    indices = np.unique(indices)
+    return x[indices], y[indices]
+
+
+class LivePlot:
+    """Figure following the evolution of variables.
+
+    Parameters
+    ----------
+
+    varnames : list
+
+      Names of the variables (one line per variable).
+
+    nb_points_full : int
+
+      Number of recent points kept at full resolution.
+
+    xlabel : str
+
+    """
+
+    def __init__(self, varnames, nb_points_full=10000, xlabel="time"):
+        self.varnames = list(varnames)
+        self.ring = RingBuffer(1 + len(self.varnames), nb_points_full)
+        self._history = {key: (np.empty(0), np.empty(0)) for key in varnames}
+
+        self.fig = fig = plt.figure()
+        self.ax = ax = fig.gca()
+        self.lines = {}
+        for key in self.varnames:
+            self.lines[key] = ax.plot([], [], label=key, animated=True)[0]
+        ax.set_xlabel(xlabel)
+        ax.legend(loc=3)
+
+        self._limits = None
+        self._background = None
+        self._cid = fig.canvas.mpl_connect("draw_event", self._on_draw)
+
+    def _get_nb_pixels(self):
+        return max(int(self.ax.bbox.width), 1)
+
+    def _on_draw(self, event):
+        """Store the background and draw the lines (after a full draw)."""
+        canvas = self.fig.canvas
+        if getattr(canvas, "supports_blit", False):
+            self._background = canvas.copy_from_bbox(self.fig.bbox)
+        self._draw_lines()
+
+    def _draw_lines(self):
+        for line in self.lines.values():
+            self.ax.draw_artist(line)
+
+    def _add_to_history(self, data):
+        """Add points leaving the ring buffer to the decimated history."""
+        nb_pixels = self._get_nb_pixels()
+        x_new = data[0]
+        for ikey, key in enumerate(self.varnames, 1):
+            x, y = self._history[key]
+            x = np.concatenate((x, x_new))
+            y = np.concatenate((y, data[ikey]))
+            # bounded size (min/max of min/max keep the extrema)
+            if x.size > 8 * nb_pixels:
+                x, y = decimate_minmax(x, y, 2 * nb_pixels)
+            self._history[key] = (x, y)
+
+    def update(self, x, values):
+        """Add new points and redraw the lines.
+
+        Parameters
+        ----------
+
+        x : array_like
+
+        values : dict
+
+          Arrays (same size as `x`) for the variables.
+
+        """
+        x = np.asarray(x, dtype=np.float64)
+        if x.size == 0:
+            return
+        chunk = np.empty((1 + len(self.varnames), x.size))
+        chunk[0] = x
+        for ikey, key in enumerate(self.varnames, 1):
+            chunk[ikey] = values[key]
+
+        ring = self.ring
+        nb_in_ring = min(ring.nb_samples_pushed, ring.size)
+        nb_leaving = nb_in_ring + x.size - ring.size
+        if nb_leaving > 0:
+            older = np.hstack((ring.get_last(), chunk))
+            self._add_to_history(older[:, :nb_leaving])
+        ring.push(chunk)
+
+        self.redraw()
+
+    def get_line_data(self, key):
+        """Data plotted for a variable (history and recent points)."""
+        recent = self.ring.get_last()
+        x_hist, y_hist = self._history[key]
+        x = np.concatenate((x_hist, recent[0]))
+        y = np.concatenate((y_hist, recent[1 + self.varnames.index(key)]))
+        return decimate_minmax(x, y, self._get_nb_pixels())
+
+    def _compute_limits(self, xmin, xmax, ymin, ymax):
+        """Limits with margins, so that they are rarely changed."""
+        if self._limits is not None:
+            xlim0, xlim1, ylim0, ylim1 = self._limits
+            if (
+                xlim0 <= xmin
+                and xmax <= xlim1
+                and ylim0 <= ymin
+                and ymax <= ylim1
+            ):
+                return self._limits
+        dx = xmax - xmin or 1.0
+        dy = ymax - ymin or 1.0
+        return (xmin, xmax + 0.25 * dx, ymin - 0.1 * dy, ymax + 0.1 * dy)
+
+    def redraw(self):
+        """Set the data of the lines and redraw them."""
+        xmin = ymin = np.inf
+        xmax = ymax = -np.inf
+        for key, line in self.lines.items():
+            x, y = self.get_line_data(key)
+            line.set_data(x, y)
+            if x.size:
+                xmin = min(xmin, x[0])
+                xmax = max(xmax, x[-1])
+            if np.any(np.isfinite(y)):
+                ymin = min(ymin, np.nanmin(y))
+                ymax = max(ymax, np.nanmax(y))
+        if not np.isfinite([xmin, xmax, ymin, ymax]).all():
+            return
+
+        canvas = self.fig.canvas
+        limits = self._compute_limits(xmin, xmax, ymin, ymax)
+        if limits != self._limits or self._background is None:
+            self._limits = limits
+            self.ax.set_xlim(limits[:2])
+            self.ax.set_ylim(limits[2:])
+            # full draw (the lines are drawn by _on_draw)
+            canvas.draw()
+        else:
+            canvas.restore_region(self._background)
+            self._draw_lines()
+            canvas.blit(self.fig.bbox)
+        canvas.flush_events()
+
+    def close(self):
+        """Close the figure."""
+        self.fig.canvas.mpl_disconnect(self._cid)
+        plt.close(self.fig)
@@ -20,25 +20,36 @@ Provides:
    :members:
    :private-members:
 
+.. autoclass:: DataTableProxy
+   :members:
+
 """
 
 from __future__ import print_function
 
 import os
 from glob import glob
-import csv
 import time
 from copy import copy
 
 import numpy as np
-import matplotlib.pyplot as plt
 
 from fluiddyn.util.logger import Logger
 from fluiddyn.io import FLUIDLAB_PATH
 from fluiddyn.io.hdf5 import H5File
-from fluiddyn.io.mycsv import CSVFile
 from fluiddyn.util import time_as_str
 
+from fluidlab.exp.tablefiles import (
+    CSVTableFile,
+    H5TableFile,
+    BinTableFile,
+    SegmentedTableFile,
+    BackgroundWriter,
+    get_segments_dir,
+    is_segmented,
+    install_signal_handlers,
+)
+
 
 class Session:
     """Experimental session
@@ -51,6 +62,11 @@ class Session:
     It can create managers of data tables for saving, loading and
     plotting data time series (see :class:`fluidlab.exp.session.DataTable`).
 
+    The data tables are indexed in the session file (names, fieldnames,
+    numbers of rows and time spans). When an existing session is
+    loaded, `data_tables` contains :class:`DataTableProxy` objects,
+    which open the files only when they are used.
+
 
     Parameters
     ----------
@@ -70,6 +86,25 @@ class Session:
     email_delay : {None, int}
        Time is second between two emails.
 
+    email_server : str
+
+    background_writer : {False, True}
+       If True, the rows saved by the data tables are written by a
+       thread (see :class:`fluidlab.exp.tablefiles.BackgroundWriter`).
+       The errors of the thread are then raised by the next `save` or
+       `flush`.
+
+    writer_queue_size : int
+       Maximum number of rows waiting to be written.
+
+    writer_policy : {"block", "drop", "spill"}
+       Behavior of `DataTable.save` when the queue is full.
+
+    handle_signals : {False, True}
+       If True, the files of the data tables are also closed when the
+       process is terminated with SIGTERM or SIGHUP (see
+       :func:`fluidlab.exp.tablefiles.install_signal_handlers`).
+
     """
 
     def __init__(
@@ -82,6 +117,10 @@ class Session:
         email_title=None,
         email_delay=None,
         email_server="localhost",
+        background_writer=False,
+        writer_queue_size=10000,
+        writer_policy="block",
+        handle_signals=False,
     ):
 
         if not save_in_dir and path is None:
@@ -145,11 +184,17 @@ class Session:
 
         self.info = info
 
-        if self._new_session:
-            self.data_tables = {}
+        if handle_signals:
+            install_signal_handlers()
+
+        if background_writer:
+            self._writer = BackgroundWriter(writer_queue_size, writer_policy)
         else:
-            # should be initialized in a better way (loaded from files?)
-            self.data_tables = {}
+            self._writer = None
+
+        self.data_tables = {}
+        if not self._new_session:
+            self._load_data_tables()
 
         path_log_file = os.path.join(self.path, self._base_name_files + "log.txt")
 
@@ -181,10 +226,252 @@ class Session:
         See :class:`fluidlab.exp.session.DataTable`.
 
         """
-        if name not in self.data_tables:
-            self.data_tables[name] = DataTable(name, session=self, **kargs)
+        data_table = self.data_tables.get(name)
+        if isinstance(data_table, DataTableProxy):
+            data_table = self.data_tables[name] = data_table.open()
+        elif data_table is None:
+            kargs.setdefault("writer", self._writer)
+            data_table = DataTable(name, session=self, **kargs)
+            self.data_tables[name] = data_table
+            self._index_data_table(data_table)
+
+        return data_table
+
+    def _read_data_tables_info(self):
+        with H5File(self.path_session_file, "r") as file:
+            if "data_tables" not in file:
+                return {}
+            return {
+                name: dict(group.attrs)
+                for name, group in file["data_tables"].items()
+            }
+
+    def _write_data_tables_info(self, infos, remove=()):
+        with H5File(self.path_session_file, "a") as file:
+            groups = file.require_group("data_tables")
+            for name in remove:
+                del groups[name]
+            for name, info in infos.items():
+                group = groups.require_group(name)
+                for key, value in info.items():
+                    group.attrs[key] = value
+
+    def _load_data_tables(self):
+        """Index the data tables and create the proxies.
+
+        Only the table files modified since they were indexed (or not
+        yet indexed) are opened.
+
+        """
+        infos = self._read_data_tables_info()
+        paths = {
+            name: os.path.join(self.path, info["file"])
+            for name, info in infos.items()
+        }
+        if self._base_name_files == "":
+            # the directory only contains the files of the session
+            for extension in DataTable._supported_extensions:
+                for path in glob(os.path.join(self.path, "*." + extension)):
+                    if path == self.path_session_file:
+                        continue
+                    name = os.path.splitext(os.path.basename(path))[0]
+                    paths.setdefault(name, path)
+                # segmented tables
+                pattern = get_segments_dir(
+                    os.path.join(self.path, "*." + extension)
+                )
+                for path_dir in glob(pattern):
+                    path = path_dir[: -len(get_segments_dir(""))]
+                    name = os.path.splitext(os.path.basename(path))[0]
+                    paths.setdefault(name, path)
+
+        to_update = {}
+        to_remove = []
+        for name, path in paths.items():
+            if not (os.path.isfile(path) or is_segmented(path)):
+                to_remove.append(name)
+                infos.pop(name)
+                continue
+            file_info = _get_file_info(path)
+            info = infos.get(name)
+            if (
+                info is not None
+                and info["size"] == file_info["size"]
+                and info["mtime"] == file_info["mtime"]
+            ):
+                continue
+            try:
+                info = _read_table_info(path)
+            except (ValueError, KeyError, OSError):
+                # not a data table
+                continue
+            infos[name] = to_update[name] = info
+
+        if to_update or to_remove:
+            self._write_data_tables_info(to_update, to_remove)
+
+        for name, info in infos.items():
+            self.data_tables[name] = DataTableProxy(self, name, info)
+
+    def _save_data_tables_info(self, data_tables):
+        infos = {}
+        for data_table in data_tables:
+            info = data_table._file.get_info()
+            # the file is closed (reopened if needed) before its size and
+            # time are stored
+            data_table._file.close()
+            info.update(_get_file_info(data_table.path))
+            infos[data_table.name] = info
+        self._write_data_tables_info(infos)
+
+    def _index_data_table(self, data_table):
+        """Index a new data table without closing its file.
+
+        If the file is modified before it is closed, the entry is
+        updated by :func:`close` (or when the session is loaded).
+
+        """
+        info = data_table._file.get_info()
+        info.update(_get_file_info(data_table.path))
+        self._write_data_tables_info({data_table.name: info})
+
+    def flush(self):
+        """Write all the rows saved before the call (barrier)."""
+        if self._writer is not None:
+            self._writer.flush()
+        for data_table in self.data_tables.values():
+            data_table.flush()
+
+    def close(self):
+        """Flush and close the files of the data tables."""
+        if self._writer is not None:
+            self._writer.close()
+        data_tables = []
+        for data_table in self.data_tables.values():
+            if isinstance(data_table, DataTableProxy):
+                data_table = data_table._data_table
+                if data_table is None:
+                    continue
+            data_table.close()
+            data_tables.append(data_table)
+        if data_tables:
+            self._save_data_tables_info(data_tables)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def _import_pyplot():
+    """Import matplotlib.pyplot (only to plot) in interactive mode.
+
+    matplotlib is not imported with this module, which can then be used
+    without display and imports faster.
+
+    """
+    import matplotlib.pyplot as plt
+
+    plt.ion()
+    return plt
+
+
+def _get_file_info(path):
+    if is_segmented(path):
+        # total size and last modification of the segments
+        stats = [entry.stat() for entry in os.scandir(get_segments_dir(path))]
+        size = sum(stat.st_size for stat in stats)
+        mtime = max(stat.st_mtime for stat in stats)
+    else:
+        stat = os.stat(path)
+        size = stat.st_size
+        mtime = stat.st_mtime
+    return {
+        "file": os.path.basename(path),
+        "extension": os.path.splitext(path)[1][1:],
+        "size": size,
+        "mtime": mtime,
+    }
+
+
+def _read_table_info(path):
+    """Open a table file to get its fieldnames, size and time span."""
+    extension = os.path.splitext(path)[1][1:]
+    cls = DataTable._table_file_classes[extension]
+    if is_segmented(path):
+        table_file = SegmentedTableFile(path)
+    elif cls is H5TableFile:
+        # the file is not modified
+        table_file = cls(path, readonly=True)
+    else:
+        table_file = cls(path)
+    try:
+        info = table_file.get_info()
+    finally:
+        table_file.close()
+    info.update(_get_file_info(path))
+    return info
+
+
+class DataTableProxy:
+    """Data table of a loaded session, opened when it is used.
+
+    The attributes `name`, `path`, `extension`, `fieldnames`,
+    `varnames`, `nb_rows`, `time_start` and `time_stop` come from the
+    session file and do not need to read the table. Other attributes
+    and methods are those of the :class:`DataTable`, which is then
+    created.
+
+    """
+
+    def __init__(self, session, name, info):
+        self._session = session
+        self._data_table = None
+        self._info = info
+        self.name = name
+        self.path = os.path.join(session.path, info["file"])
+        self.extension = info["extension"]
+        self.fieldnames = [str(key) for key in info["fieldnames"]]
+        self.varnames = [
+            key for key in self.fieldnames if key not in ("time", "clock")
+        ]
+        self.time_start = info["time_start"]
+        self.time_stop = info["time_stop"]
+
+    @property
+    def nb_rows(self):
+        """Number of rows (from the session file if the table is not open)."""
+        if self._data_table is None:
+            return int(self._info["nb_rows"])
+        return self._data_table.get_nb_times_saved()
+
+    def open(self):
+        """Create (once) and return the data table."""
+        if self._data_table is None:
+            self._data_table = DataTable(
+                path=self.path, writer=self._session._writer
+            )
+        return self._data_table
+
+    def __getattr__(self, key):
+        if key.startswith("_"):
+            raise AttributeError(key)
+        return getattr(self.open(), key)
 
-        return self.data_tables[name]
+    def flush(self):
+        """Flush the data table (if it is open)."""
+        if self._data_table is not None:
+            self._data_table.flush()
+
+    def close(self):
+        """Close the data table (if it is open)."""
+        if self._data_table is not None:
+            self._data_table.close()
+
+    def __repr__(self):
+        state = "open" if self._data_table is not None else "not open"
+        return f"<DataTableProxy {self.name!r} ({self.nb_rows} rows, {state})>"
 
 
 class DataTable:
@@ -202,8 +489,12 @@ class DataTable:
     session : {None, fluidlab.exp.session.Session}, optional
       A session used to get its path.
 
-    extension : {None, 'csv'}, optional
-      An extension defining in which format the data is saved.
+    extension : {None, 'csv', 'h5', 'bin'}, optional
+      An extension defining in which format the data is saved. With
+      'h5', each column is a dataset of a HDF5 file written in SWMR mode
+      (see :class:`fluidlab.exp.tablefiles.H5TableFile`). With 'bin',
+      the rows are binary records and `load` returns views of a memmap
+      of the file (see :class:`fluidlab.exp.tablefiles.BinTableFile`).
 
     fieldnames : {None, array_like}, optional
       An array_like of strings.
@@ -212,9 +503,32 @@ class DataTable:
 
     add_clock : {True, False}, optional
 
+    buffer_size : int, optional
+      Number of rows buffered before writing to the file.
+
+    flush_period : float, optional
+      Maximum time (in s) during which a row stays in the buffer (checked
+      when a row is saved). Use :func:`flush` to write the rows before.
+
+    writer : {None, fluidlab.exp.tablefiles.BackgroundWriter}, optional
+      Thread writing the rows (by default the one of the session).
+
+    rotate_size : {None, int}, optional
+      Maximum size (in bytes) of the files. If given (or if
+      `rotate_period` is given), the table is saved in segment files
+      (see :class:`fluidlab.exp.tablefiles.SegmentedTableFile`).
+
+    rotate_period : {None, float}, optional
+      Maximum time span (in s) of the segment files.
+
     """
 
-    _supported_extensions = ["csv"]
+    _table_file_classes = {
+        "csv": CSVTableFile,
+        "h5": H5TableFile,
+        "bin": BinTableFile,
+    }
+    _supported_extensions = list(_table_file_classes)
 
     def __init__(
         self,
@@ -225,9 +539,12 @@ class DataTable:
         fieldnames=None,
         add_time=True,
         add_clock=True,
+        buffer_size=100,
+        flush_period=1.0,
+        writer=None,
+        rotate_size=None,
+        rotate_period=None,
     ):
-        plt.ion()
-
         if session is not None and path is not None:
             raise ValueError(
                 "Only one of the arguments `session` and `path` "
@@ -261,7 +578,7 @@ class DataTable:
             else:
                 extension = extension_name
 
-        elif os.path.isfile(path):
+        elif os.path.isfile(path) or is_segmented(path):
             # path should correspond to a data table file
             if name is not None:
                 raise ValueError(
@@ -276,7 +593,7 @@ class DataTable:
                 )
 
             # we have to load `name` from the file
-            name = os.path.split(path)
+            name = os.path.split(path)[1]
             name, extension = os.path.splitext(name)
             extension = extension[1:]
 
@@ -294,26 +611,30 @@ class DataTable:
             if add_time and "time" not in fieldnames:
                 fieldnames.insert(0, "time")
 
-        if not os.path.isfile(path):
-            # we have to create the file
-            if fieldnames is None:
-                raise ValueError(
-                    "For new data table, the argument "
-                    "`fieldnames` has to be given."
-                )
-
-            with open(path, "w") as csvfile:
-                writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-                writer.writeheader()
+        # create the file or check its header
+        cls = self._table_file_classes[extension]
+        if (
+            rotate_size is not None
+            or rotate_period is not None
+            or is_segmented(path)
+        ):
+            self._file = SegmentedTableFile(
+                path,
+                fieldnames,
+                cls,
+                max_size=rotate_size,
+                max_duration=rotate_period,
+                buffer_size=buffer_size,
+                flush_period=flush_period,
+            )
         else:
-            # the file already exists
-            with open(path, "r") as csvfile:
-                reader = csv.DictReader(csvfile)
-                if fieldnames is not None and fieldnames != reader.fieldnames:
-                    raise ValueError(
-                        "`fieldnames` does not correspond to the content "
-                        "of the file."
-                    )
+            self._file = cls(
+                path,
+                fieldnames,
+                buffer_size=buffer_size,
+                flush_period=flush_period,
+            )
+        fieldnames = self._file.fieldnames
 
         self.path = path
         self.name = name
@@ -329,99 +650,192 @@ class DataTable:
 
         self.add_time = add_time
         self.add_clock = add_clock
+        self._writer = writer
 
         self.figures = []
+        # index of the next row returned by load_new_rows
+        self._index_new_rows = 0
+
+    def init_figure(self, varnames=None, live=False, nb_points_full=10000):
+        """Initialize a figure to follow the evolution of variables.
 
-    def init_figure(self, varnames=None):
-        """Initialize a figure to follow the evolution of variables."""
+        With `live=True`, the figure is a
+        :class:`fluidlab.exp.liveplot.LivePlot` (one line per variable,
+        decimated and redrawn with blitting), for which the cost of an
+        update does not grow with the length of the table. The last
+        `nb_points_full` points are plotted at full resolution.
+
+        """
 
         if varnames is None:
             varnames = self.varnames
 
-        fig = self.plot_vs_time(varnames)
+        if not live:
+            fig = self.plot_vs_time(varnames)
+            fig._live_plot = None
+        else:
+            _import_pyplot()
+            from fluidlab.exp.liveplot import LivePlot
+
+            live_plot = LivePlot(
+                varnames,
+                nb_points_full=nb_points_full,
+                xlabel="time" if self.add_time or self.add_clock else "index",
+            )
+            fig = live_plot.fig
+            fig._live_plot = live_plot
+            fig._nb_points_plotted = 0
 
         fig._varnames = varnames
         self.figures.append(fig)
+        if live:
+            self.update_figures()
 
     def get_nb_times_saved(self):
-        with open(self.path) as f:
-            num_lines = sum(1 for line in f)
+        """Number of rows saved (without reading the file)."""
+        if self._writer is not None:
+            self._writer.flush()
+        return self._file.nb_rows
 
-        return num_lines - 1
+    def load_new_rows(self, fieldnames=None):
+        """Load the rows saved since the previous call.
+
+        Only the end of the file is parsed.
+
+        """
+        self.flush()
+        data, self._index_new_rows = self._file.read_rows(
+            self._index_new_rows, fieldnames
+        )
+        return data
 
     def update_figures(self):
         """Update all active figures of the data table."""
+        if not self.figures:
+            return
+
+        varnames = []
         for fig in self.figures:
-            ax = fig.get_axes()[0]
-            varnames = fig._varnames
-            nb_points_plotted = fig._nb_points_plotted
-            nb_times = self.get_nb_times_saved()
-            nb_points_to_plot = nb_times - nb_points_plotted
+            varnames.extend(k for k in fig._varnames if k not in varnames)
 
-            assert nb_points_to_plot >= 0
+        if self.add_time:
+            fieldnames = ["time"] + varnames
+        elif self.add_clock:
+            fieldnames = ["clock"] + varnames
+        else:
+            fieldnames = varnames
 
-            if nb_points_to_plot == 0:
-                continue
+        self.flush()
+        # the new rows are parsed only once for all the figures
+        index_start = min(fig._nb_points_plotted for fig in self.figures)
+        d, index_stop = self._file.read_rows(index_start, fieldnames)
 
-            if self.add_time:
-                fieldnames = ["time"] + varnames
-            elif self.add_clock:
-                fieldnames = ["clock"] + varnames
+        if self.add_time:
+            times = d["time"]
+        elif self.add_clock:
+            times = d["clock"]
+        else:
+            times = np.arange(index_start, index_stop, dtype=int)
 
-            d = self.load(fieldnames, skiptimes=nb_points_plotted)
+        for fig in self.figures:
+            ax = fig.get_axes()[0]
+            nb_points_plotted = fig._nb_points_plotted
+            if nb_points_plotted == index_stop:
+                continue
 
-            if self.add_time:
-                time = d.pop("time")
-            elif self.add_clock:
-                time = d.pop("clock")
-            else:
-                time = np.arange(
-                    nb_points_plotted,
-                    nb_points_plotted + nb_points_to_plot,
-                    dtype=int,
+            first = nb_points_plotted - index_start
+            if fig._live_plot is not None:
+                fig._live_plot.update(
+                    times[first:], {k: d[k][first:] for k in fig._varnames}
                 )
+                fig._nb_points_plotted = index_stop
+                continue
 
-            for k in varnames:
-                ax.plot(time, d[k], "x" + fig._colors[k])
+            for k in fig._varnames:
+                ax.plot(times[first:], d[k][first:], "x", color=fig._colors[k])
 
-            fig._nb_points_plotted += nb_points_to_plot
+            fig._nb_points_plotted = index_stop
             fig.canvas.draw()
 
-        plt.show()
+        _import_pyplot().show()
 
     def save(self, dict_to_save):
         """Save the data contained in the dict `dict_to_save`."""
 
         if self.add_clock and "clock" not in dict_to_save:
-            dict_to_save["clock"] = time.clock()
+            # time.clock has been removed in Python 3.8
+            dict_to_save["clock"] = time.perf_counter()
         if self.add_time and "time" not in dict_to_save:
             dict_to_save["time"] = time.time()
 
-        with open(self.path, "a") as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=self.fieldnames)
-            writer.writerow(dict_to_save)
+        if self._writer is None:
+            self._file.append(dict_to_save)
+        else:
+            self._writer.put(self._file, dict_to_save)
+
+    def flush(self):
+        """Write the buffered rows to the file."""
+        if self._writer is not None:
+            self._writer.flush()
+        self._file.flush()
+
+    def close(self):
+        """Flush and close the file (reopened if data is saved later)."""
+        if self._writer is not None:
+            self._writer.flush()
+        self._file.close()
+
+    def load(self, fieldnames=None, skiptimes=0, t_start=None, t_stop=None):
+        """Load the data contained in the files as a dict.
+
+        If `t_start` or `t_stop` is given (same unit as the column
+        "time"), only the rows of this time range are read (using a
+        sparse index of the file).
 
-    def load(self, fieldnames=None, skiptimes=0):
-        """Load the data contained in the files as a dict."""
+        """
         if fieldnames is None:
             fieldnames = self.fieldnames
 
-        with CSVFile(self.path) as f:
-            d = f.load_as_dict(keys=fieldnames, skiptimes=skiptimes)
+        self.flush()
+        return self._file.load(
+            fieldnames, skiptimes=skiptimes, t_start=t_start, t_stop=t_stop
+        )
 
-        return d
+    def load_overview(
+        self, t_start=None, t_stop=None, max_points=1000, varnames=None
+    ):
+        """Load a summary of a time range with at most `max_points` points.
 
-    def plot_vs_time(self, varnames=None):
-        """Plot the evolution of variables."""
+        Returns a dict with the keys "time", "<name>_min", "<name>_max"
+        and "<name>_mean" (see
+        :func:`fluidlab.exp.tablefiles.TableFile.load_overview`).
+
+        """
+        self.flush()
+        return self._file.load_overview(t_start, t_stop, max_points, varnames)
+
+    def plot_vs_time(self, varnames=None, max_points=None):
+        """Plot the evolution of variables.
+
+        If `max_points` is given, the figure is made from the summaries
+        of the table (mean, and min/max as a shaded area) so that long
+        tables are plotted quickly.
+
+        """
         if varnames is None:
             varnames = self.varnames
 
+        if max_points is not None and self.add_time:
+            return self._plot_overview(varnames, max_points)
+
         if self.add_time:
             fieldnames = ["time"] + varnames
         elif self.add_clock:
             fieldnames = ["clock"] + varnames
 
-        d = self.load(fieldnames)
+        self.flush()
+        # read_rows also moves the cursor used to read the new rows
+        d, _ = self._file.read_rows(0, fieldnames)
 
         if self.add_time:
             time = d.pop("time")
@@ -431,6 +845,7 @@ class DataTable:
             arr = d.popitem()
             time = np.arange(arr.size, dtype=int)
 
+        plt = _import_pyplot()
         fig = plt.figure()
         fig._nb_points_plotted = time.size
         ax = plt.gca()
@@ -445,6 +860,28 @@ class DataTable:
         plt.show()
         return fig
 
+    def _plot_overview(self, varnames, max_points):
+        data = self.load_overview(max_points=max_points, varnames=varnames)
+        time = data["time"]
+
+        plt = _import_pyplot()
+        fig = plt.figure()
+        fig._nb_points_plotted = self._file.nb_rows
+        ax = plt.gca()
+
+        fig._colors = {}
+        for k in varnames:
+            line = ax.plot(time, data[k + "_mean"], label=k)[0]
+            fig._colors[k] = color = line.get_color()
+            ax.fill_between(
+                time, data[k + "_min"], data[k + "_max"], color=color, alpha=0.3
+            )
+
+        ax.set_xlabel("time")
+        plt.legend(loc=3)
+        plt.show()
+        return fig
+
 
 class SessionWithDefaultParams(Session):
     """Not implemented"""
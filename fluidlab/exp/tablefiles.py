@@ -0,0 +1,1793 @@
+"""Files of data tables (:mod:`fluidlab.exp.tablefiles`)
+======================================================
+
+Classes used by :class:`fluidlab.exp.session.DataTable` to write and
+read the files of the data tables.
+
+The rows are not written one by one: a table file keeps the file open
+and buffers the rows, which are written when the buffer is full, when
+the last write is older than `flush_period` or when :func:`flush` is
+called. The open table files are flushed and closed at the exit of the
+interpreter. To do the same when the process is terminated with SIGTERM
+or SIGHUP, call :func:`install_signal_handlers` (or use
+``Session(handle_signals=True)``).
+
+A table file also keeps the number of rows and the position (row index
+and byte offset) of the last row read, so that the rows appended since
+the previous read are loaded without parsing the file from the start
+(see :func:`CSVTableFile.read_rows`).
+
+If the table has a column "time", a sparse index is written next to
+the table (file with the extension ".idx"). It contains the time, the
+row index and the offset (in bytes for CSV files) of one row every
+`index_period` rows and is updated when rows are written. It is used
+by :func:`TableFile.read_time_range` to read only the rows of a time
+range (the times are assumed to be increasing).
+
+The table files with a column "time" also maintain a
+:class:`SummaryPyramid` (minimum, maximum and mean of the columns for
+blocks of 10, 100 and 1000 rows), used by
+:func:`TableFile.load_overview` to load a long time range with a
+limited number of points.
+
+A table can also be rotated in segment files (by size or duration, see
+:class:`SegmentedTableFile`).
+
+Several processes can append to the same CSV or binary table: the rows of a
+flush are written with one `write` call on a file opened with
+O_APPEND, while holding an advisory lock (`fcntl.flock`, not available
+on Windows) also protecting the updates of the index and of the
+summaries. The rows written by other processes are counted when
+needed.
+
+For high rates, :class:`BinTableFile` writes fixed-size binary records
+and returns memory-mapped views of the file (no parsing nor copy).
+
+With the HDF5 format (:class:`H5TableFile`), each column is a chunked,
+extendable and compressed dataset. The file is written in SWMR mode
+(single writer, multiple readers), so that other processes can read the
+data while it is written.
+
+A :class:`BackgroundWriter` (optionally used by the sessions) writes the rows of
+several table files in a thread, so that saving a row does not wait for
+the disk.
+
+.. autoclass:: TableFile
+   :members:
+
+.. autoclass:: CSVTableFile
+   :members:
+
+.. autoclass:: H5TableFile
+   :members:
+
+.. autoclass:: BinTableFile
+   :members:
+
+.. autoclass:: SummaryPyramid
+   :members:
+
+.. autoclass:: SegmentedTableFile
+   :members:
+
+.. autofunction:: is_segmented
+
+.. autoclass:: BackgroundWriter
+   :members:
+
+.. autofunction:: flush_all
+
+.. autofunction:: close_all
+
+.. autofunction:: install_signal_handlers
+
+"""
+
+import os
+import io
+import csv
+import time
+import queue
+import bisect
+import json
+import atexit
+import signal
+import threading
+import weakref
+import traceback
+from collections import deque
+from contextlib import contextmanager, nullcontext
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+
+import numpy as np
+import h5py
+
+_table_files = weakref.WeakSet()
+_writers = weakref.WeakSet()
+_signal_handlers_installed = False
+
+
+def flush_all():
+    """Flush all the background writers and open table files."""
+    for writer in list(_writers):
+        writer.flush()
+    for table_file in list(_table_files):
+        table_file.flush()
+
+
+def close_all():
+    """Flush and close all the background writers and open table files."""
+    for writer in list(_writers):
+        writer.close()
+    for table_file in list(_table_files):
+        table_file.close()
+
+
+atexit.register(close_all)
+
+
+def _count_lines(file, chunk_size=2**20):
+    """Count the complete lines from the position of a binary file.
+
+    Returns the number of lines and the position after the last one.
+
+    """
+    nb_lines = 0
+    position = end = file.tell()
+    while True:
+        chunk = file.read(chunk_size)
+        if not chunk:
+            return nb_lines, end
+        index = chunk.rfind(b"\n")
+        if index != -1:
+            nb_lines += chunk.count(b"\n")
+            end = position + index + 1
+        position += len(chunk)
+
+
+@contextmanager
+def _flock(file):
+    """Hold an exclusive advisory lock on an open file."""
+    if fcntl is None:
+        yield
+        return
+    fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+    try:
+        yield
+    finally:
+        fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+
+
+def _as_float(value):
+    """Convert a value to float (NaN for "" and non-numeric values)."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _rows_as_array(rows, strict=True):
+    """Rows (lists of values) as a 2d array of floats ("" gives NaN).
+
+    If `strict` is False, the non-numeric values also give NaN instead
+    of raising a ValueError.
+
+    """
+    try:
+        return np.array(
+            [[np.nan if value == "" else value for value in row] for row in rows],
+            dtype=np.float64,
+        )
+    except (TypeError, ValueError):
+        if strict:
+            raise
+    return np.array(
+        [[_as_float(value) for value in row] for row in rows], dtype=np.float64
+    )
+
+
+def _exit_on_signal(signum, frame):
+    # SystemExit unwinds the stack (finally clauses) and runs the atexit
+    # functions, so the buffers are written
+    raise SystemExit(128 + signum)
+
+
+def install_signal_handlers():
+    """Close the table files when the process receives SIGTERM or SIGHUP.
+
+    The handlers raise SystemExit, so that the atexit functions (which
+    write the buffers) are called. The handlers set by other code are
+    not replaced. Has to be called from the main thread.
+
+    """
+    global _signal_handlers_installed
+    if _signal_handlers_installed:
+        return
+    if threading.current_thread() is not threading.main_thread():
+        raise ValueError("Signal handlers can only be set in the main thread.")
+    _signal_handlers_installed = True
+    for name in ("SIGTERM", "SIGHUP"):
+        signum = getattr(signal, name, None)
+        if signum is None:
+            continue
+        # do not replace handlers set by other code
+        if signal.getsignal(signum) is signal.SIG_DFL:
+            signal.signal(signum, _exit_on_signal)
+
+
+class TableFile:
+    """Base class of the files of data tables (buffered writes).
+
+    Parameters
+    ----------
+
+    path : str
+
+    fieldnames : {None, list}
+
+      Names of the columns. Has to be given to create a new file.
+
+    buffer_size : int
+
+      Number of rows buffered before writing.
+
+    flush_period : float
+
+      Maximum time (in s) between the first row buffered and the write.
+
+    index_period : int
+
+      Number of rows between two entries of the sparse time index.
+
+    """
+
+    extension = None
+    readonly = False
+    summary_factors = (10, 100, 1000)
+
+    def __init__(
+        self,
+        path,
+        fieldnames=None,
+        buffer_size=100,
+        flush_period=1.0,
+        index_period=1000,
+    ):
+        self.path = path
+        self.buffer_size = buffer_size
+        self.flush_period = flush_period
+        self.index_period = index_period
+
+        if not os.path.isfile(path):
+            if fieldnames is None:
+                raise ValueError(
+                    "For new data table, the argument "
+                    "`fieldnames` has to be given."
+                )
+            self._create(list(fieldnames))
+        else:
+            fieldnames_file = self._read_fieldnames()
+            if fieldnames is not None and fieldnames != fieldnames_file:
+                raise ValueError(
+                    "`fieldnames` does not correspond to the content "
+                    "of the file."
+                )
+            fieldnames = fieldnames_file
+
+        self.fieldnames = list(fieldnames)
+        self._fieldnames_set = set(self.fieldnames)
+
+        self._buffer = []
+        self._time_first_buffered = None
+        self._lock = threading.RLock()
+        self._init_reading()
+        self._init_index()
+
+        _table_files.add(self)
+
+    def _create(self, fieldnames):
+        raise NotImplementedError
+
+    def _read_fieldnames(self):
+        raise NotImplementedError
+
+    def _init_reading(self):
+        pass
+
+    def _write_rows(self, rows):
+        """Write rows (lists of values) to the file."""
+        raise NotImplementedError
+
+    def _close_file(self):
+        raise NotImplementedError
+
+    def _lock_file(self):
+        """Context manager protecting the writes from other processes."""
+        return nullcontext()
+
+    def _read_index_entries(self):
+        """Compute the entries of the index from the file."""
+        raise NotImplementedError
+
+    def _read_range(
+        self, row_start, offset_start, row_stop, offset_stop, fieldnames
+    ):
+        """Read the rows from `row_start` to `row_stop` (None for the end)."""
+        raise NotImplementedError
+
+    def _init_index(self):
+        self._index_path = self.path + ".idx"
+        self._summary = None
+        if "time" in self.fieldnames:
+            self._index_column = self.fieldnames.index("time")
+        else:
+            self._index_column = None
+            return
+        if self.summary_factors:
+            self._summary = SummaryPyramid(self, self.summary_factors)
+        if self.readonly:
+            return
+        with self._lock_file():
+            # the index is (re)built if it is missing or incomplete
+            nb_entries = -(-self._get_nb_rows_file() // self.index_period)
+            if os.path.isfile(self._index_path):
+                nb_entries_file = os.path.getsize(self._index_path) // 24
+            else:
+                nb_entries_file = None
+            if nb_entries_file != nb_entries:
+                entries = np.array(self._read_index_entries(), dtype=np.float64)
+                entries.tofile(self._index_path)
+            if self._summary is not None:
+                self._summary.init_writing()
+
+    def _add_to_index(self, rows, index_first, offsets=None):
+        """Add the written rows multiple of `index_period` to the index.
+
+        `offsets` are the offsets of the rows (if None, the row indices).
+
+        """
+        if self._index_column is None:
+            return
+        entries = []
+        for index in range(
+            -index_first % self.index_period, len(rows), self.index_period
+        ):
+            entries.append(
+                (
+                    _as_float(rows[index][self._index_column]),
+                    index_first + index,
+                    index_first + index if offsets is None else offsets[index],
+                )
+            )
+        if entries:
+            with open(self._index_path, "ab") as file:
+                file.write(np.array(entries, dtype=np.float64).tobytes())
+
+    def _get_index(self):
+        """Array of the entries (time, row index, offset) of the index."""
+        if os.path.isfile(self._index_path):
+            index = np.fromfile(self._index_path, dtype=np.float64)
+            # an entry can be in writing
+            return index[: index.size // 3 * 3].reshape(-1, 3)
+        # read-only file without index
+        return np.array(self._read_index_entries(), dtype=np.float64).reshape(
+            -1, 3
+        )
+
+    def _row_as_list(self, row):
+        if not self._fieldnames_set.issuperset(row):
+            wrong_fields = set(row) - self._fieldnames_set
+            raise ValueError(
+                "dict contains fields not in fieldnames: "
+                + ", ".join(repr(field) for field in wrong_fields)
+            )
+        return [row.get(key, "") for key in self.fieldnames]
+
+    def append(self, row):
+        """Append a row (dict)."""
+        self.append_rows([row])
+
+    def append_rows(self, rows):
+        """Append rows (sequence of dict)."""
+        self._append_lists([self._row_as_list(row) for row in rows])
+
+    def _append_lists(self, rows):
+        with self._lock:
+            if not self._buffer:
+                self._time_first_buffered = time.monotonic()
+            self._buffer.extend(rows)
+            if (
+                len(self._buffer) >= self.buffer_size
+                or time.monotonic() - self._time_first_buffered
+                >= self.flush_period
+            ):
+                self.flush()
+
+    def flush(self):
+        """Write the buffered rows to the file."""
+        with self._lock:
+            if not self._buffer:
+                return
+            rows, self._buffer = self._buffer, []
+            if self._summary is not None:
+                # computed before writing (non-numeric values give NaN)
+                values = _rows_as_array(rows, strict=False)
+            with self._lock_file():
+                try:
+                    self._write_rows(rows)
+                except BaseException:
+                    self._buffer = rows + self._buffer
+                    raise
+                # the rows are written: they must not be buffered again
+                if self._summary is not None:
+                    self._summary.add_rows(values)
+
+    @property
+    def nb_rows(self):
+        """Number of rows (including the rows in the buffer)."""
+        return self._get_nb_rows_file() + len(self._buffer)
+
+    def _get_nb_rows_file(self):
+        raise NotImplementedError
+
+    def close(self):
+        """Flush and close the file (it is reopened if needed)."""
+        with self._lock:
+            self.flush()
+            self._close_file()
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def read_rows(self, start=0, fieldnames=None):
+        """Read the rows from the row index `start` to the end.
+
+        Returns a dict of arrays and the index of the next row.
+
+        """
+        raise NotImplementedError
+
+    def _find_time_range(self, t_start, t_stop):
+        """Bounds (row, offset) of the rows to be read for a time range.
+
+        Returns None for an empty table and None for `row_stop` and
+        `offset_stop` if the rows have to be read until the end.
+
+        """
+        index = self._get_index()
+        if index.shape[0] == 0:
+            return None
+        times = index[:, 0]
+        # entries before the range (the rows before them are not read)
+        if t_start is None:
+            ientry_start = 0
+        else:
+            ientry_start = max(np.searchsorted(times, t_start) - 1, 0)
+        if t_stop is None:
+            ientry_stop = times.size
+        else:
+            ientry_stop = np.searchsorted(times, t_stop, side="right")
+        row_start, offset_start = index[ientry_start, 1:].astype(int)
+        if ientry_stop < times.size:
+            row_stop, offset_stop = index[ientry_stop, 1:].astype(int)
+        else:
+            row_stop = offset_stop = None
+        return row_start, offset_start, row_stop, offset_stop
+
+    def _read_last_rows(self, nb_rows):
+        """Read the last rows as a 2d array (using the index)."""
+        nb_rows_file = self._get_nb_rows_file()
+        index = self._get_index()
+        if nb_rows == 0 or index.shape[0] == 0:
+            return np.empty((0, len(self.fieldnames)))
+        ientry = min(
+            (nb_rows_file - nb_rows) // self.index_period, index.shape[0] - 1
+        )
+        row_start, offset_start = index[ientry, 1:].astype(int)
+        data = self._read_range(
+            row_start, offset_start, None, None, self.fieldnames
+        )
+        values = np.column_stack([data[key] for key in self.fieldnames])
+        return values[-nb_rows:].astype(np.float64)
+
+    def get_info(self):
+        """Fieldnames, number of rows and time span (NaN without "time")."""
+        self.flush()
+        info = {
+            "fieldnames": self.fieldnames,
+            "nb_rows": self.nb_rows,
+            "time_start": np.nan,
+            "time_stop": np.nan,
+        }
+        if self._index_column is not None and info["nb_rows"]:
+            with self._lock:
+                info["time_start"] = self._get_index()[0, 0]
+                last_row = self._read_last_rows(1)
+            info["time_stop"] = last_row[0, self._index_column]
+        return info
+
+    def read_time_range(self, t_start=None, t_stop=None, fieldnames=None):
+        """Read the rows for which t_start <= time <= t_stop.
+
+        The sparse index is used to read only the rows close to the
+        time range.
+
+        """
+        if self._index_column is None:
+            raise ValueError("Time-range queries need a column 'time'.")
+        self.flush()
+        if fieldnames is None:
+            fieldnames = self.fieldnames
+        fieldnames_read = list(fieldnames)
+        if "time" not in fieldnames_read:
+            fieldnames_read.append("time")
+
+        with self._lock:
+            bounds = self._find_time_range(t_start, t_stop)
+            if bounds is None:
+                return {key: np.array([]) for key in fieldnames}
+            data = self._read_range(*bounds, fieldnames_read)
+
+        time = data["time"]
+        mask = np.ones(time.shape, dtype=bool)
+        if t_start is not None:
+            mask &= time >= t_start
+        if t_stop is not None:
+            mask &= time <= t_stop
+        return {key: data[key][mask] for key in fieldnames}
+
+    def load_overview(
+        self, t_start=None, t_stop=None, max_points=1000, fieldnames=None
+    ):
+        """Load a summary of a time range with at most `max_points` points.
+
+        The finest level of the :class:`SummaryPyramid` (or the rows
+        themselves) giving less than `max_points` points is used (the
+        records are combined if even the coarsest level gives too many
+        points). The last rows not in a complete block of the level are
+        not included.
+
+        Returns a dict of arrays: "time" (middle of the blocks) and, for
+        each column, "<name>_min", "<name>_max" and "<name>_mean".
+
+        """
+        records = self._get_overview_records(t_start, t_stop, max_points)
+        return self._summary.records_as_dict(records, fieldnames)
+
+    def _get_overview_records(self, t_start, t_stop, max_points):
+        if self._summary is None:
+            raise ValueError("Overviews need a column 'time'.")
+        summary = self._summary
+        self.flush()
+
+        with self._lock:
+            nb_records = summary.count(0, t_start, t_stop)
+            if nb_records * summary.factors[0] <= max_points:
+                data = self.read_time_range(t_start, t_stop)
+                values = np.column_stack([data[key] for key in self.fieldnames])
+                records = summary.rows_as_records(values.astype(np.float64))
+            else:
+                for ilevel in range(len(summary.factors)):
+                    if summary.count(ilevel, t_start, t_stop) <= max_points:
+                        break
+                records = summary.read(ilevel, t_start, t_stop)
+
+        return summary.reduce(records, max_points)
+
+    def load(self, fieldnames=None, skiptimes=0, t_start=None, t_stop=None):
+        """Load columns as a dict of arrays.
+
+        If `t_start` or `t_stop` is given, only the rows of this time
+        range are loaded (see :func:`read_time_range`).
+
+        """
+        if t_start is None and t_stop is None:
+            return self.read_rows(skiptimes, fieldnames)[0]
+        if skiptimes:
+            raise ValueError("skiptimes can not be used with a time range.")
+        return self.read_time_range(t_start, t_stop, fieldnames)
+
+
+class CSVTableFile(TableFile):
+    """CSV file of a data table.
+
+    Reading from the row index returned by the previous call of
+    :func:`read_rows` only parses the new rows (the file is read from
+    the byte offset of the last row read).
+
+    The values are parsed as float64 (NaN for missing values).
+
+    """
+
+    extension = "csv"
+    parse_chunk_size = 2**24
+
+    def _create(self, fieldnames):
+        with open(self.path, "w") as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+            writer.writeheader()
+
+    def _read_fieldnames(self):
+        with open(self.path, "r") as csvfile:
+            return next(csv.reader(csvfile), None)
+
+    def _init_reading(self):
+        self._file = None
+        with open(self.path, "rb") as file:
+            header = file.readline()
+        # number of complete rows before the offset `_end_offset`
+        self._nb_rows_file = 0
+        self._end_offset = len(header)
+        self._sync_nb_rows()
+        # rows written by other processes since the summary was loaded
+        self._external_rows = False
+        # position of the next row to be read
+        self._offset_first_row = len(header)
+        self._cursor_row = 0
+        self._cursor_offset = len(header)
+
+    def _sync_nb_rows(self):
+        """Count the rows appended (possibly by other processes)."""
+        if os.path.getsize(self.path) <= self._end_offset:
+            return
+        with open(self.path, "rb") as file:
+            file.seek(self._end_offset)
+            nb_rows, self._end_offset = _count_lines(file)
+        if nb_rows:
+            self._nb_rows_file += nb_rows
+            self._external_rows = True
+
+    def _lock_file(self):
+        if self._file is None:
+            # O_APPEND: each write goes at the end of the file
+            self._file = open(self.path, "ab", buffering=0)
+        return _flock(self._file)
+
+    def _write_rows(self, rows):
+        # same format as csv.DictWriter (lines terminated by "\r\n")
+        text = io.StringIO()
+        writer = csv.writer(text)
+        positions = []
+        for row in rows:
+            positions.append(text.tell())
+            writer.writerow(row)
+        text = text.getvalue()
+        data = text.encode()
+        if len(data) != len(text):
+            # non-ASCII characters
+            positions = [len(text[:position].encode()) for position in positions]
+
+        # called with the lock (see _lock_file)
+        self._sync_nb_rows()
+        if self._external_rows and self._summary is not None:
+            # the incomplete blocks have changed
+            self._summary.init_writing()
+        self._external_rows = False
+
+        offset = os.fstat(self._file.fileno()).st_size
+        # one write of complete lines
+        self._file.write(data)
+        self._add_to_index(
+            rows,
+            self._nb_rows_file,
+            [offset + position for position in positions],
+        )
+        self._nb_rows_file += len(rows)
+        self._end_offset = offset + len(data)
+
+    def _get_nb_rows_file(self):
+        self._sync_nb_rows()
+        return self._nb_rows_file
+
+    def _close_file(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _parse_chunk(self, chunk, indices):
+        try:
+            values = np.loadtxt(
+                io.BytesIO(chunk), delimiter=",", usecols=indices, ndmin=2
+            )
+        except ValueError:
+            # missing values (saved as empty strings) give NaN
+            values = np.genfromtxt(
+                io.BytesIO(chunk), delimiter=",", usecols=indices
+            )
+        return values.reshape(-1, len(indices))
+
+    def _parse(self, data, fieldnames):
+        """Parse complete CSV lines (bytes) into a dict of arrays.
+
+        Only the requested columns are parsed, by chunks of about
+        `parse_chunk_size` bytes with the C parser of `np.loadtxt`. The
+        arrays are contiguous (float64).
+
+        """
+        indices = [self.fieldnames.index(key) for key in fieldnames]
+        result = np.empty((len(indices), data.count(b"\n")))
+        view = memoryview(data)
+        start = row = 0
+        while start < len(data):
+            stop = data.rfind(b"\n", start, start + self.parse_chunk_size) + 1
+            if stop <= start:
+                # line longer than a chunk
+                stop = data.index(b"\n", start) + 1
+            values = self._parse_chunk(view[start:stop], indices)
+            result[:, row : row + values.shape[0]] = values.T
+            row += values.shape[0]
+            start = stop
+        # the blank lines are skipped by the parser
+        result = result[:, :row]
+        return {key: result[ik] for ik, key in enumerate(fieldnames)}
+
+    def _read_index_entries(self):
+        entries = []
+        column = self._index_column
+        with open(self.path, "rb") as file:
+            offset = len(file.readline())
+            for index, line in enumerate(file):
+                if not line.endswith(b"\n"):
+                    break
+                if index % self.index_period == 0:
+                    time = float(line.split(b",", column + 1)[column])
+                    entries.append((time, index, offset))
+                offset += len(line)
+        return entries
+
+    def _read_range(
+        self, row_start, offset_start, row_stop, offset_stop, fieldnames
+    ):
+        with open(self.path, "rb") as file:
+            file.seek(offset_start)
+            if offset_stop is None:
+                data = file.read()
+            else:
+                data = file.read(offset_stop - offset_start)
+        # only complete lines
+        data = data[: data.rfind(b"\n") + 1]
+        return self._parse(data, fieldnames)
+
+    def _seek_row(self, start):
+        """Move the cursor to the closest known row before `start`.
+
+        The known rows are the cursor, the first row and the entries
+        of the sparse index, so that at most `index_period` rows have
+        to be skipped line by line.
+
+        """
+        if start < self._cursor_row:
+            self._cursor_row = 0
+            self._cursor_offset = self._offset_first_row
+        if self._index_column is None or start - self._cursor_row < 2:
+            return
+        index = self._get_index()
+        ientry = np.searchsorted(index[:, 1], start, side="right") - 1
+        if ientry >= 0 and index[ientry, 1] > self._cursor_row:
+            self._cursor_row, self._cursor_offset = index[ientry, 1:].astype(int)
+
+    def read_rows(self, start=0, fieldnames=None):
+        """Read the rows from the row index `start` to the end."""
+        self.flush()
+        if fieldnames is None:
+            fieldnames = self.fieldnames
+
+        with self._lock, open(self.path, "rb") as file:
+            self._seek_row(start)
+            file.seek(self._cursor_offset)
+            # skip the rows before start
+            while self._cursor_row < start:
+                line = file.readline()
+                if not line.endswith(b"\n"):
+                    break
+                self._cursor_row += 1
+                self._cursor_offset += len(line)
+
+            data = file.read()
+            # only complete lines
+            data = data[: data.rfind(b"\n") + 1]
+            nb_rows = data.count(b"\n")
+            self._cursor_row += nb_rows
+            self._cursor_offset += len(data)
+            index_stop = self._cursor_row
+
+        return self._parse(data, fieldnames), index_stop
+
+
+class H5TableFile(TableFile):
+    """HDF5 file of a data table.
+
+    The file contains a group (named as the file without extension) with
+    one dataset (float64) per column. The datasets are chunked,
+    extendable and compressed. The file is written in SWMR mode.
+
+    Parameters
+    ----------
+
+    path : str
+
+    fieldnames : {None, list}
+
+    buffer_size : int
+
+    flush_period : float
+
+    readonly : bool
+
+      Open an existing file only for reading (in SWMR mode, so that the
+      file can be written by another process).
+
+    chunk_size : int
+
+      Number of values in a chunk of the datasets.
+
+    compression : {None, str}
+
+    index_period : int
+
+    """
+
+    extension = "h5"
+
+    def __init__(
+        self,
+        path,
+        fieldnames=None,
+        buffer_size=100,
+        flush_period=1.0,
+        readonly=False,
+        chunk_size=4096,
+        compression="gzip",
+        index_period=1000,
+    ):
+        self.readonly = readonly
+        self.chunk_size = chunk_size
+        self.compression = compression
+        self.group_name = os.path.splitext(os.path.basename(path))[0]
+        self._file = None
+        if readonly and not os.path.isfile(path):
+            raise ValueError(f"No file {path}")
+        super().__init__(
+            path, fieldnames, buffer_size, flush_period, index_period
+        )
+
+    def _create(self, fieldnames):
+        with h5py.File(self.path, "w", libver="latest") as file:
+            group = file.create_group(self.group_name)
+            group.attrs["fieldnames"] = fieldnames
+            for key in fieldnames:
+                group.create_dataset(
+                    key,
+                    shape=(0,),
+                    maxshape=(None,),
+                    chunks=(self.chunk_size,),
+                    dtype=np.float64,
+                    compression=self.compression,
+                )
+
+    def _read_fieldnames(self):
+        group = self._get_group()
+        return [str(key) for key in group.attrs["fieldnames"]]
+
+    def _get_group(self):
+        if self._file is None:
+            if self.readonly:
+                self._file = h5py.File(self.path, "r", libver="latest", swmr=True)
+            else:
+                self._file = h5py.File(self.path, "a", libver="latest")
+                self._file.swmr_mode = True
+        return self._file[self.group_name]
+
+    def _write_rows(self, rows):
+        if self.readonly:
+            raise ValueError("The table file is opened in read-only mode.")
+        group = self._get_group()
+        values = _rows_as_array(rows)
+        nb_rows_old = group[self.fieldnames[0]].shape[0]
+        nb_rows_new = nb_rows_old + len(rows)
+        for index, key in enumerate(self.fieldnames):
+            dataset = group[key]
+            dataset.resize((nb_rows_new,))
+            dataset[nb_rows_old:] = values[:, index]
+        # make the data visible to the readers
+        self._file.flush()
+        self._add_to_index(rows, nb_rows_old)
+
+    def _get_nb_rows_file(self):
+        dataset = self._get_group()[self.fieldnames[0]]
+        if self.readonly:
+            dataset.refresh()
+        return dataset.shape[0]
+
+    def _close_file(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _read_index_entries(self):
+        dataset = self._get_group()["time"]
+        if self.readonly:
+            dataset.refresh()
+        times = dataset[:: self.index_period]
+        rows = self.index_period * np.arange(times.size)
+        return list(zip(times, rows, rows))
+
+    def _read_range(
+        self, row_start, offset_start, row_stop, offset_stop, fieldnames
+    ):
+        group = self._get_group()
+        data = {}
+        for key in fieldnames:
+            dataset = group[key]
+            if self.readonly:
+                dataset.refresh()
+            data[key] = dataset[row_start:row_stop]
+        # columns of a reader can differ during a write
+        size = min(column.size for column in data.values())
+        return {key: column[:size] for key, column in data.items()}
+
+    def read_rows(self, start=0, fieldnames=None):
+        """Read the rows from the row index `start` to the end.
+
+        Only the datasets of the requested columns are read.
+
+        """
+        self.flush()
+        if fieldnames is None:
+            fieldnames = self.fieldnames
+        with self._lock:
+            group = self._get_group()
+            datasets = [group[key] for key in fieldnames]
+            if self.readonly:
+                for dataset in datasets:
+                    dataset.refresh()
+            # columns of a reader can differ during a write
+            index_stop = min(
+                (dataset.shape[0] for dataset in datasets),
+                default=self._get_nb_rows_file(),
+            )
+            data = {
+                key: dataset[start:index_stop]
+                for key, dataset in zip(fieldnames, datasets)
+            }
+        return data, max(start, index_stop)
+
+
+class BinTableFile(TableFile):
+    """Binary file of fixed-size records.
+
+    Each row is a record of a structured dtype (one float64 field per
+    column) appended to the raw file `path`. The fieldnames and the
+    dtype are stored in a small JSON header (file `path + ".json"`).
+
+    The reading methods return views of a `np.memmap` of the file, so
+    that reading a slice of a column does not copy nor parse the
+    file. The number of rows is given by the size of the file.
+
+    """
+
+    extension = "bin"
+
+    def _get_path_header(self):
+        return self.path + ".json"
+
+    def _create(self, fieldnames):
+        self.dtype = np.dtype([(key, "<f8") for key in fieldnames])
+        header = {"fieldnames": fieldnames, "dtype": self.dtype.descr}
+        with open(self._get_path_header(), "w") as file:
+            json.dump(header, file)
+        open(self.path, "wb").close()
+
+    def _read_fieldnames(self):
+        with open(self._get_path_header()) as file:
+            header = json.load(file)
+        self.dtype = np.dtype([tuple(field) for field in header["dtype"]])
+        return header["fieldnames"]
+
+    def _init_reading(self):
+        self._file = None
+        # number of rows after the last write of this object
+        self._nb_rows_expected = self._get_nb_rows_file()
+
+    def _lock_file(self):
+        if self._file is None:
+            # O_APPEND: each write goes at the end of the file
+            self._file = open(self.path, "ab", buffering=0)
+        return _flock(self._file)
+
+    def _write_rows(self, rows):
+        # called with the lock (see _lock_file)
+        nb_rows_old = self._get_nb_rows_file()
+        if nb_rows_old != self._nb_rows_expected and self._summary is not None:
+            # rows written by other processes
+            self._summary.init_writing()
+        records = np.ascontiguousarray(_rows_as_array(rows)).view(self.dtype)
+        # one write of complete records
+        self._file.write(records.tobytes())
+        self._add_to_index(rows, nb_rows_old)
+        self._nb_rows_expected = nb_rows_old + len(rows)
+
+    def _get_nb_rows_file(self):
+        return os.path.getsize(self.path) // self.dtype.itemsize
+
+    def _close_file(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def get_memmap(self):
+        """Memory-mapped array of the records (read-only)."""
+        self.flush()
+        nb_rows = self._get_nb_rows_file()
+        if nb_rows == 0:
+            return np.empty(0, dtype=self.dtype)
+        return np.memmap(self.path, dtype=self.dtype, mode="r", shape=(nb_rows,))
+
+    def _read_index_entries(self):
+        times = self.get_memmap()["time"][:: self.index_period]
+        rows = self.index_period * np.arange(times.size)
+        return list(zip(times, rows, rows))
+
+    def _read_range(
+        self, row_start, offset_start, row_stop, offset_stop, fieldnames
+    ):
+        records = self.get_memmap()[row_start:row_stop]
+        return {key: records[key] for key in fieldnames}
+
+    def read_rows(self, start=0, fieldnames=None):
+        """Read the rows from the row index `start` to the end.
+
+        The arrays are views of a memmap of the file.
+
+        """
+        if fieldnames is None:
+            fieldnames = self.fieldnames
+        records = self.get_memmap()
+        data = {key: records[key][start:] for key in fieldnames}
+        return data, max(start, records.size)
+
+
+class SummaryPyramid:
+    """Downsampled summaries of a table file with a column "time".
+
+    For each decimation factor, a binary file (extension
+    ".sum<factor>") contains one record (float64) per block of `factor`
+    rows: the first and last times of the block, then the minimum,
+    maximum and mean of each other column. The records are appended
+    when rows are written (a level is computed from the previous one),
+    so the cost does not depend on the length of the table.
+
+    Parameters
+    ----------
+
+    table_file : TableFile
+
+    factors : sequence of int
+
+      Decimation factors (each one a multiple of the previous one).
+
+    """
+
+    def __init__(self, table_file, factors=(10, 100, 1000)):
+        self.table_file = table_file
+        self.factors = list(factors)
+        self._ratios = [self.factors[0]]
+        for factor0, factor1 in zip(self.factors[:-1], self.factors[1:]):
+            if factor1 % factor0:
+                raise ValueError(
+                    "Each factor has to be a multiple of the previous."
+                )
+            self._ratios.append(factor1 // factor0)
+
+        fieldnames = table_file.fieldnames
+        self._index_time = fieldnames.index("time")
+        self.columns = [key for key in fieldnames if key != "time"]
+        self._indices_columns = [fieldnames.index(key) for key in self.columns]
+        self.record_size = 2 + 3 * len(self.columns)
+        self.paths = [f"{table_file.path}.sum{factor}" for factor in self.factors]
+        # rows (first level) and records not yet in a complete block
+        self._pending = None
+
+    def _get_nb_records(self, ilevel):
+        path = self.paths[ilevel]
+        if not os.path.isfile(path):
+            return None
+        return os.path.getsize(path) // (8 * self.record_size)
+
+    def _read_records(self, ilevel, start=0, stop=None):
+        path = self.paths[ilevel]
+        if stop is None:
+            stop = self._get_nb_records(ilevel)
+        return np.fromfile(
+            path,
+            dtype=np.float64,
+            count=(stop - start) * self.record_size,
+            offset=8 * start * self.record_size,
+        ).reshape(-1, self.record_size)
+
+    def init_writing(self):
+        """Check the files (rebuilt if needed) and load the incomplete blocks."""
+        table_file = self.table_file
+        nb_rows = table_file._get_nb_rows_file()
+        consistent = all(
+            self._get_nb_records(ilevel) == nb_rows // factor
+            for ilevel, factor in enumerate(self.factors)
+        )
+        if not consistent:
+            self.rebuild()
+            return
+
+        self._pending = [
+            self.rows_as_records(
+                table_file._read_last_rows(nb_rows % self.factors[0])
+            )
+        ]
+        for ilevel in range(1, len(self.factors)):
+            nb_records = nb_rows // self.factors[ilevel - 1]
+            start = nb_records - nb_records % self._ratios[ilevel]
+            self._pending.append(
+                self._read_records(ilevel - 1, start, nb_records)
+            )
+
+    def rebuild(self):
+        """Compute the summaries from all the rows of the table."""
+        for path in self.paths:
+            open(path, "wb").close()
+        self._pending = [np.empty((0, self.record_size)) for _ in self.factors]
+        table_file = self.table_file
+        if table_file._get_nb_rows_file() == 0:
+            return
+        data, _ = table_file.read_rows(0)
+        values = np.column_stack([data[key] for key in table_file.fieldnames])
+        self.add_rows(values.astype(np.float64))
+
+    def rows_as_records(self, values):
+        """Rows (2d array) as records of blocks of one row."""
+        records = np.empty((values.shape[0], self.record_size))
+        records[:, 0] = records[:, 1] = values[:, self._index_time]
+        for icolumn, index in enumerate(self._indices_columns):
+            for shift in range(3):
+                records[:, 2 + 3 * icolumn + shift] = values[:, index]
+        return records
+
+    def _combine(self, blocks):
+        """Combine the records of blocks (3d array)."""
+        records = np.empty((blocks.shape[0], self.record_size))
+        records[:, 0] = blocks[:, 0, 0]
+        records[:, 1] = blocks[:, -1, 1]
+        records[:, 2::3] = np.fmin.reduce(blocks[:, :, 2::3], axis=1)
+        records[:, 3::3] = np.fmax.reduce(blocks[:, :, 3::3], axis=1)
+        records[:, 4::3] = blocks[:, :, 4::3].mean(axis=1)
+        return records
+
+    def add_rows(self, values):
+        """Add rows (2d array of floats, in the order of the fieldnames)."""
+        records = self.rows_as_records(values)
+        for ilevel, ratio in enumerate(self._ratios):
+            pending = np.concatenate((self._pending[ilevel], records))
+            nb_blocks = pending.shape[0] // ratio
+            nb_records = nb_blocks * ratio
+            self._pending[ilevel] = pending[nb_records:]
+            if nb_blocks == 0:
+                break
+            records = self._combine(
+                pending[:nb_records].reshape(nb_blocks, ratio, self.record_size)
+            )
+            with open(self.paths[ilevel], "ab") as file:
+                file.write(records.tobytes())
+
+    def _find(self, ilevel, t_start, t_stop):
+        """Records of a level (memmap) and indices of a time range."""
+        nb_records = self._get_nb_records(ilevel)
+        if nb_records is None:
+            raise ValueError(f"No summary file {self.paths[ilevel]}")
+        if nb_records == 0:
+            return np.empty((0, self.record_size)), 0, 0
+        records = np.memmap(
+            self.paths[ilevel],
+            dtype=np.float64,
+            mode="r",
+            shape=(nb_records, self.record_size),
+        )
+        # binary searches (only a few pages of the file are read)
+        start = 0
+        stop = nb_records
+        if t_start is not None:
+            start = bisect.bisect_left(records[:, 1], t_start)
+        if t_stop is not None:
+            stop = bisect.bisect_right(records[:, 0], t_stop)
+        return records, start, max(start, stop)
+
+    def count(self, ilevel, t_start=None, t_stop=None):
+        """Number of records of a level overlapping a time range."""
+        _, start, stop = self._find(ilevel, t_start, t_stop)
+        return stop - start
+
+    def read(self, ilevel, t_start=None, t_stop=None):
+        """Read the records of a level overlapping a time range."""
+        records, start, stop = self._find(ilevel, t_start, t_stop)
+        return np.array(records[start:stop])
+
+    def records_as_dict(self, records, fieldnames=None):
+        """Records as a dict of arrays (see :func:`TableFile.load_overview`)."""
+        if fieldnames is None:
+            fieldnames = self.columns
+        result = {"time": 0.5 * (records[:, 0] + records[:, 1])}
+        for key in fieldnames:
+            if key == "time":
+                continue
+            icolumn = 2 + 3 * self.columns.index(key)
+            result[key + "_min"] = records[:, icolumn]
+            result[key + "_max"] = records[:, icolumn + 1]
+            result[key + "_mean"] = records[:, icolumn + 2]
+        return result
+
+    def reduce(self, records, max_points):
+        """Combine consecutive records to get at most `max_points` records."""
+        nb_records = records.shape[0]
+        if nb_records <= max_points:
+            return records
+        ratio = -(-nb_records // max_points)
+        nb_blocks = nb_records // ratio
+        nb_full = nb_blocks * ratio
+        result = [
+            self._combine(
+                records[:nb_full].reshape(nb_blocks, ratio, self.record_size)
+            )
+        ]
+        if nb_full < nb_records:
+            result.append(self._combine(records[np.newaxis, nb_full:]))
+        return np.concatenate(result)
+
+
+def get_segments_dir(path):
+    """Directory of the segments of a table file."""
+    return path + ".segments"
+
+
+def is_segmented(path):
+    """Check if a table is saved in segment files."""
+    return os.path.isfile(os.path.join(get_segments_dir(path), "manifest.json"))
+
+
+def _nan_to_none(value):
+    value = float(value)
+    return None if np.isnan(value) else value
+
+
+class SegmentedTableFile:
+    """Table saved in a sequence of segment files.
+
+    The segments are in the directory `path + ".segments"`, which also
+    contains a manifest (file "manifest.json") recording the fieldnames,
+    the rotation parameters and, for each segment, the number of rows and
+    the time span. A new segment is started when the current one is
+    larger than `max_size` or spans more than `max_duration` (checked
+    before each batch of rows is written).
+
+    Only one process should write a segmented table (the rotation is
+    not synchronized between processes).
+
+    The methods are the same as for the other table files. The reading
+    methods only open the segments overlapping the requested rows or
+    time range.
+
+    Parameters
+    ----------
+
+    path : str
+
+      Path of the table (the file `path` itself does not exist).
+
+    fieldnames : {None, list}
+
+    segment_class : {CSVTableFile, H5TableFile}
+
+      Class of the segment files (given by the manifest for an existing
+      table).
+
+    max_size : {None, int}
+
+      Maximum size of a segment (in bytes).
+
+    max_duration : {None, float}
+
+      Maximum time span of a segment (in s, needs a column "time").
+
+    buffer_size : int
+
+    flush_period : float
+
+    """
+
+    def __init__(
+        self,
+        path,
+        fieldnames=None,
+        segment_class=None,
+        max_size=None,
+        max_duration=None,
+        buffer_size=100,
+        flush_period=1.0,
+    ):
+        self.path = path
+        self.path_dir = get_segments_dir(path)
+        self.path_manifest = os.path.join(self.path_dir, "manifest.json")
+        self.buffer_size = buffer_size
+        self.flush_period = flush_period
+        self._lock = threading.RLock()
+        self._segments = {}
+
+        if os.path.isfile(self.path_manifest):
+            with open(self.path_manifest) as file:
+                manifest = json.load(file)
+            if (
+                fieldnames is not None
+                and list(fieldnames) != manifest["fieldnames"]
+            ):
+                raise ValueError(
+                    "`fieldnames` does not correspond to the content "
+                    "of the file."
+                )
+            self.fieldnames = manifest["fieldnames"]
+            self.extension = manifest["extension"]
+            self._entries = manifest["segments"]
+            if max_size is None:
+                max_size = manifest["max_size"]
+            if max_duration is None:
+                max_duration = manifest["max_duration"]
+        else:
+            if fieldnames is None:
+                raise ValueError(
+                    "For new data table, the argument "
+                    "`fieldnames` has to be given."
+                )
+            if segment_class is None:
+                raise ValueError("segment_class has to be given.")
+            if os.path.isfile(path):
+                raise ValueError(f"{path} exists and is not segmented.")
+            os.makedirs(self.path_dir, exist_ok=True)
+            self.fieldnames = list(fieldnames)
+            self.extension = segment_class.extension
+            self._entries = []
+
+        if max_duration is not None and "time" not in self.fieldnames:
+            raise ValueError("Rotation by duration needs a column 'time'.")
+        self.max_size = max_size
+        self.max_duration = max_duration
+        self._segment_classes = {
+            cls.extension: cls
+            for cls in (CSVTableFile, H5TableFile, BinTableFile)
+        }
+        self._segment_class = self._segment_classes[self.extension]
+        self._index_time = (
+            self.fieldnames.index("time") if "time" in self.fieldnames else None
+        )
+
+        if not self._entries:
+            self._start_segment()
+        else:
+            self._current = self._open_segment(
+                len(self._entries) - 1, writable=True
+            )
+        self._write_manifest()
+        _table_files.add(self)
+
+    def _write_manifest(self):
+        manifest = {
+            "fieldnames": self.fieldnames,
+            "extension": self.extension,
+            "max_size": self.max_size,
+            "max_duration": self.max_duration,
+            "segments": self._entries,
+        }
+        path_tmp = self.path_manifest + ".tmp"
+        with open(path_tmp, "w") as file:
+            json.dump(manifest, file, indent=1)
+        os.replace(path_tmp, self.path_manifest)
+
+    def _get_path_segment(self, index):
+        return os.path.join(self.path_dir, self._entries[index]["file"])
+
+    def _open_segment(self, index, writable=False):
+        cls = self._segment_class
+        path = self._get_path_segment(index)
+        if writable:
+            return cls(
+                path,
+                self.fieldnames,
+                buffer_size=self.buffer_size,
+                flush_period=self.flush_period,
+            )
+        if index not in self._segments:
+            if cls is H5TableFile:
+                self._segments[index] = cls(path, readonly=True)
+            else:
+                self._segments[index] = cls(path)
+        return self._segments[index]
+
+    def _get_segment(self, index):
+        if index == len(self._entries) - 1:
+            return self._current
+        return self._open_segment(index)
+
+    def _start_segment(self):
+        index = len(self._entries)
+        self._entries.append(
+            {
+                "file": f"{index:05d}.{self.extension}",
+                "nb_rows": 0,
+                "time_start": None,
+                "time_stop": None,
+            }
+        )
+        self._current = self._open_segment(index, writable=True)
+
+    def _update_entry(self):
+        """Store the number of rows and time span of the current segment."""
+        info = self._current.get_info()
+        entry = self._entries[-1]
+        entry["nb_rows"] = info["nb_rows"]
+        entry["time_start"] = _nan_to_none(info["time_start"])
+        entry["time_stop"] = _nan_to_none(info["time_stop"])
+
+    def _must_rotate(self, first_row):
+        entry = self._entries[-1]
+        if self._current.nb_rows == 0:
+            return False
+        if self.max_size is not None:
+            path = self._get_path_segment(-1)
+            if os.path.getsize(path) >= self.max_size:
+                return True
+        if self.max_duration is not None:
+            if entry["time_start"] is None:
+                self._update_entry()
+            time = first_row[self._index_time]
+            if time != "" and time - entry["time_start"] >= self.max_duration:
+                return True
+        return False
+
+    def rotate(self):
+        """Close the current segment and start a new one."""
+        with self._lock:
+            self._current.flush()
+            self._update_entry()
+            self._current.close()
+            self._start_segment()
+            self._write_manifest()
+
+    def _row_as_list(self, row):
+        return self._current._row_as_list(row)
+
+    def append(self, row):
+        """Append a row (dict)."""
+        self.append_rows([row])
+
+    def append_rows(self, rows):
+        """Append rows (sequence of dict)."""
+        self._append_lists([self._row_as_list(row) for row in rows])
+
+    def _append_lists(self, rows):
+        with self._lock:
+            if not rows:
+                return
+            if self._must_rotate(rows[0]):
+                self.rotate()
+            self._current._append_lists(rows)
+
+    def flush(self):
+        """Write the buffered rows to the current segment."""
+        self._current.flush()
+
+    def close(self):
+        """Flush and close the segments (and update the manifest)."""
+        with self._lock:
+            self._current.flush()
+            self._update_entry()
+            self._current.close()
+            for segment in self._segments.values():
+                segment.close()
+            self._write_manifest()
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    @property
+    def nb_rows(self):
+        """Number of rows of all the segments."""
+        return sum(nb_rows for _, nb_rows in self._get_sizes())
+
+    def _get_sizes(self):
+        """Number of rows of the segments (index, nb_rows)."""
+        last = len(self._entries) - 1
+        for index, entry in enumerate(self._entries):
+            if index == last:
+                yield index, self._current.nb_rows
+            else:
+                yield index, entry["nb_rows"]
+
+    def _select_segments(self, t_start, t_stop):
+        """Indices of the segments overlapping a time range."""
+        indices = []
+        last = len(self._entries) - 1
+        for index, entry in enumerate(self._entries):
+            time_start = entry["time_start"]
+            time_stop = entry["time_stop"] if index != last else None
+            if (
+                t_stop is not None
+                and time_start is not None
+                and time_start > t_stop
+            ):
+                continue
+            if (
+                t_start is not None
+                and time_stop is not None
+                and time_stop < t_start
+            ):
+                continue
+            indices.append(index)
+        return indices
+
+    @staticmethod
+    def _concatenate(parts, fieldnames):
+        if not parts:
+            return {key: np.array([]) for key in fieldnames}
+        return {
+            key: np.concatenate([part[key] for part in parts])
+            for key in fieldnames
+        }
+
+    def read_rows(self, start=0, fieldnames=None):
+        """Read the rows from the row index `start` to the end.
+
+        Returns a dict of arrays and the index of the next row.
+
+        """
+        if fieldnames is None:
+            fieldnames = self.fieldnames
+        self.flush()
+        parts = []
+        with self._lock:
+            offset = 0
+            for index, nb_rows in list(self._get_sizes()):
+                if start < offset + nb_rows:
+                    data, _ = self._get_segment(index).read_rows(
+                        max(start - offset, 0), fieldnames
+                    )
+                    parts.append(data)
+                offset += nb_rows
+        return self._concatenate(parts, fieldnames), max(start, offset)
+
+    def read_time_range(self, t_start=None, t_stop=None, fieldnames=None):
+        """Read the rows for which t_start <= time <= t_stop."""
+        if self._index_time is None:
+            raise ValueError("Time-range queries need a column 'time'.")
+        if fieldnames is None:
+            fieldnames = self.fieldnames
+        self.flush()
+        with self._lock:
+            parts = [
+                self._get_segment(index).read_time_range(
+                    t_start, t_stop, fieldnames
+                )
+                for index in self._select_segments(t_start, t_stop)
+            ]
+        return self._concatenate(parts, fieldnames)
+
+    def load_overview(
+        self, t_start=None, t_stop=None, max_points=1000, fieldnames=None
+    ):
+        """Load a summary of a time range with at most `max_points` points.
+
+        See :func:`TableFile.load_overview`.
+
+        """
+        summary = self._current._summary
+        if summary is None:
+            raise ValueError("Overviews need a column 'time'.")
+        self.flush()
+        with self._lock:
+            records = [
+                self._get_segment(index)._get_overview_records(
+                    t_start, t_stop, max_points
+                )
+                for index in self._select_segments(t_start, t_stop)
+            ]
+        if records:
+            records = summary.reduce(np.concatenate(records), max_points)
+        else:
+            # no segment in the time range
+            records = np.empty((0, summary.record_size))
+        return summary.records_as_dict(records, fieldnames)
+
+    def load(self, fieldnames=None, skiptimes=0, t_start=None, t_stop=None):
+        """Load columns as a dict of arrays (see :func:`TableFile.load`)."""
+        if t_start is None and t_stop is None:
+            return self.read_rows(skiptimes, fieldnames)[0]
+        if skiptimes:
+            raise ValueError("skiptimes can not be used with a time range.")
+        return self.read_time_range(t_start, t_stop, fieldnames)
+
+    def get_info(self):
+        """Fieldnames, number of rows and time span of the table."""
+        with self._lock:
+            self._current.flush()
+            self._update_entry()
+            times_start = [
+                entry["time_start"]
+                for entry in self._entries
+                if entry["time_start"] is not None
+            ]
+            times_stop = [
+                entry["time_stop"]
+                for entry in self._entries
+                if entry["time_stop"] is not None
+            ]
+        return {
+            "fieldnames": self.fieldnames,
+            "nb_rows": self.nb_rows,
+            "time_start": times_start[0] if times_start else np.nan,
+            "time_stop": times_stop[-1] if times_stop else np.nan,
+        }
+
+
+class BackgroundWriter:
+    """Thread writing the rows of table files.
+
+    The rows are put in a bounded queue. The thread takes all the rows
+    available, groups them by file and writes them (one write per file
+    for each batch).
+
+    Parameters
+    ----------
+
+    queue_size : int
+
+      Maximum number of rows in the queue.
+
+    policy : {"block", "drop", "spill"}
+
+      What to do when the queue is full: wait for free space ("block"),
+      discard the row ("drop", counted in `nb_dropped`) or keep it in an
+      unbounded list in memory ("spill").
+
+    An error in the thread is raised at the next call of `put` or
+    `flush`. After `close`, the thread is restarted if rows are put.
+
+    """
+
+    _policies = ("block", "drop", "spill")
+
+    def __init__(self, queue_size=10000, policy="block"):
+        if policy not in self._policies:
+            raise ValueError(f"policy has to be in {self._policies}")
+        self.policy = policy
+        self.nb_dropped = 0
+        self.error = None
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._spill = deque()
+        self._spill_lock = threading.Lock()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        _writers.add(self)
+
+    def _start(self):
+        with self._thread_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="BackgroundWriter", daemon=True
+                )
+                self._thread.start()
+
+    def _raise_error(self):
+        """Raise (once) the last error of the thread."""
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def put(self, table_file, row):
+        """Put a row (dict) to be written in a table file."""
+        self._raise_error()
+        # errors in the row are raised in the caller thread
+        item = (table_file, table_file._row_as_list(row))
+        self._put(item)
+
+    def _put(self, item, force=False):
+        if self._thread is None:
+            self._start()
+
+        with self._spill_lock:
+            if self._spill:
+                # keep the order of the rows
+                self._spill.append(item)
+                return
+            try:
+                self._queue.put_nowait(item)
+                return
+            except queue.Full:
+                if self.policy == "spill" or force:
+                    self._spill.append(item)
+                    return
+                if self.policy == "drop":
+                    self.nb_dropped += 1
+                    return
+        self._queue.put(item)
+
+    def _get_items(self):
+        try:
+            items = [self._queue.get(timeout=0.1)]
+        except queue.Empty:
+            items = []
+        while True:
+            try:
+                items.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if not items:
+            with self._spill_lock:
+                items = list(self._spill)
+                self._spill.clear()
+        return items
+
+    def _run(self):
+        while True:
+            items = self._get_items()
+            rows_by_file = {}
+            events = []
+            stop = False
+            for item in items:
+                if item is None:
+                    stop = True
+                elif isinstance(item, threading.Event):
+                    events.append(item)
+                else:
+                    table_file, row = item
+                    rows_by_file.setdefault(table_file, []).append(row)
+
+            for table_file, rows in rows_by_file.items():
+                try:
+                    table_file._append_lists(rows)
+                    # the thread is here to wait for the disk
+                    table_file.flush()
+                except Exception as error:
+                    self.error = error
+                    traceback.print_exc()
+
+            for event in events:
+                event.set()
+            if stop:
+                return
+
+    def flush(self, timeout=None):
+        """Wait until all the rows put before the call are written."""
+        if self._thread is not None and self._thread.is_alive():
+            event = threading.Event()
+            self._put(event, force=True)
+            event.wait(timeout)
+        self._raise_error()
+
+    def close(self):
+        """Write the remaining rows and stop the thread.
+
+        The thread is started again if rows are put after the call.
+
+        """
+        thread = self._thread
+        if thread is None:
+            return
+        if thread.is_alive():
+            self._put(None, force=True)
+            thread.join()
+        with self._thread_lock:
+            self._thread = None
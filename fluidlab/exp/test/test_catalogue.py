@@ -0,0 +1,117 @@
+import os
+import time
+from tempfile import TemporaryDirectory
+
+import numpy as np
+import h5py
+
+from fluiddyn.io import stdout_redirected
+
+from fluidlab.exp.catalogue import Catalogue, main, register_run
+
+
+def _create_files(path_dir):
+    for index, time_expo in enumerate([0.01, 0.02, 0.01]):
+        path = os.path.join(path_dir, f"piv2d_double_frame_{index}.h5")
+        with h5py.File(path, "w") as file:
+            file["t"] = np.arange(10) * 0.1
+            file["volt_angle"] = np.zeros(10)
+            file["t_start"] = time.ctime(1e9 + 3600 * index)
+            file["time_expo"] = time_expo
+    path = os.path.join(path_dir, "probe.h5")
+    with h5py.File(path, "w") as file:
+        file["t"] = np.arange(10) * 0.01
+        file["voltrho"] = np.zeros(10)
+    # not an experiment file
+    with h5py.File(os.path.join(path_dir, "other.h5"), "w") as file:
+        file["x"] = 1
+
+
+def names(paths):
+    return [os.path.basename(path) for path in paths]
+
+
+def test_register_query():
+    with TemporaryDirectory() as tmpdir:
+        catalogue = Catalogue(os.path.join(tmpdir, "catalogue.sqlite"))
+        catalogue.register("a.h5", "torque", 10.0, sample_rate=100, name="a")
+        catalogue.register("b.h5", "torque", 20.0, sample_rate=200)
+        catalogue.register("c.h5", "piv2d_single_frame", 30.0, time_expo=0.1)
+        # registering again replaces the run
+        catalogue.register("b.h5", "torque", 20.0, sample_rate=300)
+
+        assert len(catalogue) == 3
+        assert names(catalogue.query()) == ["a.h5", "b.h5", "c.h5"]
+        assert names(catalogue.query(kind="piv*")) == ["c.h5"]
+        assert names(catalogue.query(sample_rate=300)) == ["b.h5"]
+        assert names(catalogue.query(sample_rate=(150, None))) == ["b.h5"]
+        assert names(catalogue.query(since=15, until=25)) == ["b.h5"]
+        assert catalogue.get_info("a.h5")["params"] == {
+            "sample_rate": 100,
+            "name": "a",
+        }
+
+        catalogue.remove("a.h5")
+        assert names(catalogue.query(kind="torque")) == ["b.h5"]
+
+
+def test_rebuild():
+    with TemporaryDirectory() as tmpdir:
+        _create_files(tmpdir)
+        path_db = os.path.join(tmpdir, "catalogue.sqlite")
+        with stdout_redirected():
+            main(["--db", path_db, "rebuild", tmpdir, "-n", "2"])
+
+        catalogue = Catalogue(path_db)
+        assert len(catalogue) == 4
+        paths = catalogue.query(kind="piv2d_double_frame", time_expo=0.01)
+        assert names(paths) == [
+            "piv2d_double_frame_0.h5",
+            "piv2d_double_frame_2.h5",
+        ]
+        info = catalogue.get_info(paths[0])
+        assert info["time_measurement"] == 1e9
+        assert np.isclose(info["params"]["sample_rate"], 10)
+        assert catalogue.query(kind="mscti_probe", sample_rate=(99, 101))
+
+
+def test_rebuild_clear():
+    with TemporaryDirectory() as tmpdir:
+        dir0 = os.path.join(tmpdir, "dir0")
+        dir1 = os.path.join(tmpdir, "dir1")
+        for path_dir in (dir0, dir1):
+            os.mkdir(path_dir)
+            _create_files(path_dir)
+        catalogue = Catalogue(os.path.join(tmpdir, "catalogue.sqlite"))
+        catalogue.rebuild([dir0, dir1], nb_workers=1)
+        assert len(catalogue) == 8
+        # a run of dir1 not found by rebuild (other pattern)
+        path_notes = os.path.join(dir1, "notes.txt")
+        open(path_notes, "w").close()
+        catalogue.register(path_notes, "torque", 1e9)
+        # a run whose file no longer exists
+        catalogue.register(os.path.join(tmpdir, "removed.h5"), "torque", 1e9)
+
+        for path_dir in (dir0, dir1):
+            os.remove(os.path.join(path_dir, "probe.h5"))
+        catalogue.rebuild(dir0, nb_workers=1, clear=True)
+
+        # the runs of dir1 are kept (except the missing file)
+        paths = catalogue.query()
+        assert len(paths) == 7
+        assert path_notes in paths
+        names_piv = [f"piv2d_double_frame_{index}.h5" for index in range(3)]
+        assert sorted(names(paths)) == sorted(2 * names_piv + ["notes.txt"])
+
+
+def test_register_run_best_effort(monkeypatch):
+    with TemporaryDirectory() as tmpdir:
+        path_db = os.path.join(tmpdir, "catalogue.db")
+        monkeypatch.setenv("FLUIDLAB_CATALOGUE", path_db)
+        path = os.path.join(tmpdir, "torque_0.h5")
+        with stdout_redirected():
+            # errors are only printed
+            register_run(path, "torque", time_measurement="not a time")
+            register_run(path, "torque", time_measurement=1e9, speed=2.0)
+        runs = Catalogue(path_db).query(kind="torque")
+        assert len(runs) == 1
@@ -0,0 +1,54 @@
+from tempfile import TemporaryDirectory
+
+import numpy as np
+import matplotlib
+
+matplotlib.use("Agg")
+
+from fluidlab.exp.liveplot import LivePlot, decimate_minmax
+from fluidlab.exp.session import DataTable
+
+
+def test_decimate_minmax():
+    x = np.arange(1005.0)
+    y = np.sin(x / 10)
+    y[503] = 10
+    x_dec, y_dec = decimate_minmax(x, y, 100)
+    assert x_dec.size <= 2 * 100
+    assert np.all(np.diff(x_dec) > 0)
+    assert y_dec.max() == 10
+    assert y_dec.min() == y.min()
+
+    x_dec, y_dec = decimate_minmax(x[:10], y[:10], 100)
+    assert x_dec.size == 10
+
+
+def test_live_plot():
+    live_plot = LivePlot(["a", "b"], nb_points_full=100)
+    nb_pixels = live_plot._get_nb_pixels()
+    for index in range(50):
+        x = np.arange(100 * index, 100 * (index + 1), dtype=float)
+        live_plot.update(x, {"a": np.cos(x), "b": x})
+
+    assert len(live_plot.ax.lines) == 2
+    x, y = live_plot.lines["b"].get_data()
+    assert x.size <= 2 * nb_pixels + 1
+    assert y[-1] == 4999
+    # the history is decimated
+    assert live_plot._history["a"][0].size <= 8 * nb_pixels
+    live_plot.close()
+
+
+def test_data_table_live_figure():
+    with TemporaryDirectory() as tmpdir:
+        table = DataTable("table", path=tmpdir, fieldnames=["a"])
+        table.save({"a": 0})
+        table.init_figure(live=True, nb_points_full=10)
+        for value in range(1, 30):
+            table.save({"a": value})
+        table.update_figures()
+        fig = table.figures[0]
+        assert fig._nb_points_plotted == 30
+        assert fig._live_plot.lines["a"].get_data()[1].tolist() == list(range(30))
+        fig._live_plot.close()
+        table.close()
@@ -1,10 +1,27 @@
 import os
+import json
+import multiprocessing
 import shutil
+import subprocess
+import sys
 from glob import glob
+from tempfile import TemporaryDirectory
+
+import h5py
+import numpy as np
+import matplotlib.pyplot as plt
+import pytest
 
 from fluiddyn.io import stdout_redirected
 
-from fluidlab.exp.session import Session
+from fluidlab.exp import session as session_module
+from fluidlab.exp.session import Session, DataTable, DataTableProxy
+from fluidlab.exp.tablefiles import (
+    H5TableFile,
+    CSVTableFile,
+    SegmentedTableFile,
+    BackgroundWriter,
+)
 
 
 class TestCase:
@@ -27,3 +44,530 @@ class TestCase:
         paths = glob(os.path.join(session.path, session.name) + "_*")
         for path in paths:
             os.remove(path)
+
+
+def test_data_table_buffered():
+    with TemporaryDirectory() as tmpdir:
+        table = DataTable(
+            "table", path=tmpdir, fieldnames=["a", "b"], buffer_size=3
+        )
+        table.save({"a": 1, "b": 0.5})
+        table.save({"a": 2, "b": 1.5})
+        # still in the buffer
+        with open(table.path) as file:
+            assert len(file.readlines()) == 1
+        table.save({"a": 3, "b": 2.5})
+        with open(table.path) as file:
+            assert len(file.readlines()) == 4
+
+        table.save({"a": 4, "b": 3.5})
+        data = table.load(["a", "b"])
+        assert data["a"].tolist() == [1, 2, 3, 4]
+        table.close()
+
+        # same format as csv.DictWriter
+        with open(table.path, newline="") as file:
+            lines = file.readlines()
+        assert lines[0] == "time,clock,a,b\r\n"
+        assert lines[-1].endswith(",4,3.5\r\n")
+
+        # reopen the file without fieldnames
+        table = DataTable(path=table.path)
+        assert table.fieldnames == ["time", "clock", "a", "b"]
+        assert table.varnames == ["a", "b"]
+        table.close()
+
+
+def test_data_table_string_field():
+    with TemporaryDirectory() as tmpdir:
+        table = DataTable("table", path=tmpdir, fieldnames=["a", "s"])
+        table.save({"a": 1, "s": "hello"})
+        table.save({"a": 2, "s": ""})
+        table.close()
+        table.save({"a": 3, "s": "world"})
+        table.close()
+
+        with open(table.path) as file:
+            lines = file.readlines()
+        assert len(lines) == 4
+        assert sum("hello" in line for line in lines) == 1
+        assert table.load(["a"])["a"].tolist() == [1, 2, 3]
+        # non-numeric values are NaN in the summaries
+        overview = table.load_overview(max_points=10, varnames=["a", "s"])
+        assert overview["a_max"].max() == 3
+        assert np.isnan(overview["s_mean"]).all()
+
+
+def test_session_close():
+    with TemporaryDirectory() as tmpdir:
+        with stdout_redirected():
+            session = Session(path=tmpdir, name="test")
+        with session:
+            table = session.get_data_table("table", fieldnames=["a"])
+            table.save({"a": 1})
+        with open(table.path) as file:
+            assert len(file.readlines()) == 2
+
+
+def test_data_table_new_rows():
+    with TemporaryDirectory() as tmpdir:
+        table = DataTable("table", path=tmpdir, fieldnames=["a"], buffer_size=1)
+        for value in range(5):
+            table.save({"a": value})
+        assert table.get_nb_times_saved() == 5
+        assert table.load_new_rows(["a"])["a"].tolist() == list(range(5))
+        assert table.load_new_rows(["a"])["a"].size == 0
+
+        table.save({"a": 5})
+        table.save({"a": 6})
+        data = table.load_new_rows()
+        assert data["a"].tolist() == [5, 6]
+        assert sorted(data) == ["a", "clock", "time"]
+        table.close()
+
+        # a partial last line (being written) is not returned
+        with open(table.path, "a") as file:
+            file.write("1.5,2.5,7\n1.5,2.5,")
+        table = DataTable(path=table.path)
+        assert table.get_nb_times_saved() == 8
+        data, index = table._file.read_rows(6, ["a"])
+        assert data["a"].tolist() == [6, 7]
+        assert index == 8
+        table.close()
+
+
+def test_data_table_h5():
+    with TemporaryDirectory() as tmpdir:
+        table = DataTable(
+            "table.h5", path=tmpdir, fieldnames=["a", "b"], buffer_size=2
+        )
+        assert table.extension == "h5"
+        for value in range(3):
+            table.save({"a": value, "b": 0.5 * value})
+
+        # reader in SWMR mode while the file is open for writing
+        reader = H5TableFile(table.path, readonly=True)
+        assert reader.fieldnames == ["time", "clock", "a", "b"]
+        data, index = reader.read_rows(0, ["a"])
+        assert data["a"].tolist() == [0, 1]
+        table.flush()
+        data, index = reader.read_rows(index, ["a", "b"])
+        assert data["b"].tolist() == [1.0]
+        assert index == 3
+        reader.close()
+
+        assert table.load_new_rows(["a"])["a"].tolist() == [0, 1, 2]
+        table.close()
+
+        with h5py.File(table.path, "r") as file:
+            assert file["table/a"].chunks is not None
+
+        table = DataTable(path=table.path)
+        assert table.get_nb_times_saved() == 3
+        assert table.load(["b"])["b"].tolist() == [0, 0.5, 1.0]
+        table.close()
+
+
+@pytest.mark.parametrize("policy", ["block", "drop", "spill"])
+def test_session_background_writer(policy):
+    with TemporaryDirectory() as tmpdir:
+        with stdout_redirected():
+            session = Session(
+                path=tmpdir,
+                name="test",
+                background_writer=True,
+                writer_queue_size=4,
+                writer_policy=policy,
+            )
+        table = session.get_data_table("table", fieldnames=["a"])
+        for value in range(100):
+            table.save({"a": value})
+        # barrier: all the rows saved before are in the file
+        session.flush()
+        values = table.load(["a"])["a"].tolist()
+        if policy == "drop":
+            assert len(values) + session._writer.nb_dropped == 100
+            assert values == sorted(values)
+        else:
+            assert values == list(range(100))
+        session.close()
+        # the writer is restarted after close
+        table.save({"a": 100})
+        table.close()
+        assert table.load(["a"])["a"][-1] == 100
+
+
+def test_background_writer_errors():
+    with pytest.raises(ValueError):
+        BackgroundWriter(policy="wait")
+
+    with TemporaryDirectory() as tmpdir:
+        table_file = CSVTableFile(os.path.join(tmpdir, "t.csv"), ["a"])
+        writer = BackgroundWriter()
+        # unknown fields are detected in the thread calling put
+        with pytest.raises(ValueError):
+            writer.put(table_file, {"b": 1})
+        writer.put(table_file, {"a": 1})
+        writer.close()
+        assert table_file.nb_rows == 1
+
+        # errors in the thread are raised by the next put
+        def append_lists(rows):
+            raise OSError("disk full")
+
+        table_file._append_lists = append_lists
+        with stdout_redirected():
+            writer.put(table_file, {"a": 2})
+            writer.close()
+        with pytest.raises(OSError):
+            writer.put(table_file, {"a": 3})
+        del table_file._append_lists
+        writer.put(table_file, {"a": 4})
+        writer.flush()
+        assert table_file.nb_rows == 2
+        writer.close()
+        table_file.close()
+
+
+@pytest.mark.parametrize("extension", ["csv", "h5"])
+def test_data_table_time_range(extension):
+    with TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "table." + extension)
+        cls = CSVTableFile if extension == "csv" else H5TableFile
+        table_file = cls(path, ["time", "a"], buffer_size=7, index_period=10)
+        for value in range(95):
+            table_file.append({"time": 0.5 * value, "a": value})
+        table_file.flush()
+        assert table_file._get_index().shape == (10, 3)
+
+        data = table_file.load(["a"], t_start=10, t_stop=20.2)
+        assert data["a"].tolist() == list(range(20, 41))
+        data = table_file.load(t_start=45)
+        assert data["a"].tolist() == list(range(90, 95))
+        assert data["time"][0] == 45
+        assert table_file.load(["a"], t_stop=1)["a"].tolist() == [0, 1, 2]
+        assert table_file.load(["a"], t_start=100)["a"].size == 0
+        table_file.close()
+
+        # the index is rebuilt if it is missing
+        os.remove(path + ".idx")
+        table_file = cls(path, index_period=10)
+        table_file.append({"time": 100, "a": 200})
+        data = table_file.load(["a"], t_start=40, t_stop=1000)
+        assert data["a"].tolist() == list(range(80, 95)) + [200]
+        table_file.close()
+
+
+def test_csv_read_rows_seek():
+    with TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "table.csv")
+        table_file = CSVTableFile(path, ["time", "a"], index_period=10)
+        table_file.append_rows({"time": value, "a": value} for value in range(95))
+        data, index = table_file.read_rows(0, ["a"])
+        assert index == 95
+        # reading again from a previous row starts from an entry of the index
+        table_file._seek_row(43)
+        assert table_file._cursor_row == 40
+        for start in (43, 0, 90, 10, 95):
+            data, index = table_file.read_rows(start, ["a"])
+            assert data["a"].tolist() == list(range(start, 95))
+            assert index == 95
+        table_file.close()
+
+
+def test_data_table_load_time_range():
+    with TemporaryDirectory() as tmpdir:
+        table = DataTable("table", path=tmpdir, fieldnames=["a"])
+        for value in range(10):
+            table.save({"a": value})
+        times = table.load(["time"])["time"]
+        data = table.load(["a"], t_start=times[3], t_stop=times[5])
+        assert data["a"].tolist() == [3, 4, 5]
+        table.close()
+
+
+@pytest.mark.parametrize("extension", ["csv", "h5"])
+def test_summary_pyramid(extension):
+    with TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "table." + extension)
+        cls = CSVTableFile if extension == "csv" else H5TableFile
+        table_file = cls(path, ["time", "a"], buffer_size=33)
+        values = np.sin(np.arange(2345) / 50)
+        for index, value in enumerate(values):
+            table_file.append({"time": float(index), "a": value})
+        table_file.flush()
+
+        summary = table_file._summary
+        records = summary._read_records(0)
+        assert records.shape == (234, 5)
+        assert np.allclose(records[:, 2], values[:2340].reshape(-1, 10).min(1))
+        assert np.allclose(records[:, 4], values[:2340].reshape(-1, 10).mean(1))
+        assert summary._get_nb_records(2) == 2
+
+        data = table_file.load_overview(100, 299, max_points=50)
+        # level 10
+        assert data["time"].size == 20
+        assert data["a_max"].max() == values[100:300].max()
+        assert table_file.load_overview(max_points=100)["time"].size <= 100
+        # full resolution
+        data = table_file.load_overview(10, 20, max_points=50)
+        assert np.array_equal(data["a_mean"], values[10:21])
+        table_file.close()
+
+        # incomplete blocks are reloaded (and missing files rebuilt)
+        os.remove(path + ".sum100")
+        table_file = cls(path, buffer_size=1)
+        assert summary._pending is not None
+        for index in range(2345, 2400):
+            table_file.append({"time": float(index), "a": 0.0})
+        records = table_file._summary._read_records(0)
+        assert records.shape == (240, 5)
+        assert records[234, 3] == values[2340:2345].max()
+        assert table_file._summary._get_nb_records(1) == 24
+        table_file.close()
+
+
+def test_data_table_overview():
+    with TemporaryDirectory() as tmpdir:
+        table = DataTable("table", path=tmpdir, fieldnames=["a"])
+        for value in range(100):
+            table.save({"a": value})
+        data = table.load_overview(max_points=10)
+        assert data["a_min"].tolist() == list(range(0, 100, 10))
+        fig = table.plot_vs_time(max_points=10)
+        assert fig._nb_points_plotted == 100
+        plt.close(fig)
+        table.close()
+
+
+def test_session_reload(monkeypatch):
+    with TemporaryDirectory() as tmpdir:
+        with stdout_redirected():
+            session = Session(path=tmpdir, name="test")
+        with session:
+            table = session.get_data_table("table", fieldnames=["a"])
+            table_h5 = session.get_data_table("other.h5", fieldnames=["b"])
+            # indexed without closing the file opened for writing
+            h5file = table_h5._file._file
+            assert h5file is not None
+            assert session._read_data_tables_info()["other"]["nb_rows"] == 0
+            for value in range(5):
+                table.save({"a": value})
+                table_h5.save({"b": value})
+            assert table_h5._file._file is h5file
+        times = table.load(["time"])["time"]
+        # table not created with the session
+        table = DataTable("manual", path=session.path, fieldnames=["c"])
+        table.save({"c": 1})
+        table.close()
+
+        with stdout_redirected():
+            session = Session(path=tmpdir, name="test")
+        assert sorted(session.data_tables) == ["manual", "other", "table"]
+        proxy = session.data_tables["table"]
+        assert isinstance(proxy, DataTableProxy)
+        assert proxy._data_table is None
+        assert proxy.nb_rows == 5
+        assert proxy.varnames == ["a"]
+        assert (proxy.time_start, proxy.time_stop) == (times[0], times[-1])
+        assert session.data_tables["manual"].nb_rows == 1
+        assert proxy._data_table is None
+
+        # the table is opened when needed
+        assert proxy.load(["a"])["a"].tolist() == list(range(5))
+        assert proxy._data_table is not None
+        table = session.get_data_table("table")
+        assert table is proxy._data_table
+        table.save({"a": 5})
+        session.close()
+
+        def read_table_info(path):
+            raise AssertionError("no need to open the table files")
+
+        with stdout_redirected():
+            session = Session(path=tmpdir, name="test")
+        # only the modified table is opened
+        assert session.data_tables["table"].nb_rows == 6
+        monkeypatch.setattr(session_module, "_read_table_info", read_table_info)
+        with stdout_redirected():
+            session = Session(path=tmpdir, name="test")
+        assert session.data_tables["other"].nb_rows == 5
+        session.close()
+
+
+@pytest.mark.parametrize("extension", ["csv", "h5"])
+def test_segmented_table(extension):
+    with TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "table." + extension)
+        cls = CSVTableFile if extension == "csv" else H5TableFile
+        table_file = SegmentedTableFile(
+            path, ["time", "a"], cls, max_duration=10.0, buffer_size=4
+        )
+        for index in range(35):
+            table_file.append({"time": float(index), "a": index})
+        assert table_file.nb_rows == 35
+        table_file.close()
+
+        with open(os.path.join(path + ".segments", "manifest.json")) as file:
+            manifest = json.load(file)
+        segments = manifest["segments"]
+        assert [entry["nb_rows"] for entry in segments] == [10, 10, 10, 5]
+        assert segments[1]["time_start"] == 10.0
+        assert not os.path.exists(path)
+
+        table_file = SegmentedTableFile(path)
+        # only the overlapping segments are opened
+        data = table_file.load(["a"], t_start=13, t_stop=19)
+        assert data["a"].tolist() == list(range(13, 20))
+        assert list(table_file._segments) == [1]
+        data, index = table_file.read_rows(10, ["a"])
+        assert data["a"].tolist() == list(range(10, 35))
+        assert index == 35
+        data = table_file.load_overview(max_points=10)
+        assert data["time"].size <= 10
+        assert data["a_max"].max() == 34
+        # no segment in the time range
+        data = table_file.load_overview(100, 200, max_points=10)
+        assert data["time"].size == data["a_mean"].size == 0
+        table_file.append({"time": 35.0, "a": 35})
+        assert table_file.load(["a"], t_start=34)["a"].tolist() == [34, 35]
+        table_file.close()
+
+
+def test_data_table_rotation():
+    with TemporaryDirectory() as tmpdir:
+        with stdout_redirected():
+            # the rotation is checked for each batch of rows written
+            session = Session(path=tmpdir, name="test", background_writer=False)
+        with session:
+            table = session.get_data_table(
+                "table", fieldnames=["a"], buffer_size=1, rotate_size=500
+            )
+            for value in range(50):
+                table.save({"a": value})
+            assert table.load(["a"])["a"].tolist() == list(range(50))
+        assert len(glob(table.path + ".segments/*.csv")) > 1
+
+        with stdout_redirected():
+            session = Session(path=tmpdir, name="test")
+        assert session.data_tables["table"].nb_rows == 50
+        table = session.get_data_table("table")
+        table.save({"a": 50})
+        assert table.load_new_rows(["a"])["a"].tolist() == list(range(51))
+        session.close()
+
+
+def test_csv_parse_chunks():
+    with TemporaryDirectory() as tmpdir:
+        table_file = CSVTableFile(os.path.join(tmpdir, "t.csv"), ["a", "b", "c"])
+        table_file.parse_chunk_size = 50
+        table_file.append_rows(
+            [{"a": i, "b": 0.5 * i, "c": -i} for i in range(100)]
+        )
+        table_file.append({"a": 100, "c": -100})
+        data = table_file.load(["c", "b"])
+        assert data["c"].tolist() == [-i for i in range(101)]
+        assert data["b"].dtype == np.float64
+        assert data["b"].flags.c_contiguous
+        # missing value
+        assert np.isnan(data["b"][-1])
+        table_file.close()
+
+        # blank line (hand-edited file)
+        with open(table_file.path, "a") as file:
+            file.write("\n101,1.5,-101\n")
+        table_file = CSVTableFile(table_file.path)
+        data = table_file.load(["a"])
+        assert data["a"].tolist() == list(range(102))
+        table_file.close()
+
+
+def _append_from_process(path, ivalue):
+    table = DataTable(path=path, buffer_size=7)
+    for index in range(200):
+        table.save({"a": ivalue, "b": index})
+    table.close()
+
+
+@pytest.mark.skipif(
+    "fork" not in multiprocessing.get_all_start_methods(),
+    reason="needs the start method fork",
+)
+@pytest.mark.parametrize("extension", ["csv", "bin"])
+def test_data_table_multiprocess(extension):
+    with TemporaryDirectory() as tmpdir:
+        table = DataTable(
+            "table." + extension, path=tmpdir, fieldnames=["a", "b"]
+        )
+        table.close()
+        context = multiprocessing.get_context("fork")
+        processes = [
+            context.Process(
+                target=_append_from_process, args=(table.path, ivalue)
+            )
+            for ivalue in range(4)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+
+        table = DataTable(path=table.path)
+        assert table.get_nb_times_saved() == 800
+        data = table.load(["a", "b"])
+        for ivalue in range(4):
+            assert data["b"][data["a"] == ivalue].tolist() == list(range(200))
+        # index and summaries consistent with the rows of all processes
+        assert table._file._get_index()[:, 1].tolist() == [0.0]
+        records = table._file._summary._read_records(0)
+        assert records.shape[0] == 80
+        # minimum of the column "b" (columns clock, a, b)
+        assert records[:, 8].tolist() == data["b"].reshape(80, 10).min(1).tolist()
+        table.close()
+
+
+def test_data_table_bin():
+    with TemporaryDirectory() as tmpdir:
+        table = DataTable("table.bin", path=tmpdir, fieldnames=["a", "b"])
+        for value in range(2500):
+            table.save({"a": value, "b": -value})
+        data = table.load(["b"])
+        assert isinstance(data["b"], np.memmap)
+        assert data["b"][-3:].tolist() == [-2497, -2498, -2499]
+        times = table.load(["time"])["time"]
+        data = table.load(["a"], t_start=times[1500], t_stop=times[2100])
+        assert data["a"].tolist() == list(range(1500, 2101))
+        assert table.load_overview(max_points=100)["a_max"].max() == 2499
+        table.close()
+
+        with open(table.path + ".json") as file:
+            assert json.load(file)["fieldnames"] == ["time", "clock", "a", "b"]
+        assert os.path.getsize(table.path) == 2500 * 4 * 8
+
+        table = DataTable(path=table.path)
+        table.save({"a": 2500})
+        assert table.load_new_rows(["a"])["a"][-2:].tolist() == [2499, 2500]
+        assert np.isnan(table.load(["b"])["b"][-1])
+        table.close()
+
+
+def test_import_without_matplotlib():
+    code = (
+        "import sys, fluidlab.exp.session, fluidlab.objects.boards; "
+        "assert 'matplotlib' not in sys.modules; "
+        "assert 'fluidlab.objects.boards.nidaqnx' not in sys.modules"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True)
+
+
+def test_signal_handlers_opt_in():
+    code = (
+        "import os, signal, tempfile\n"
+        "from fluidlab.exp import tablefiles\n"
+        "path = os.path.join(tempfile.mkdtemp(), 't.csv')\n"
+        "tablefiles.CSVTableFile(path, ['a'])\n"
+        "assert signal.getsignal(signal.SIGTERM) is signal.SIG_DFL\n"
+        "tablefiles.install_signal_handlers()\n"
+        "assert signal.getsignal(signal.SIGTERM) is not signal.SIG_DFL\n"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True)
@@ -18,7 +18,9 @@ Provides two small classes, :class:`ObjectUsingBoard` and the modules:
 The classes for data acquisition boards should be obtained from this
 package. If the boards are not available, no error are raised and the
 classes are replaced by the class
-:class:`fluidlab.objects.boards.FalseBoard`.
+:class:`fluidlab.objects.boards.FalseBoard`. The drivers are imported
+(and the warnings printed) only when the classes are first accessed,
+so that importing this package is fast and silent.
 
 For example, with a computer without PowerDAQ board::
 
@@ -40,7 +42,7 @@ For example, with a computer without PowerDAQ board::
 
 """
 
-from fluiddyn.io import _write_warning
+import importlib
 
 
 class FalseBoard:
@@ -66,25 +68,42 @@ class FalseBoard:
         return False
 
 
-try:
-    from .powerdaq import PowerDAQBoard
-except ImportError:
-    _write_warning(
-        "Warning:\n    no fluidlab.objects.boards.powerdaq (use FalseBoard)."
-    )
-    PowerDAQBoard = FalseBoard
+def _import_board(name):
+    """Import a board class, or return FalseBoard with a warning."""
+    from fluiddyn.io import _write_warning
+
+    if name == "PowerDAQBoard":
+        try:
+            from .powerdaq import PowerDAQBoard
+        except ImportError:
+            _write_warning(
+                "Warning:\n    no fluidlab.objects.boards.powerdaq (use FalseBoard)."
+            )
+            PowerDAQBoard = FalseBoard
+        return PowerDAQBoard
 
+    from . import nidaqnx
 
-from . import nidaqnx
+    if nidaqnx.works:
+        return nidaqnx.NIDAQBoard
 
-if nidaqnx.works:
-    NIDAQBoard = nidaqnx.NIDAQBoard
-else:
     _write_warning(
         "Warning:\n    "
         "no fluidlab.objects.boards.nidaqnx.NIDAQBoard (use FalseBoard)."
     )
-    NIDAQBoard = FalseBoard
+    return FalseBoard
+
+
+def __getattr__(name):
+    """The board drivers are only imported when they are used."""
+    if name in ("PowerDAQBoard", "NIDAQBoard"):
+        value = _import_board(name)
+    elif name == "nidaqnx":
+        value = importlib.import_module(".nidaqnx", __name__)
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    globals()[name] = value
+    return value
 
 
 class ObjectUsingBoard:
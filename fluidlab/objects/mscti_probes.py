@@ -20,6 +20,7 @@ import matplotlib.pyplot as plt
 
 from fluiddyn.io import query
 from fluidlab.daq.daqmx import read_analog
+from fluidlab.exp.catalogue import register_run
 
 import h5py
 
@@ -225,6 +226,13 @@ class MSCTIProbe:
                     else:
                         f["calibration/coeffsT"] = self.coeffsT
 
+        register_run(
+            path,
+            "mscti_probe",
+            sample_rate=self.sample_rate,
+            duration=len(times) / self.sample_rate,
+        )
+
     def measure_density(self):
 
         time, voltages = self.measure_volts(duration=2)
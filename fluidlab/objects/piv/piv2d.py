@@ -2,39 +2,25 @@
 =========
 
 """
+
 from __future__ import print_function, division
 
 import os
 import time
-import sys
-from glob import glob
 
 import numpy as np
 
 from labjack import ljm
 
 from fluiddyn.io.query import query_yes_no
-from fluidlab.instruments.daq.streaming_t7 import T7
+from fluidlab.daq.streaming_t7 import T7, StreamOutRefiller
 
-from fluidlab.exp import Timer
-from .signal_double_frame import make_signal_double_frame
+from .waveforms import make_double_frame_trigger
 from .util import wait_for_file, save_exp, serial_numbers
 
-
 path_save = os.path.join(os.path.expanduser("~"), ".fluidcoriolis")
 
 
-def is_new_file(str_name):
-    str_name = os.path.expanduser(str_name)
-    files_start = glob(str_name)
-    while True:
-        files = glob(str_name)
-        if len(files) > len(files_start):
-            return max(files, key=os.path.getctime)
-
-        time.sleep(0.1)
-
-
 class PIV2D:
     """Trigger cameras for PIV 2D (single and double frame)
 
@@ -132,24 +118,48 @@ class PIV2D:
         """
         Double frame 2D PIV.
 
-        # TODO: Understand volts.
+        Send a double pulse signal to trig cameras (DAC0) every
+        `time_between_pairs`. The whole sequence is hardware-timed: the
+        signal of one period (double pulse followed by zeros) is split in
+        segments written in the stream-out buffer by a
+        :class:`fluidlab.daq.streaming_t7.StreamOutRefiller`.
 
         Parameters
         ----------
 
-        Returns
-        -------
+        time_between_pairs : float
+          Period in s.
+
+        time_expo : float
+          Exposure time in s.
+
+        time_between_frames : float
+          Time between the two frames in s.
+
+        nb_couples : int
+          Number of pairs of images.
+
+        nb_nodes : int
+          Maximum number of time nodes of the double pulse signal (it
+          gives the maximum scan rate).
+
+        The durations are rounded jointly to the sample clock (see
+        :class:`fluidlab.objects.piv.waveforms.Waveform`).
+
         """
 
-        (
-            times_signal,
-            volts_signal,
+        wave = make_double_frame_trigger(
             time_expo,
             time_between_frames,
-            time_between_nodes,
-        ) = make_signal_double_frame(
-            time_between_pairs, time_expo, time_between_frames, nb_nodes
+            time_between_pairs,
+            max_scan_rate=(nb_nodes - 1) / (time_expo + time_between_frames),
         )
+        # signal of one period: double pulse and zeros
+        volts_period = wave.generate()[0]
+        edges = wave.get_edge_times()
+        time_expo = edges[1]
+        time_between_frames = edges[2]
+        time_between_pairs = wave.duration
 
         print(
             "New values for the variables:\n"
@@ -166,16 +176,11 @@ class PIV2D:
         IN_NAMES = []
         OUT_NAMES = ["DAC0"]
 
-        a = [v for v in volts_signal]
-        # To do: which integer. 12 solves problems with the buffer
-        # size encoding??
-        volts = np.array([np.array(a)])
-        # print(volts)
-        aScanList = t7.prepare_stream(
-            IN_NAMES=IN_NAMES, OUT_NAMES=OUT_NAMES, volt=volts
+        aScanList, volt_splitted = t7.prepare_stream_loop(
+            IN_NAMES=IN_NAMES, OUT_NAMES=OUT_NAMES, volt=[volts_period]
         )
 
-        scanRate = len(OUT_NAMES) / time_between_nodes  # scans/s
+        scanRate = wave.scan_rate  # scans/s
         # scans for each call of the function eStreamRead. It should
         # be an integer
         scansPerRead = scanRate
@@ -199,23 +204,12 @@ class PIV2D:
             "- number of images = {}".format(2 * nb_couples)
         )
 
-        # # to avoid a strange bug
-        # t7.write_out_buffer('STREAM_OUT0_BUFFER_F32', 0*volts[0])
-        # scanRate = ljm.eStreamStart(
-        #     handle, int(scansPerRead), TOTAL_NUM_CHANNELS, aScanList,
-        #     scanRate)
-
-        # time.sleep(time_between_pairs)
-        # t7.write_out_buffer('STREAM_OUT0_BUFFER_F32', volts[0])
-        # time.sleep(time_between_pairs)
-        # # end of the code to avoid the strange bug
-
         if not query_yes_no("Are you ready to start acquisition?"):
             return
 
         save_exp(
-            times_signal,
-            volts_signal,
+            wave.get_times(),
+            volts_period,
             time_between_frames=time_between_frames,
             time_expo=time_expo,
             time_between_pairs=time_between_pairs,
@@ -225,21 +219,22 @@ class PIV2D:
         if wait_file:
             wait_for_file("oscillate_*", nb_period_to_wait)
 
-        timer = Timer(time_between_pairs)
         try:
-            for i in range(nb_couples):
-                scanRate = ljm.eStreamStart(
-                    handle,
-                    int(scansPerRead),
-                    TOTAL_NUM_CHANNELS,
-                    aScanList,
-                    scanRate,
-                )
-                print("\r{}/{}".format(i + 1, nb_couples), end="")
-                sys.stdout.flush()
-                time.sleep(2 * time_between_frames)
-                t7.write_out_buffer("STREAM_OUT0_BUFFER_F32", volts[0])
-                timer.wait_tick()
+            scanRate = ljm.eStreamStart(
+                handle,
+                int(scansPerRead),
+                TOTAL_NUM_CHANNELS,
+                aScanList,
+                scanRate,
+            )
+            time_start = time.perf_counter()
+            if len(volt_splitted[0]) == 1:
+                # the whole period fits in the loop of the device
+                time.sleep(nb_couples * time_between_pairs)
+            else:
+                refiller = StreamOutRefiller(t7, len(OUT_NAMES), scanRate)
+                refiller.run_periods(volt_splitted, nb_couples, time_start)
+                refiller.wait_end()
         except KeyboardInterrupt:
             pass
         finally:
@@ -1,7 +1,6 @@
 from __future__ import print_function, division
 
 import time
-import sys
 
 import numpy as np
 import pylab
@@ -9,10 +8,11 @@ import pylab
 from labjack import ljm
 
 from fluiddyn.io.query import query_yes_no
-from fluidlab.exp import Timer
 from fluidlab.objects.galvanometer import Galva
+from fluidlab.daq.streaming_t7 import StreamOutRefiller, MAX_NB_VALUES_STREAM_OUT
 
 from .util import wait_for_file, save_exp
+from .waveforms import make_saw_tooth_scan
 
 
 class PIVScan:
@@ -69,7 +69,7 @@ class PIVScan:
         tup = t[volt[0].argmax()]
         t7 = self.t7
         handle = t7.handle
-        aScanList = t7.prepare_stream_loop(
+        aScanList, volt_splitted = t7.prepare_stream_loop(
             IN_NAMES=IN_NAMES, OUT_NAMES=OUT_NAMES, volt=volt
         )
 
@@ -103,12 +103,39 @@ class PIVScan:
             rootname="piv_scan_single_frame",
         )
 
-        scanRate = ljm.eStreamStart(
-            handle, int(scansPerRead), TOTAL_NUM_CHANNELS, aScanList, scanRate
-        )
-        print("Stream started")
+        NUM_BUFFER_UPDATES = len(volt_splitted[0])
 
-        t7.wait_before_stop(total_time, time_between_frames)
+        if NUM_BUFFER_UPDATES == 1:
+            scanRate = ljm.eStreamStart(
+                handle, int(scansPerRead), TOTAL_NUM_CHANNELS, aScanList, scanRate
+            )
+            print("Stream started")
+
+            t7.wait_before_stop(total_time, time_between_frames)
+        else:
+            # the period does not fit in the stream-out buffers
+            if total_time is None:
+                print("Stop the acquisition with Ctrl-C")
+                nb_periods = None
+            else:
+                nb_periods = max(1, int(round(total_time / time_between_frames)))
+            try:
+                scanRate = ljm.eStreamStart(
+                    handle,
+                    int(scansPerRead),
+                    TOTAL_NUM_CHANNELS,
+                    aScanList,
+                    scanRate,
+                )
+                time_start = time.perf_counter()
+                refiller = StreamOutRefiller(t7, len(OUT_NAMES), scanRate)
+                refiller.run_periods(volt_splitted, nb_periods, time_start)
+                refiller.wait_end()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                print("")
+                t7.stop_stream()
 
     def double_frame_3d(
         self,
@@ -221,7 +248,6 @@ class PIVScan:
             wait_for_file("oscillate_*", nb_period_to_wait)
 
         NUM_BUFFER_UPDATES = len(volt_splitted[0])
-        STAT_SIZE = volt_splitted[0][0].size
 
         if NUM_BUFFER_UPDATES == 1:
             scanRate = ljm.eStreamStart(
@@ -241,30 +267,10 @@ class PIVScan:
                     aScanList,
                     scanRate,
                 )
-                for i in range(nb_couples):
-                    print("\r{}/{}".format(i + 1, nb_couples), end="")
-                    sys.stdout.flush()
-                    if i == 0:
-                        iteration = 1
-                    else:
-                        iteration = 0
-                    while iteration < NUM_BUFFER_UPDATES:
-                        bs = ljm.eReadName(handle, f"STREAM_OUT{0}_BUFFER_STATUS")
-                        if bs >= STAT_SIZE:
-                            for indout, out in enumerate(OUT_NAMES):
-                                ljm.eWriteName(
-                                    handle,
-                                    f"STREAM_OUT{indout}_LOOP_SIZE",
-                                    STAT_SIZE,
-                                )
-                                t7.write_out_buffer(
-                                    f"STREAM_OUT{indout}_BUFFER_F32",
-                                    volt_splitted[indout][iteration],
-                                )
-                                ljm.eWriteName(
-                                    handle, f"STREAM_OUT{indout}_SET_LOOP", 1
-                                )
-                            iteration = iteration + 1
+                time_start = time.perf_counter()
+                refiller = StreamOutRefiller(t7, len(OUT_NAMES), scanRate)
+                refiller.run_periods(volt_splitted, nb_couples, time_start)
+                refiller.wait_end()
             except KeyboardInterrupt:
                 pass
             finally:
@@ -275,10 +281,16 @@ class PIVScan:
         self.t7.stop_stream()
 
 
-def multilevel_piv(time_between_frames, volt, tacq=None, nloop=None):
+def multilevel_piv(
+    time_between_frames, volt, tacq=None, nloop=None, nb_samples_per_level=20
+):
     """
     multilevel_piv
 
+    The galvanometer voltage (DAC0) and the camera trigger (DAC1) are
+    sampled waveforms output with the stream-out of the T7, so that the
+    timing is set by the clock of the device.
+
     Parameters
     ----------
 
@@ -292,14 +304,53 @@ def multilevel_piv(time_between_frames, volt, tacq=None, nloop=None):
       time of acquition in each level
 
     nloop : integer
-      loop nloop times the array volt
+      loop nloop times the array volt (in addition to the first time)
+
+    nb_samples_per_level : integer
+      number of samples of the waveforms for each level (the trigger
+      duration is rounded to a multiple of time_between_frames /
+      nb_samples_per_level)
+
     """
+    if tacq is None:
+        tacq = 0.9 * time_between_frames
+
     if tacq >= time_between_frames:
         print("you need to verify tacq < time_between_frames")
         return None
 
+    volt = np.asarray(volt, dtype=np.float64).ravel()
+    nb_samples_per_level = int(nb_samples_per_level)
+    nb_samples_high = max(
+        1, int(round(nb_samples_per_level * tacq / time_between_frames))
+    )
+    if nb_samples_high >= nb_samples_per_level:
+        raise ValueError(
+            "nb_samples_per_level too small to resolve "
+            "time_between_frames - tacq"
+        )
+
+    if nloop is None:
+        nb_periods = 1
+    else:
+        nb_periods = nloop + 1
+
+    # waveforms of one period (one pass over the levels)
+    trigger_level = np.zeros(nb_samples_per_level)
+    trigger_level[:nb_samples_high] = 5.0
+    volt_galva = np.repeat(volt, nb_samples_per_level)
+    volt_trigger = np.tile(trigger_level, volt.size)
+
+    scan_rate = nb_samples_per_level / time_between_frames
+    duration_period = volt.size * time_between_frames
+
     galva = Galva()
-    handle = galva.t7.handle
+    t7 = galva.t7
+    handle = t7.handle
+
+    IN_NAMES = []
+    OUT_NAMES = ["DAC0", "DAC1"]
+    TOTAL_NUM_CHANNELS = len(IN_NAMES) + len(OUT_NAMES)
 
     print(
         "\n" + "#" * 79 + "\n Connect DAC0 to the galvanometer"
@@ -320,31 +371,40 @@ def multilevel_piv(time_between_frames, volt, tacq=None, nloop=None):
         else:
             return None
 
-    if tacq is None:
-        tacq = 0.9 * time_between_frames
-
-    if nloop is not None:
-        voltperiod = volt
-        for i in range(nloop):
-            volt = np.hstack([volt, voltperiod])
+    aScanList, volt_splitted = t7.prepare_stream_loop(
+        IN_NAMES=IN_NAMES, OUT_NAMES=OUT_NAMES, volt=[volt_galva, volt_trigger]
+    )
 
+    volt_levels = np.tile(volt, nb_periods)
     save_exp(
-        np.linspace(0, volt.size * time_between_frames, volt.size),
-        volt,
+        time_between_frames * np.arange(volt_levels.size),
+        volt_levels,
+        time_between_frames=time_between_frames,
         rootname="multilevel_piv",
     )
-    timer = Timer(time_between_frames)
-    for volti in volt:
-
-        ljm.eWriteName(handle, "DAC0", volti)
-        ljm.eWriteName(handle, "DAC1", 5)
 
-        time.sleep(tacq)
-        ljm.eWriteName(handle, "DAC1", 0)
-        timer.wait_tick()
-
-    ljm.eWriteName(handle, "DAC0", 0)
-    ljm.eWriteName(handle, "DAC1", 0)
+    try:
+        # scansPerRead has to be >= 1 (scan_rate < 1 Hz for slow scans)
+        scan_rate = ljm.eStreamStart(
+            handle,
+            max(1, int(scan_rate)),
+            TOTAL_NUM_CHANNELS,
+            aScanList,
+            scan_rate,
+        )
+        time_start = time.perf_counter()
+        if len(volt_splitted[0]) == 1:
+            # the whole period fits in the loop of the device
+            time.sleep(nb_periods * duration_period)
+        else:
+            refiller = StreamOutRefiller(t7, len(OUT_NAMES), scan_rate)
+            refiller.run_periods(volt_splitted, nb_periods, time_start)
+            refiller.wait_end()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print("")
+        t7.stop_stream()
 
 
 # def saw_tooth_period(vmin, vmax, tup, nb_levels, time_between_frames):
@@ -403,6 +463,21 @@ def multilevel_piv(time_between_frames, volt, tacq=None, nloop=None):
 #     return volt, freq, t
 
 
+# maximum relative error on the durations of the saw tooth signals
+rtol = 1e-3
+
+
+def _plot_signals(t, volt):
+    pylab.figure()
+    pylab.plot(t, volt[0], "+")
+    pylab.plot(t, volt[1], "r+")
+    pylab.step(t, volt[0], "b-", where="post")
+    pylab.step(t, volt[1], "r-", where="post")
+    pylab.ylim([-1, 6])
+    pylab.xlabel("t (s)")
+    pylab.ylabel("voltage (V)")
+
+
 def saw_tooth_period2(vmin, vmax, time_expo, nb_levels, time_between_frames):
     """Determine the saw tooth profile for single frame acquisition
 
@@ -420,65 +495,27 @@ def saw_tooth_period2(vmin, vmax, time_expo, nb_levels, time_between_frames):
     - volt[0]: saw_tooth profile
     - volt[1]: square wave to trig the camera
     - freq: time frequency
-    """
-
-    nb_levels -= 1
-    freq = 2.0 / time_expo
-
-    N = time_between_frames / time_expo
-    if (N != int(N)) or (N <= nb_levels):
-        print(
-            "time_between_frames / time_expo has to be an integer larger than nb_levels ! "
-        )
-        return
 
-    # Ndown = N - nb_levels
+    The durations are rounded jointly to the sample clock (see
+    :func:`fluidlab.objects.piv.waveforms.make_saw_tooth_scan`), with
+    at most as many samples as a stream-out buffer of the T7 can hold.
+    """
 
-    # first channel
-    volttemp = np.hstack(
-        [
-            np.linspace(vmin, vmax, nb_levels + 1)[:-1],
-            np.linspace(vmax, vmin, N - nb_levels + 1)[:-1],
-        ]
-    )
-    volt0 = np.zeros(volttemp.size * 2)
-    for ind in range(volttemp.size):
-        volt0[2 * ind : 2 * ind + 2] = np.asarray([volttemp[ind], volttemp[ind]])
-
-    # second channel
-    Vmin = 0.0
-    Vmax = 5.0
-    volttemp = np.hstack(
-        [np.zeros(nb_levels + 1) + Vmax, np.zeros(N - nb_levels + 1)[2:] + Vmin]
+    wave = make_saw_tooth_scan(
+        vmin,
+        vmax,
+        time_expo,
+        nb_levels,
+        time_between_frames,
+        max_nb_samples=MAX_NB_VALUES_STREAM_OUT,
+        rtol=rtol,
     )
-
-    volt1 = np.zeros(volttemp.size * 2)
-    for ind in range(volttemp.size):
-        volt1[2 * ind : 2 * ind + 2] = np.asarray([volttemp[ind], 0])
-    print(volt0.shape, volt1.shape)
-    volt = np.vstack([volt0, volt1])
-
-    pylab.figure()
-    t = np.arange(0, time_between_frames, 1 / freq)[0 : volt0.size]
-    pylab.plot(t, volt[0], "+")
-    pylab.plot(t, volt[1], "r+")
-    for i in range(int(t.size / 2 - 1)):
-        pylab.plot(
-            t[i * 2 : i * 2 + 3],
-            np.hstack([volt[0][i * 2 : i * 2 + 2], volt[0][i * 2 + 1]]),
-            "b-",
-        )
-        pylab.plot(
-            t[i * 2 : i * 2 + 2],
-            np.hstack([volt[1][i * 2 : i * 2 + 1], volt[1][i * 2]]),
-            "r-",
-        )
-    pylab.plot((t[1] + t[-1]) * np.ones(2), [0, 5], "k")
-    pylab.ylim([-1, 6])
-    pylab.xlabel("t (s)")
-    pylab.ylabel("voltage (V)")
+    volt = wave.generate()
+    t = wave.get_times()
+    _plot_signals(t, volt)
+    pylab.plot(wave.duration * np.ones(2), [0, 5], "k")
     pylab.show()
-    return volt, freq, t
+    return volt, wave.scan_rate, t
 
 
 # def double_saw_tooth(vmin, vmax, tup, nb_levels, time_between_frames):
@@ -581,101 +618,34 @@ def double_saw_tooth2(
     - freq: time frequency
     - time_between_frames: the calculated time_between_frames.
 
-    As freq is calculated such that freq = nb_levels/tup,
-    time_between_frames is defined as time_between_frames = n/freq
-    with n an integer and can be different from input
-    time_between_frames.
+    The durations are rounded jointly to the sample clock (see
+    :func:`fluidlab.objects.piv.waveforms.make_saw_tooth_scan`), so
+    that time_between_frames can be slightly different from the input
+    time_between_frames. The period has at most as many samples as a
+    stream-out buffer of the T7 can hold.
 
     """
-    if nb_levels * time_expo > time_between_frames:
-        raise ValueError(
-            "nb_levels X time_expo should be smaller than time_between_frames"
-        )
-    nb_levels -= 1
-    freq = 2.0 / time_expo
-    datalenght = int(time_between_pairs * freq)
-
-    if not datalenght % (datalenght * 2 // 512 + 1) == 0:
-        raise ValueError(
-            f"Data lenght = {datalenght} should be divisible by {datalenght*2//512+1}"
-        )
-
-    N = time_between_frames / time_expo
-    # if (N != int(N)) or (N <= nb_levels):
-    #     raise ValueError(
-    #         "time_between_frames / time_expo has to be an integer larger than nb_levels !")
-
-    Ndown = N - nb_levels
-    # print('Ndown = {}'.format(Ndown))
-
-    Ndown = int(Ndown)
-
-    print(Ndown)
-
-    # first channel
-    volttemp = np.hstack(
-        [
-            np.linspace(vmin, vmax, nb_levels + 1)[0:-1],
-            np.linspace(vmax, vmin, Ndown + 1)[0:-1],
-            np.linspace(vmin, vmax, nb_levels + 1)[0:-1],
-            np.linspace(vmax, vmin, Ndown + 1)[0:-1],
-        ]
-    )
-    volt0 = np.zeros(volttemp.size * 2 + 1)
-    for ind in range(volttemp.size):
-        volt0[2 * ind : 2 * ind + 2] = np.asarray([volttemp[ind], volttemp[ind]])
-    volt0[-1] = volt0[0]
-    # second channel
-    Vmin = 0
-    Vmax = 5
-    volttemp = np.hstack(
-        [
-            np.zeros(nb_levels + 1) + Vmax,
-            np.zeros(Ndown + 1)[2:] + Vmin,
-            np.zeros(nb_levels + 1) + Vmax,
-            np.zeros(Ndown + 1)[2:] + Vmin,
-        ]
+    wave = make_saw_tooth_scan(
+        vmin,
+        vmax,
+        time_expo,
+        nb_levels,
+        time_between_frames,
+        nb_scans=2,
+        time_period=time_between_pairs,
+        max_nb_samples=MAX_NB_VALUES_STREAM_OUT,
+        rtol=rtol,
     )
-    volt1 = np.zeros(volttemp.size * 2 + 1)
-    for ind in range(volttemp.size):
-        volt1[2 * ind : 2 * ind + 2] = np.asarray([volttemp[ind], 0])
-    volt1[-1] = 0
-
-    t_missing = time_between_pairs - (time_between_frames * 2 + time_expo)
-    nbpoint_to_add = int(t_missing * freq) + 1
-
-    volt0_loop = np.hstack([volt0, np.ones(nbpoint_to_add) * volt0[-1]])
-
-    volt1_loop = np.hstack([volt1, np.ones(nbpoint_to_add) * volt1[-1]])
+    volt = wave.generate()
+    t = wave.get_times()
+    # start of the second saw tooth
+    time_between_frames = wave.get_edge_times(0)[nb_levels + 1]
 
-    volt = np.vstack([volt0_loop, volt1_loop])
-
-    pylab.figure()
-    t = np.arange(0, time_between_pairs, 1 / freq)[0 : volt0_loop.size]
-    # t = np.linspace(0, (N+1)/freq, 2 * N+1)[0:volt0.size]
-    pylab.plot(t, volt0_loop, "+")
-    pylab.plot(t, volt[1], "r+")
-    pylab.step(t, volt[0], "b-", where="post")
-    pylab.step(t, volt[1], "r-", where="post")
-    # for i in range(int(t.size / 2 - 1)):
-    #    pylab.plot(
-    #        t[i * 2 : i * 2 + 3],
-    #        np.hstack([volt[0][i * 2 : i * 2 + 2], volt[0][i * 2 + 1]]),
-    #        "b-",
-    #    )
-    #    pylab.plot(
-    #        t[i * 2 : i * 2 + 2],
-    #        np.hstack([volt[1][i * 2 : i * 2 + 1], volt[1][i * 2]]),
-    #        "r-",
-    #    )
-    pylab.ylim([-1, 6])
-    pylab.xlabel("t (s)")
-    pylab.ylabel("voltage (V)")
-    time_between_frames = t[np.argwhere(volt0_loop == vmin)].squeeze()[2]
+    _plot_signals(t, volt)
     pylab.plot(time_between_frames * np.ones(2), [0, 5], "k")
     pylab.show()
     print(f"time_between_frames is set to {time_between_frames}s")
-    return volt, freq, time_between_frames, t
+    return volt, wave.scan_rate, time_between_frames, t
 
 
 def test_multilevel(T):
@@ -688,4 +658,4 @@ def test_multilevel(T):
 def test_multilevel2():
     volt = np.arange(5)
     t = volt * 1
-    multilevel_piv(t[1] - t[0], volt, outputname="DAC0")
+    multilevel_piv(t[1] - t[0], volt)
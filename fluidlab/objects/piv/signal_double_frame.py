@@ -1,13 +1,13 @@
 from __future__ import print_function
 
-from math import ceil
 import numpy as np
 
+from .waveforms import Waveform, Pulse
+
 
 def make_signal_double_frame(
     time_between_pairs, time_expo, delta_t, nb_nodes=256
 ):
-
     """
 
     Computes the signal to trigger out the cameras for a PIV double frame 2d
@@ -23,8 +23,8 @@ def make_signal_double_frame(
     delta_t : float
     Time between the two frames in s.
 
-    n : int
-    Number of time nodes
+    nb_nodes : int
+    Maximum number of time nodes
 
     Returns
     -------
@@ -47,43 +47,24 @@ def make_signal_double_frame(
     """
     assert nb_nodes > 8
 
-    # Compute time interval
-    time_between_nodes = (time_expo + delta_t) / (nb_nodes - 1)
-
     # Check potential errors
     if delta_t - time_expo < 0:
         raise ValueError(
             "No double frame possible. \n" "Choose lower exposure time"
         )
 
-    n_e = int(ceil(time_expo / time_between_nodes))
-    time_expo = n_e * time_between_nodes
-
-    # Check if n_d (number of nodes delta_t - time_expo) is an integer
-    t_0 = delta_t - time_expo
-    n_d = int(ceil(t_0 / time_between_nodes))
-    t_0 = n_d * time_between_nodes
-
-    delta_t = t_0 + time_expo
-
-    # Arrays
-    times = time_between_nodes * np.arange(nb_nodes)
-    volts = np.zeros_like(times)
-
-    # Trigger on. Frame 1
-    cond = times < time_expo
-    volts[cond] = 5.0
-
-    # Trigger off.
-    cond = (times >= time_expo) & (times < delta_t)
-    volts[cond] = 0.0
-
-    # Trigger on. Frame 2
-    cond = (times >= delta_t) & (times < delta_t + time_expo)
-    volts[cond] = 5.0
-
-    # Trigger off
-    volts[-1] = 0.0
+    # the edges are rounded jointly to the sample clock (at most nb_nodes
+    # samples, the signal ends low)
+    wave = Waveform(
+        [[Pulse(delta_t, time_expo), Pulse(2 * time_expo, time_expo)]],
+        max_nb_samples=nb_nodes,
+    )
+    volts = np.array(wave.generate()[0])
+    times = wave.get_times()
+    edges = wave.get_edge_times()
+    time_expo = edges[1]
+    delta_t = edges[2]
+    time_between_nodes = 1.0 / wave.scan_rate
 
     return times, volts, time_expo, delta_t, time_between_nodes
 
@@ -0,0 +1,53 @@
+import os
+import threading
+from tempfile import TemporaryDirectory
+
+import pytest
+
+from fluidlab.objects.piv import util
+from fluidlab.objects.piv.util import wait_for_new_file, read_period
+
+
+def _create_later(path, text="", delay=0.05):
+    def create():
+        with open(path, "w") as file:
+            file.write(text)
+
+    timer = threading.Timer(delay, create)
+    timer.start()
+    return timer
+
+
+@pytest.mark.parametrize("inotify", [True, False])
+def test_wait_for_new_file(inotify, monkeypatch):
+    if not inotify:
+
+        def raise_oserror():
+            raise OSError
+
+        monkeypatch.setattr(util, "_load_libc", raise_oserror)
+
+    with TemporaryDirectory() as tmpdir:
+        # files existing before the call are not new
+        open(os.path.join(tmpdir, "oscillate_0.txt"), "w").close()
+        pattern = os.path.join(tmpdir, "oscillate_*")
+
+        with pytest.raises(TimeoutError):
+            wait_for_new_file(pattern, timeout=0.1, poll_period=0.01)
+
+        timer = _create_later(os.path.join(tmpdir, "other.txt"))
+        timer2 = _create_later(os.path.join(tmpdir, "oscillate_1.txt"), delay=0.1)
+        path = wait_for_new_file(pattern, timeout=5, poll_period=0.01)
+        timer.join()
+        timer2.join()
+        assert path == os.path.join(tmpdir, "oscillate_1.txt")
+
+
+def test_read_period():
+    with TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "oscillate_0.txt")
+        lines = [f"{i} 0.5 period = 2.5" for i in range(10000)]
+        with open(path, "w") as file:
+            file.write("\n".join(lines) + "\n")
+        assert read_period(path) == 2.5
+        assert len(util.read_tail(path, 100)) == 100
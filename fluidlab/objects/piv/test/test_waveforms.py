@@ -0,0 +1,122 @@
+import os
+from collections import OrderedDict
+from tempfile import TemporaryDirectory
+
+import numpy as np
+import pytest
+
+from fluidlab.objects.piv import waveforms
+from fluidlab.objects.piv.waveforms import (
+    Waveform,
+    Ramp,
+    Hold,
+    Pulse,
+    Gap,
+    make_double_frame_trigger,
+    make_saw_tooth_scan,
+)
+from fluidlab.objects.piv.signal_double_frame import make_signal_double_frame
+
+
+@pytest.fixture(autouse=True)
+def tmp_cache(monkeypatch):
+    with TemporaryDirectory() as path:
+        monkeypatch.setattr(waveforms, "path_cache", path)
+        monkeypatch.setattr(waveforms, "_cache", OrderedDict())
+        yield path
+
+
+def test_segments():
+    wave = Waveform(
+        [
+            [Ramp(0, 4, 4.0, nb_steps=5), Gap(1.0)],
+            [Pulse(4.0, 0.4, nb_pulses=5, high=1.0), Hold(2.0, 1.0)],
+        ],
+        max_scan_rate=10,
+    )
+    volt = wave.generate(use_cache=False)
+    assert wave.scan_rate == 5
+    assert wave.error < 1e-12
+    assert volt.shape == (2, 25)
+    assert np.allclose(volt[0], np.repeat([0, 1, 2, 3, 4, 4], [4] * 5 + [5]))
+    assert np.allclose(volt[1, :20], np.tile([1, 1, 0, 0], 5))
+    assert np.allclose(volt[1, 20:], 2)
+    assert np.allclose(wave.get_times()[:3], [0, 0.2, 0.4])
+
+
+def test_rtol_and_constraints():
+    wave = make_double_frame_trigger(0.003, 0.01, 0.1, rtol=0.01)
+    volt = wave.generate()
+    # smallest clock resolving the 3 ms pulses
+    assert wave.scan_rate == 1000
+    assert volt.shape == (1, 100)
+    assert np.nonzero(np.diff(volt[0]))[0].tolist() == [2, 9, 12]
+
+    with pytest.raises(ValueError):
+        make_double_frame_trigger(0.003, 0.01, 0.1, max_nb_samples=10).solve()
+
+    with pytest.raises(ValueError):
+        Waveform([[Hold(0, 1.0)], [Hold(0, 2.0)]])
+
+
+def test_double_frame_signal():
+    times, volts, time_expo, delta_t, dt = make_signal_double_frame(
+        5.0, 0.0013, 0.0171, nb_nodes=256
+    )
+    assert times.size == volts.size <= 256
+    assert np.isclose(time_expo, 0.0013) and np.isclose(delta_t, 0.0171)
+    assert volts[0] == volts[round(delta_t / dt)] == 5.0
+    assert volts[-1] == 0.0
+
+    wave = make_double_frame_trigger(0.003, 0.01, 0.1)
+    assert np.allclose(wave.get_edge_times()[:3], [0, 0.003, 0.01])
+
+
+def test_edges_aligned():
+    wave = make_saw_tooth_scan(
+        0, 5, 0.0013, 7, 0.021, nb_scans=2, time_period=0.1, max_nb_samples=400
+    )
+    volt = wave.generate()
+    assert volt.shape[1] <= 400
+    # the trigger pulses start with the levels of the staircase
+    rises = np.nonzero(np.diff(volt[1]) > 0)[0] + 1
+    assert rises.size == 2 * 7 - 1
+    assert np.all(np.diff(volt[0])[rises - 1] != 0)
+
+
+def test_cache(tmp_cache):
+    wave = make_saw_tooth_scan(0, 5, 0.001, 10, 0.02)
+    volt = wave.generate()
+    assert not volt.flags.writeable
+    assert os.listdir(tmp_cache) == [wave.key + ".npz"]
+
+    # from the memory cache
+    wave2 = make_saw_tooth_scan(0, 5, 0.001, 10, 0.02)
+    assert wave2.generate() is volt
+    assert wave2.scan_rate == wave.scan_rate
+
+    # from the disk cache
+    waveforms._cache.clear()
+    wave3 = make_saw_tooth_scan(0, 5, 0.001, 10, 0.02)
+    assert np.array_equal(wave3.generate(), volt)
+    assert wave3.nb_samples == wave.nb_samples
+
+    assert make_saw_tooth_scan(0, 4, 0.001, 10, 0.02).key != wave.key
+
+
+def test_cache_size(monkeypatch):
+    monkeypatch.setattr(waveforms, "path_cache", None)
+    monkeypatch.setattr(waveforms, "cache_size", 2)
+    waves = [make_saw_tooth_scan(0, vmax, 0.001, 10, 0.02) for vmax in (3, 4, 5)]
+    volt0 = waves[0].generate()
+    waves[1].generate()
+    # waves[0] becomes the most recently used
+    assert waves[0].generate() is volt0
+    waves[2].generate()
+    assert list(waveforms._cache) == [waves[0].key, waves[2].key]
+
+
+def test_no_disk_cache_by_default(monkeypatch, tmp_cache):
+    monkeypatch.setattr(waveforms, "path_cache", None)
+    make_saw_tooth_scan(0, 5, 0.001, 10, 0.02).generate()
+    assert os.listdir(tmp_cache) == []
@@ -1,25 +1,192 @@
 import time
 import os
+import sys
+import select
+import struct
+import ctypes
+import ctypes.util
 from glob import glob
+from fnmatch import fnmatch
 
 import h5py
 
 from fluiddyn.util import time_as_str
 
+from fluidlab.exp.catalogue import register_run
+
 serial_numbers = {"horiz": 470012356, "vert": 470012767}
 
 path_save = os.path.join(os.path.expanduser("~"), ".fluidcoriolis")
 
 
-def is_new_file(str_name):
-    str_name = os.path.expanduser(str_name)
-    files_start = glob(str_name)
+# inotify events (see inotify(7))
+IN_CREATE = 0x00000100
+IN_MOVED_TO = 0x00000080
+_event_header = struct.Struct("iIII")
+
+
+def _load_libc():
+    if not sys.platform.startswith("linux"):
+        raise OSError("inotify is only available on Linux")
+    libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    # raise AttributeError if inotify is not supported
+    libc.inotify_init1
+    libc.inotify_add_watch
+    return libc
+
+
+class _InotifyWatcher:
+    """Watch the files created in (or moved to) a directory."""
+
+    def __init__(self, directory):
+        libc = _load_libc()
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        watch = libc.inotify_add_watch(
+            fd, os.fsencode(directory), IN_CREATE | IN_MOVED_TO
+        )
+        if watch < 0:
+            errno = ctypes.get_errno()
+            os.close(fd)
+            raise OSError(errno, os.strerror(errno), directory)
+        self.fd = fd
+
+    def read_names(self, timeout=None):
+        """Names of the new files (empty list after timeout)."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        names = []
+        offset = 0
+        while offset < len(data):
+            _, _, _, length = _event_header.unpack_from(data, offset)
+            offset += _event_header.size
+            name = data[offset : offset + length].rstrip(b"\0")
+            offset += length
+            names.append(os.fsdecode(name))
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+
+def _wait_new_file_polling(pattern, time_end, poll_period):
+    files_start = set(glob(pattern))
     while True:
-        files = glob(str_name)
-        if len(files) > len(files_start):
-            return max(files, key=os.path.getctime)
+        files_new = set(glob(pattern)) - files_start
+        if files_new:
+            return max(files_new, key=os.path.getctime)
+        if time_end is not None:
+            time_remaining = time_end - time.monotonic()
+            if time_remaining <= 0:
+                return None
+            time.sleep(min(poll_period, time_remaining))
+        else:
+            time.sleep(poll_period)
+
+
+def wait_for_new_file(pattern, timeout=None, poll_period=0.1):
+    """Wait until a file matching `pattern` is created and return its path.
+
+    On Linux, the directory is watched with inotify, so the function
+    returns as soon as the file is created without listing the
+    directory. Otherwise (or if the directory contains wildcards), the
+    directory is listed every `poll_period` s.
+
+    Parameters
+    ----------
+
+    pattern : str
+
+      Glob pattern of the file name (e.g. "~/dir/oscillate_*").
+
+    timeout : {None, float}
+
+      Maximum time to wait (in s).
 
-        time.sleep(0.1)
+    poll_period : float
+
+      Period used for the polling fallback (in s).
+
+    Raises
+    ------
+
+    TimeoutError
+
+    """
+    pattern = os.path.expanduser(pattern)
+    directory, name_pattern = os.path.split(pattern)
+    directory = directory or os.curdir
+    time_end = None if timeout is None else time.monotonic() + timeout
+
+    watcher = None
+    if not any(char in directory for char in "*?["):
+        try:
+            watcher = _InotifyWatcher(directory)
+        except (OSError, AttributeError):
+            pass
+
+    if watcher is None:
+        path = _wait_new_file_polling(pattern, time_end, poll_period)
+    else:
+        path = None
+        try:
+            while path is None:
+                if time_end is None:
+                    time_remaining = None
+                else:
+                    time_remaining = time_end - time.monotonic()
+                    if time_remaining <= 0:
+                        break
+                for name in watcher.read_names(time_remaining):
+                    if fnmatch(name, name_pattern):
+                        path = os.path.join(directory, name)
+                        break
+        finally:
+            watcher.close()
+
+    if path is None:
+        raise TimeoutError(f"No new file {pattern} after {timeout} s")
+    return path
+
+
+def is_new_file(str_name):
+    return wait_for_new_file(str_name)
+
+
+def read_tail(path, nb_bytes=4096):
+    """Read (at most) the last `nb_bytes` bytes of a text file."""
+    with open(path, "rb") as file:
+        file.seek(0, os.SEEK_END)
+        size = file.tell()
+        file.seek(max(0, size - nb_bytes))
+        return file.read().decode(errors="replace")
+
+
+def read_period(path, timeout=10.0):
+    """Read the period at the end of the last line of an oscillation file.
+
+    The file can have just been created, so its tail is read again until
+    it contains a complete line.
+
+    """
+    time_end = time.monotonic() + timeout
+    while True:
+        lines = read_tail(path).split("\n")
+        if len(lines) >= 2:
+            try:
+                return float(lines[-2].split(" ")[-1])
+            except ValueError:
+                pass
+        if time.monotonic() > time_end:
+            raise ValueError(f"No period found at the end of {path}")
+        time.sleep(0.01)
 
 
 def wait_for_file(str_file, nb_period_to_wait):
@@ -27,19 +194,16 @@ def wait_for_file(str_file, nb_period_to_wait):
     str_file = os.path.join(path_save, str_file)
 
     print("Waiting for a new file:\n" + str_file)
-    path = is_new_file(str_file)
+    path = wait_for_new_file(str_file)
+    period = read_period(path)
 
-    with open(path, "r") as f:
-        txt = f.read()
-        period = float(txt.split("\n")[-2].split(" ")[-1])
-
-        if nb_period_to_wait != 0:
-            print(
-                "Waiting {:.2f} period(s) (= {:.2f} s)".format(
-                    float(nb_period_to_wait), nb_period_to_wait * period
-                )
+    if nb_period_to_wait != 0:
+        print(
+            "Waiting {:.2f} period(s) (= {:.2f} s)".format(
+                float(nb_period_to_wait), nb_period_to_wait * period
             )
-            time.sleep(nb_period_to_wait * period)
+        )
+        time.sleep(nb_period_to_wait * period)
 
 
 def save_exp(
@@ -66,3 +230,12 @@ def save_exp(
             f["tup"] = tup
         if time_expo:
             f["time_expo"] = time_expo
+
+    register_run(
+        path,
+        rootname,
+        time_between_frames=time_between_frames,
+        time_expo=time_expo,
+        tup=tup,
+        time_between_pairs=time_between_pairs,
+    )
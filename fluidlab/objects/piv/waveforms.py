@@ -0,0 +1,599 @@
+"""Waveforms for PIV (:mod:`fluidlab.objects.piv.waveforms`)
+==========================================================
+
+Signals sent with the stream-out of the T7 (galvanometer angle, camera
+trigger, ...) described as sequences of segments (:class:`Ramp`,
+:class:`Hold`, :class:`Pulse` and :class:`Gap`), one sequence per
+channel.
+
+A :class:`Waveform` solves for the scan rate and the numbers of samples
+that best match the requested durations and generates the signals. The
+times of all the edges (steps of the ramps, high and low parts of the
+pulses, boundaries of the segments) are rounded jointly to the sample
+clock, so that edges of different channels requested at the same time
+stay aligned.
+
+The generated signals are cached in memory with a hash of the
+parameters, so that preparing the same acquisition again does not
+recompute them (at most `cache_size` signals, the least recently used
+are dropped). They are also cached on disk if the module attribute
+`path_cache` is set to a directory (None by default).
+
+.. autoclass:: Waveform
+   :members:
+
+.. autoclass:: Ramp
+
+.. autoclass:: Hold
+
+.. autoclass:: Pulse
+
+.. autoclass:: Gap
+
+.. autofunction:: make_double_frame_trigger
+
+.. autofunction:: make_saw_tooth_scan
+
+"""
+
+import os
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+
+# maximum stream rate of the T7 (samples/s, all channels)
+MAX_STREAM_RATE_T7 = 100000
+
+# directory of the disk cache (None: no disk cache)
+path_cache = None
+
+# maximum number of signals in the memory cache
+cache_size = 32
+
+_cache = OrderedDict()
+
+
+def _cache_get(key):
+    result = _cache.get(key)
+    if result is not None:
+        _cache.move_to_end(key)
+    return result
+
+
+def _cache_set(key, result):
+    _cache[key] = result
+    _cache.move_to_end(key)
+    while len(_cache) > cache_size:
+        _cache.popitem(last=False)
+
+
+class Segment:
+    """Base class of the segments."""
+
+    def __init__(self, duration):
+        if duration <= 0:
+            raise ValueError("duration has to be positive.")
+        self.duration = float(duration)
+
+    def _params(self):
+        return (self.duration,)
+
+    def __repr__(self):
+        return "{}{}".format(type(self).__name__, self._params())
+
+    def _atoms(self):
+        """Durations of the parts of the segment (each has >= 1 sample)."""
+        return [self.duration]
+
+    def _render(self, counts, previous):
+        """Values of the segment from the numbers of samples of the atoms."""
+        raise NotImplementedError
+
+
+class Hold(Segment):
+    """Constant value.
+
+    Parameters
+    ----------
+
+    value : float
+
+    duration : float
+
+    """
+
+    def __init__(self, value, duration):
+        super().__init__(duration)
+        self.value = float(value)
+
+    def _params(self):
+        return (self.value, self.duration)
+
+    def _render(self, counts, previous):
+        return np.full(counts[0], self.value)
+
+
+class Gap(Segment):
+    """Keep the last value of the channel (0 at the start of a channel).
+
+    Parameters
+    ----------
+
+    duration : float
+
+    """
+
+    def _render(self, counts, previous):
+        return np.full(counts[0], previous)
+
+
+class Ramp(Segment):
+    """Linear ramp or staircase.
+
+    Parameters
+    ----------
+
+    v_start, v_stop : float
+
+    duration : float
+
+    nb_steps : {None, int}
+
+      If None, the ramp is linear (one value per sample, `v_stop`
+      excluded so that consecutive ramps are continuous). Otherwise, the
+      signal is a staircase of `nb_steps` levels of equal duration from
+      `v_start` to `v_stop` (both included).
+
+    """
+
+    def __init__(self, v_start, v_stop, duration, nb_steps=None):
+        super().__init__(duration)
+        if nb_steps is not None and nb_steps < 1:
+            raise ValueError("nb_steps has to be a positive integer.")
+        self.v_start = float(v_start)
+        self.v_stop = float(v_stop)
+        self.nb_steps = nb_steps
+
+    def _params(self):
+        return (self.v_start, self.v_stop, self.duration, self.nb_steps)
+
+    def _atoms(self):
+        if self.nb_steps is None:
+            return [self.duration]
+        return [self.duration / self.nb_steps] * self.nb_steps
+
+    def _render(self, counts, previous):
+        if self.nb_steps is None:
+            nb_samples = counts[0]
+            return self.v_start + (self.v_stop - self.v_start) * (
+                np.arange(nb_samples) / nb_samples
+            )
+        levels = np.linspace(self.v_start, self.v_stop, self.nb_steps)
+        return np.repeat(levels, counts)
+
+
+class Pulse(Segment):
+    """Train of rectangular pulses (e.g. to trig a camera).
+
+    Parameters
+    ----------
+
+    duration : float
+
+      Total duration (`nb_pulses` periods).
+
+    width : float
+
+      Duration of the high part of each pulse.
+
+    nb_pulses : int
+
+    high, low : float
+
+    """
+
+    def __init__(self, duration, width, nb_pulses=1, high=5.0, low=0.0):
+        super().__init__(duration)
+        if nb_pulses < 1:
+            raise ValueError("nb_pulses has to be a positive integer.")
+        if not 0 < width < duration / nb_pulses:
+            raise ValueError(
+                "width has to be positive and smaller than the pulse period."
+            )
+        self.width = float(width)
+        self.nb_pulses = int(nb_pulses)
+        self.high = float(high)
+        self.low = float(low)
+
+    def _params(self):
+        return (self.duration, self.width, self.nb_pulses, self.high, self.low)
+
+    def _atoms(self):
+        period = self.duration / self.nb_pulses
+        return [self.width, period - self.width] * self.nb_pulses
+
+    def _render(self, counts, previous):
+        values = np.tile([self.high, self.low], self.nb_pulses)
+        return np.repeat(values, counts)
+
+
+class Waveform:
+    """Multichannel signal made of segments, quantized on a sample clock.
+
+    Parameters
+    ----------
+
+    channels : sequence
+
+      One sequence of segments per channel. The channels have to have
+      the same total duration.
+
+    max_scan_rate : {None, float}
+
+      Maximum scan rate (scans/s). The default is the maximum stream
+      rate of the T7 divided by the number of channels.
+
+    max_nb_samples : {None, int}
+
+      Maximum number of samples per channel (e.g. to keep the whole
+      signal in the stream-out buffer).
+
+    rtol : {None, float}
+
+      If None, the solution with the smallest timing error is chosen.
+      Otherwise, the solution with the smallest number of samples whose
+      relative errors on all durations are smaller than `rtol`.
+
+    Notes
+    -----
+
+    After :func:`solve` (called by :func:`generate`), the attributes
+    `scan_rate`, `nb_samples`, `error` (maximum relative error on the
+    durations) and `duration` (actual duration) are set.
+
+    """
+
+    def __init__(
+        self, channels, max_scan_rate=None, max_nb_samples=None, rtol=None
+    ):
+        self.channels = [list(segments) for segments in channels]
+        if not self.channels or not all(self.channels):
+            raise ValueError("Each channel has to contain segments.")
+
+        if max_scan_rate is None:
+            max_scan_rate = MAX_STREAM_RATE_T7 / len(self.channels)
+        self.max_scan_rate = float(max_scan_rate)
+        self.max_nb_samples = max_nb_samples
+        self.rtol = rtol
+
+        self._atoms = [
+            np.array([atom for seg in segments for atom in seg._atoms()])
+            for segments in self.channels
+        ]
+        durations = [atoms.sum() for atoms in self._atoms]
+        if not np.allclose(durations, durations[0], rtol=1e-9, atol=0):
+            raise ValueError(
+                f"The channels have different durations ({durations})."
+            )
+        self.requested_duration = durations[0]
+
+        self.scan_rate = None
+        self.nb_samples = None
+        self.error = None
+        self.duration = None
+        self._counts = None
+
+    @property
+    def nb_channels(self):
+        return len(self.channels)
+
+    @property
+    def key(self):
+        """Hash of the parameters (used for the cache)."""
+        description = repr(
+            (
+                self.channels,
+                self.max_scan_rate,
+                self.max_nb_samples,
+                self.rtol,
+            )
+        )
+        return hashlib.sha1(description.encode()).hexdigest()
+
+    def _candidates(self):
+        """Sample periods making one of the atoms an integer number of samples."""
+        atoms = np.unique(np.concatenate(self._atoms))
+        total = self.requested_duration
+        periods = []
+        for atom in atoms:
+            k_max = atom * self.max_scan_rate
+            if self.max_nb_samples is not None:
+                k_max = min(k_max, self.max_nb_samples * atom / total)
+            # tolerance for atoms exactly multiple of the minimum period
+            k_max = int(np.floor(k_max * (1 + 1e-9)))
+            if k_max >= 1:
+                periods.append(atom / np.arange(1, k_max + 1))
+        if not periods:
+            return np.empty(0)
+        return np.unique(np.concatenate(periods))
+
+    def solve(self, chunk_size=2048):
+        """Compute the scan rate and the numbers of samples."""
+        periods = self._candidates()
+
+        edges = np.concatenate(
+            [np.concatenate(([0.0], np.cumsum(atoms))) for atoms in self._atoms]
+        )
+        atoms = np.concatenate(self._atoms)
+        # drop the differences between the last edge of a channel and the
+        # first edge of the next one
+        mask = np.ones(edges.size - 1, dtype=bool)
+        mask[np.cumsum([a.size + 1 for a in self._atoms])[:-1] - 1] = False
+        index_end = self._atoms[0].size
+
+        errors = []
+        nbs_samples = []
+        for start in range(0, periods.size, chunk_size):
+            dts = periods[start : start + chunk_size, np.newaxis]
+            counts = np.diff(np.rint(edges / dts), axis=1)[:, mask]
+            errors_chunk = (abs(counts * dts - atoms) / atoms).max(axis=1)
+            errors_chunk[(counts < 1).any(axis=1)] = np.inf
+            errors.append(errors_chunk)
+            nbs_samples.append(np.rint(edges[index_end] / dts[:, 0]))
+
+        if periods.size:
+            errors = np.concatenate(errors)
+            nbs_samples = np.concatenate(nbs_samples)
+        else:
+            errors = nbs_samples = np.empty(0)
+
+        valid = np.isfinite(errors)
+        if self.max_nb_samples is not None:
+            valid &= nbs_samples <= self.max_nb_samples
+        if self.rtol is not None:
+            valid &= errors <= self.rtol
+
+        if not valid.any():
+            raise ValueError(
+                "No sample clock satisfies the constraints "
+                "(max_scan_rate, max_nb_samples, rtol)."
+            )
+
+        indices = np.nonzero(valid)[0]
+        errors_rounded = np.round(errors[indices], 9)
+        if self.rtol is None:
+            order = np.lexsort((nbs_samples[indices], errors_rounded))
+        else:
+            order = np.lexsort((errors_rounded, nbs_samples[indices]))
+        index = indices[order[0]]
+
+        dt = periods[index]
+        self.scan_rate = 1.0 / dt
+        self.nb_samples = int(nbs_samples[index])
+        self.error = float(errors[index])
+        self.duration = self.nb_samples * dt
+
+        self._counts = []
+        for atoms_chan in self._atoms:
+            edges_chan = np.concatenate(([0.0], np.cumsum(atoms_chan)))
+            self._counts.append(np.diff(np.rint(edges_chan / dt)).astype(int))
+
+    def _render(self):
+        volt = np.empty((self.nb_channels, self.nb_samples))
+        for ichan, segments in enumerate(self.channels):
+            counts_chan = self._counts[ichan]
+            index_atom = 0
+            index_sample = 0
+            previous = 0.0
+            for segment in segments:
+                nb_atoms = len(segment._atoms())
+                counts = counts_chan[index_atom : index_atom + nb_atoms]
+                values = segment._render(counts, previous)
+                stop = index_sample + values.size
+                volt[ichan, index_sample:stop] = values
+                index_atom += nb_atoms
+                index_sample = stop
+                previous = values[-1]
+        return volt
+
+    def _set_solution(self, scan_rate, nb_samples, error):
+        self.scan_rate = scan_rate
+        self.nb_samples = nb_samples
+        self.error = error
+        self.duration = nb_samples / scan_rate
+
+    def _load(self, key):
+        if path_cache is None:
+            return None
+        path = os.path.join(path_cache, key + ".npz")
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as data:
+                volt = data["volt"]
+                solution = (
+                    float(data["scan_rate"]),
+                    int(data["nb_samples"]),
+                    float(data["error"]),
+                )
+        except (OSError, KeyError, ValueError):
+            return None
+        volt.flags.writeable = False
+        return volt, solution
+
+    def _save(self, key, volt):
+        if path_cache is None:
+            return
+        path = os.path.join(path_cache, key + ".npz")
+        path_tmp = path + f".{os.getpid()}.tmp"
+        try:
+            os.makedirs(path_cache, exist_ok=True)
+            with open(path_tmp, "wb") as file:
+                np.savez(
+                    file,
+                    volt=volt,
+                    scan_rate=self.scan_rate,
+                    nb_samples=self.nb_samples,
+                    error=self.error,
+                )
+            os.replace(path_tmp, path)
+        except OSError:
+            # the cache is only an optimization
+            pass
+
+    def generate(self, use_cache=True):
+        """Return the signals (read-only array (nb_channels, nb_samples)).
+
+        Parameters
+        ----------
+
+        use_cache : bool
+
+          If True, the result is taken from (and stored in) the memory
+          cache (and the disk cache if `path_cache` is set).
+
+        """
+        key = self.key
+        if use_cache:
+            result = _cache_get(key)
+            if result is None:
+                result = self._load(key)
+            if result is not None:
+                volt, solution = result
+                _cache_set(key, result)
+                self._set_solution(*solution)
+                return volt
+
+        self.solve()
+        volt = self._render()
+        volt.flags.writeable = False
+
+        if use_cache:
+            solution = (self.scan_rate, self.nb_samples, self.error)
+            _cache_set(key, (volt, solution))
+            self._save(key, volt)
+
+        return volt
+
+    def get_times(self):
+        """Times of the samples (after :func:`solve`)."""
+        if self.scan_rate is None:
+            self.solve()
+        return np.arange(self.nb_samples) / self.scan_rate
+
+    def get_edge_times(self, ichannel=0):
+        """Actual times of the edges of a channel.
+
+        The edges are the boundaries of the parts of the segments
+        (steps of the ramps, high and low parts of the pulses), from 0
+        to the duration.
+
+        """
+        if self._counts is None:
+            self.solve()
+        counts = self._counts[ichannel]
+        return np.concatenate(([0], np.cumsum(counts))) / self.scan_rate
+
+
+def make_double_frame_trigger(
+    time_expo, time_between_frames, time_between_pairs, high=5.0, **kwargs
+):
+    """Trigger signal for double frame PIV (one channel).
+
+    Two pulses of duration `time_expo` separated by `time_between_frames`
+    and then low until `time_between_pairs`. The keyword arguments are
+    passed to :class:`Waveform`.
+
+    """
+    if time_expo >= time_between_frames:
+        raise ValueError("time_expo has to be smaller than time_between_frames")
+    if time_between_pairs <= 2 * time_between_frames:
+        raise ValueError("time_between_pairs <= 2 * time_between_frames")
+
+    trigger = [
+        Pulse(time_between_frames, time_expo, high=high),
+        Pulse(time_between_pairs - time_between_frames, time_expo, high=high),
+    ]
+    return Waveform([trigger], **kwargs)
+
+
+def make_saw_tooth_scan(
+    vmin,
+    vmax,
+    time_expo,
+    nb_levels,
+    time_between_frames,
+    nb_scans=1,
+    time_period=None,
+    high=5.0,
+    **kwargs,
+):
+    """Galvanometer (saw tooth) and camera trigger signals for scanning PIV.
+
+    For each scan, the galvanometer signal is a staircase of `nb_levels`
+    levels of duration `time_expo` from `vmin` to `vmax`, followed by a
+    linear ramp back to `vmin` until `time_between_frames`. The trigger
+    signal has one pulse (duration `time_expo / 2`) per level.
+
+    Parameters
+    ----------
+
+    vmin, vmax : float
+
+    time_expo : float
+
+    nb_levels : int
+
+    time_between_frames : float
+
+      Time between the starts of 2 scans.
+
+    nb_scans : int
+
+      Number of scans in a period (2 for double frame).
+
+    time_period : {None, float}
+
+      Duration of the period (the galvanometer stays at `vmin` after the
+      scans).
+
+    high : float
+
+      High level of the trigger.
+
+    The other keyword arguments are passed to :class:`Waveform`.
+
+    """
+    time_up = nb_levels * time_expo
+    time_down = time_between_frames - time_up
+    if time_down <= 0:
+        raise ValueError(
+            "nb_levels * time_expo has to be smaller than time_between_frames"
+        )
+
+    galva = []
+    trigger = []
+    for _ in range(nb_scans):
+        galva.extend(
+            [
+                Ramp(vmin, vmax, time_up, nb_steps=nb_levels),
+                Ramp(vmax, vmin, time_down),
+            ]
+        )
+        trigger.extend(
+            [
+                Pulse(time_up, time_expo / 2, nb_pulses=nb_levels, high=high),
+                Hold(0.0, time_down),
+            ]
+        )
+
+    if time_period is not None:
+        time_rest = time_period - nb_scans * time_between_frames
+        if time_rest < -1e-12 * time_period:
+            raise ValueError("time_period < nb_scans * time_between_frames")
+        if time_rest > 1e-12 * time_period:
+            galva.append(Hold(vmin, time_rest))
+            trigger.append(Hold(0.0, time_rest))
+
+    return Waveform([galva, trigger], **kwargs)
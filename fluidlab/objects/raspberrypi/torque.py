@@ -34,6 +34,7 @@ from fluiddyn.io.hdf5 import H5File
 import fluiddyn.output.figs as figs
 
 from fluidlab.objects.boards import FalseBoard
+from fluidlab.exp.catalogue import register_run
 
 if hostname in hostnames_measuring:
     try:
@@ -172,8 +173,9 @@ class TorqueRaspberryPi(Torque):
 
             path_file = self.path_save + "/torque_" + time_as_str() + ".h5"
 
+            time_start = datetime.datetime.now()
             with H5File(path_file, "w") as f:
-                f.attrs["time start"] = str(datetime.datetime.now())
+                f.attrs["time start"] = str(time_start)
                 f.attrs["name_dir"] = self.name_exp
                 f.attrs["sample_rate"] = sample_rate
 
@@ -190,6 +192,14 @@ class TorqueRaspberryPi(Torque):
             dicttosave = {"volts": results}
             with H5File(path_file, "r+") as f:
                 f.save_dict_of_ndarrays(dicttosave)
+            register_run(
+                path_file,
+                "torque",
+                time_start,
+                sample_rate=sample_rate,
+                duration=duration,
+                name_exp=self.name_exp,
+            )
 
         return results
 